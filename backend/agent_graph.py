@@ -1,17 +1,22 @@
 import os
-import json
-from typing import List, TypedDict, Annotated, Dict, Any
+from typing import List, TypedDict, Annotated, Dict, Optional, Tuple
 import operator
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+import time
+import asyncio
+import contextvars
+from contextlib import nullcontext
 from langgraph.graph import StateGraph, END
+from langgraph.types import Send
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
-from groq import Groq
-import warnings
+from llm_provider import acomplete, parse_json_content
+from retrieval import build_context
+from chunker import get_chunks, get_chunk_spans, chunk_token_budget
+from response_cache import RESPONSE_CACHE, make_cache_key, text_digest
+from singleflight import SingleFlight
+from jobs import report_progress
+from tracing import span
+from shared_state import GENERATION_LOCKS
 
 # Load env
 from pathlib import Path
@@ -19,60 +24,20 @@ env_path = Path(__file__).parent.parent / ".env"
 load_dotenv(dotenv_path=env_path)
 
 # --- LLM SETUP ---
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+# All generation and streaming goes through the async provider layer
+# (llm_provider.py), whose router picks the provider per request, so an
+# in-flight LLM call never pins a worker thread.
 AI_MODEL = os.getenv("AI_MODEL", "llama-3.3-70b-versatile")
 
-# 1. Prepare OpenRouter LLM
-openrouter_llm = None
-if OPENROUTER_API_KEY:
-    openrouter_llm = ChatOpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=OPENROUTER_API_KEY,
-        model=AI_MODEL, 
-        max_retries=2,
-        default_headers={
-            "HTTP-Referer": "http://localhost:5173",
-            "X-Title": "FlashDeck"
-        }
-    )
+# Max chunks in flight per card-generation request. Provider-wide limits
+# live in llm_provider.PROVIDER_MAX_CONCURRENCY.
+CARD_GEN_MAX_WORKERS = int(os.getenv("CARD_GEN_MAX_WORKERS", "8"))
 
-# 2. Prepare Groq LLM
-groq_llm = None
-if GROQ_API_KEY:
-    target_groq_model = AI_MODEL if ("llama" in AI_MODEL.lower() or "mixtral" in AI_MODEL.lower() or "gemma" in AI_MODEL.lower()) else "llama-3.3-70b-versatile"
-    print(f"--- AI Config: Groq Initialized with model {target_groq_model} ---")
-    groq_llm = ChatGroq(
-        model=target_groq_model,
-        groq_api_key=GROQ_API_KEY,
-        temperature=0.3,
-        max_retries=2
-    )
-
-# 3. Direct Groq Client (For high-speed, low-overhead generation)
-direct_groq_client = None
-if GROQ_API_KEY:
-    try:
-        direct_groq_client = Groq(api_key=GROQ_API_KEY)
-    except Exception as e:
-        print(f"Failed to init direct Groq client: {e}")
-
-# 4. Create Intelligent LLM Chain
-fallbacks = []
-if groq_llm: fallbacks.append(groq_llm)
-if openrouter_llm: fallbacks.append(openrouter_llm)
-
-if "llama" in AI_MODEL.lower() and groq_llm:
-    print(f"--- AI Config: Using Groq (Primary) ---")
-    llm = groq_llm.with_fallbacks([f for f in fallbacks if f != groq_llm])
-elif openrouter_llm:
-    print(f"--- AI Config: Using OpenRouter (Primary) ---")
-    llm = openrouter_llm.with_fallbacks([f for f in fallbacks if f != openrouter_llm])
-elif groq_llm:
-    print(f"--- AI Config: Using Groq (Standalone) ---")
-    llm = groq_llm
-else:
-    llm = None
+# Decks larger than a task's context budget are summarized map-reduce style
+# ("map_reduce") for report, guide, slides and podcast/overview scripts;
+# "retrieval" sends the best-matching passages instead.
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "map_reduce")
+SUMMARY_MAX_WORKERS = int(os.getenv("SUMMARY_MAX_WORKERS", "8"))
 
 # --- DATATYPES ---
 
@@ -93,8 +58,9 @@ class QuizList(BaseModel):
     quiz: List[QuizQuestion]
 
 class DeckState(TypedDict):
-    original_text: str
-    chunks: List[str]
+    # The deck text itself is not part of the state (see deck_text()), so
+    # checkpoints only hold small inputs and finished outputs
+    chunk_count: int
     partial_cards: Annotated[List[Dict], operator.add] 
     final_cards: List[Dict]
     flowchart: str
@@ -107,23 +73,136 @@ class DeckState(TypedDict):
     podcast_script: List[Dict]
     overview_script: str
     options: Dict
+    deck_digest: str
+    chunk_tokens: int
+    task: str
+    missed_questions: List[Dict]
+    # Failed generations ("task: reason"); a result with errors is not cached
+    errors: Annotated[List[str], operator.add]
 
 # --- NODES ---
 
-def chunk_document(state: DeckState):
-    print("--- NODE: CHUNKER ---")
-    text = state['original_text']
-    splitter = RecursiveCharacterTextSplitter(chunk_size=25000, chunk_overlap=500)
-    docs = splitter.create_documents([text])
-    chunks = [d.page_content for d in docs]
-    print(f"Created {len(chunks)} chunks.")
-    return {"chunks": chunks}
+def node_error(task: str, error) -> Dict:
+    """State update recording that a node fell back to a placeholder result."""
+    return {"errors": [f"{task}: {error}"]}
 
-from langchain_core.messages import SystemMessage
+# Text of the deck the current graph run works on. Set by run_graph and read
+# by the nodes (contextvars follow the graph's tasks and worker threads).
+_DECK_TEXT: contextvars.ContextVar = contextvars.ContextVar("deck_text")
 
-def generate_report_node(state: DeckState):
+def deck_text() -> str:
+    return _DECK_TEXT.get()
+
+def deck_chunk_spans(state: DeckState) -> List[List[int]]:
+    """Card chunk offsets for the current deck (computed once, then cached by chunker.py)."""
+    max_tokens = state.get('chunk_tokens') or chunk_token_budget("cards", AI_MODEL)
+    return get_chunk_spans(deck_text(), max_tokens, state.get('deck_digest'))
+
+async def select_context(state: DeckState, budget_chars: int, query: str = "") -> str:
+    """
+    The deck text to send for a task: all of it when it fits budget_chars,
+    otherwise the passages most relevant to query (or to the deck's main
+    topics) from the deck's retrieval index, in document order.
+    """
+    return await asyncio.to_thread(
+        build_context, deck_text(), query, budget_chars, state.get('deck_digest')
+    )
+
+# --- MAP-REDUCE SUMMARIES ---
+# Chunk summaries are cached by chunk content, so report, guide, slides and
+# podcast requests on the same deck (or overlapping decks) share the map step.
+SUMMARY_FLIGHTS = SingleFlight()
+
+MAP_INSTRUCTION = """You are condensing one part of a longer document for later use in a report, study guide, slides and a podcast.
+Write a dense summary of this part in plain prose and bullet points (max ~500 words).
+Keep every key concept, definition, argument, name, date and number. Do not add information that is not in the text."""
+
+REDUCE_INSTRUCTION = """You are merging summaries of consecutive parts of one document.
+Combine them into a single dense summary (max ~800 words) that keeps the document's structure and order,
+every key concept, definition, name, date and number. Remove repetition. Do not add information."""
+
+async def _summarize_chunk(chunk: str, limit: asyncio.Semaphore) -> str:
+    cache_key = make_cache_key("chunk_summary", text_digest(chunk))
+    cached = await RESPONSE_CACHE.aget(cache_key)
+    if cached is not None:
+        return cached["summary"]
+
+    async def run():
+        async with limit:
+            summary = await acomplete(MAP_INSTRUCTION, f"TEXT: {chunk}")
+        if summary:
+            await RESPONSE_CACHE.aset(cache_key, {"summary": summary})
+        return summary
+
+    return await SUMMARY_FLIGHTS.do(cache_key, run)
+
+async def _reduce_summaries(summaries: List[str], budget_chars: int, limit: asyncio.Semaphore) -> List[str]:
+    """Merges neighbouring summaries (at least two per group) until they fit in budget_chars."""
+    while len(summaries) > 1 and sum(len(x) for x in summaries) > budget_chars:
+        groups, current = [], []
+        for summary in summaries:
+            if len(current) >= 2 and sum(len(x) for x in current) + len(summary) > budget_chars:
+                groups.append(current)
+                current = []
+            current.append(summary)
+        if len(current) == 1 and groups:
+            groups[-1].append(current[0])
+        elif current:
+            groups.append(current)
+
+        async def reduce(group: List[str]) -> str:
+            async with limit:
+                return await acomplete(REDUCE_INSTRUCTION, "\n\n".join(f"PART {i + 1}:\n{x}" for i, x in enumerate(group)))
+
+        print(f"Reducing {len(summaries)} summaries into {len(groups)}")
+        summaries = list(await asyncio.gather(*(reduce(group) for group in groups)))
+    return summaries
+
+async def summarize_document(text: str, budget_chars: int, deck_digest: str = None) -> str:
+    """
+    Returns text unchanged when it fits budget_chars. Otherwise summarizes
+    each chunk in parallel (map) and merges the summaries until they fit
+    (reduce), so the whole document is represented rather than a prefix.
+    """
+    if len(text) <= budget_chars:
+        return text
+    if SUMMARY_MODE != "map_reduce":
+        return await asyncio.to_thread(build_context, text, "", budget_chars, deck_digest)
+
+    deck_key = make_cache_key("deck_summary", deck_digest or text_digest(text), {"budget": budget_chars})
+    cached = await RESPONSE_CACHE.aget(deck_key)
+    if cached is not None:
+        return cached["summary"]
+
+    async def run():
+        start_time = time.time()
+        chunks = await asyncio.to_thread(get_chunks, text, chunk_token_budget("summary", AI_MODEL), deck_digest)
+        limit = asyncio.Semaphore(max(1, SUMMARY_MAX_WORKERS))
+        results = await asyncio.gather(*(_summarize_chunk(chunk, limit) for chunk in chunks), return_exceptions=True)
+        failed = [r for r in results if isinstance(r, Exception) or not r]
+        if len(failed) == len(results):
+            raise failed[0] if isinstance(failed[0], Exception) else Exception("No chunk summaries produced")
+        summaries = [r for r in results if isinstance(r, str) and r]
+        summaries = await _reduce_summaries(summaries, budget_chars, limit)
+        summary = "\n\n".join(summaries)
+        # A partial summary is still usable now, but only a complete one is cached
+        if not failed:
+            await RESPONSE_CACHE.aset(deck_key, {"summary": summary})
+        print(f"Summarized {len(chunks)} chunks ({len(text)} -> {len(summary)} chars) in {time.time() - start_time:.2f}s")
+        return summary
+
+    try:
+        return await SUMMARY_FLIGHTS.do(deck_key, run)
+    except Exception as e:
+        print(f"Map-reduce summary failed, using retrieval context: {e}")
+        return await asyncio.to_thread(build_context, text, "", budget_chars, deck_digest)
+
+async def summary_context(state: DeckState, budget_chars: int) -> str:
+    return await summarize_document(deck_text(), budget_chars, state.get('deck_digest'))
+
+async def generate_report_node(state: DeckState):
     print("--- NODE: REPORT GEN ---")
-    text = state['original_text'][:50000] 
+    text = await summary_context(state, 50000)
     
     system_instruction = """You are an expert researcher. Create a comprehensive Deep Research Report based on the provided text.
     Format the output in beautiful, professional Markdown.
@@ -137,44 +216,18 @@ def generate_report_node(state: DeckState):
     """
     
     try:
-        if direct_groq_client and ("llama" in target_google_model.lower() or "llama" in AI_MODEL.lower()):
-            try:
-                res = direct_groq_client.chat.completions.create(
-                    model=AI_MODEL if "llama" in AI_MODEL.lower() else "llama-3.3-70b-versatile",
-                    messages=[{"role": "system", "content": system_instruction}, {"role": "user", "content": f"TEXT: {text}"}]
-                )
-                content = res.choices[0].message.content
-            except Exception as e:
-                print(f"Direct Groq Report Gen Error: {e}")
-
-
-
-        if not content and llm:
-            # FIX: Use SystemMessage to avoid variable parsing in the instruction
-            messages = [
-                SystemMessage(content=system_instruction),
-                ("user", "TEXT: {text}")
-            ]
-            prompt = ChatPromptTemplate.from_messages(messages)
-            chain = prompt | llm
-            res = chain.invoke({"text": text})
-            content = res.content
-            
+        content = await acomplete(system_instruction, f"TEXT: {text}")
         print(f"Report generated ({len(content)} chars)")
+        if not content:
+            return {"report": "", **node_error("report", "empty response")}
         return {"report": content}
     except Exception as e:
         print(f"Report Gen Error: {e}")
-        return {"report": "# Error generating report\n" + str(e)}
+        return {"report": "# Error generating report\n" + str(e), **node_error("report", e)}
 
-def generate_slides_node(state: DeckState):
+async def generate_slides_node(state: DeckState):
     print("--- NODE: SLIDES GEN ---")
-    text = state['original_text'][:30000]
-    
-    # We need to ensure braces for JSON are doubled if we were using f-strings, 
-    # but here it's a static string usually, except we might have injected options (not yet for slides).
-    # Since we are essentially passing this as a raw string to SystemMessage, we don't need to double-escape 
-    # for LangChain if we use SystemMessage(content=...). 
-    # BUT if we use simple string "system" tuple, LangChain parses it.
+    text = await summary_context(state, 30000)
     
     system_instruction = """You are a presentation expert. Create a slide deck based on the text. 
     Respond ONLY with JSON matching this structure:
@@ -188,45 +241,22 @@ def generate_slides_node(state: DeckState):
     """
     
     try:
-        if direct_groq_client and ("llama" in AI_MODEL.lower() or "mixtral" in AI_MODEL.lower()):
-            try:
-                res = direct_groq_client.chat.completions.create(
-                    model=AI_MODEL if "llama" in AI_MODEL.lower() else "llama-3.3-70b-versatile",
-                    messages=[{"role": "system", "content": system_instruction}, {"role": "user", "content": f"TEXT: {text}"}],
-                    response_format={"type": "json_object"}
-                )
-                content = res.choices[0].message.content
-            except Exception as e:
-                print(f"Direct Groq Slides Gen Error: {e}")
-
-
-
-        if not content and llm:
-            messages = [
-                SystemMessage(content=system_instruction),
-                ("user", "TEXT: {text}")
-            ]
-            prompt = ChatPromptTemplate.from_messages(messages)
-            chain = prompt | llm | JsonOutputParser()
-            res = chain.invoke({"text": text})
-            return {"slides": res.get("slides", [])}
-            
+        content = await acomplete(system_instruction, f"TEXT: {text}", json_mode=True)
         if content:
              try:
-                 content = content.replace("```json", "").replace("```", "").strip()
-                 data = json.loads(content, strict=False)
+                 data = parse_json_content(content)
                  return {"slides": data.get("slides", [])}
              except Exception as e:
                  print(f"Slides parse error: {e}")
-                 return {"slides": []}
+                 return {"slides": [], **node_error("slides", e)}
     except Exception as e:
         print(f"Slides Gen Error: {e}")
-        return {"slides": []}
-    return {"slides": []}
+        return {"slides": [], **node_error("slides", e)}
+    return {"slides": [], **node_error("slides", "empty response")}
 
-def generate_table_node(state: DeckState):
+async def generate_table_node(state: DeckState):
     print("--- NODE: TABLE GEN ---")
-    text = state['original_text'][:30000]
+    text = await select_context(state, 30000)
     
     system_instruction = """You are a data analyst. Extract key structured data from the text into a JSON table.
     Identify the most important entities (rows) and attributes (columns).
@@ -241,49 +271,23 @@ def generate_table_node(state: DeckState):
     """
     
     try:
-        content = ""
-        if direct_groq_client:
-            try:
-                res = direct_groq_client.chat.completions.create(
-                    model=AI_MODEL if "llama" in AI_MODEL.lower() else "llama-3.3-70b-versatile",
-                    messages=[{"role": "system", "content": system_instruction}, {"role": "user", "content": f"TEXT: {text}"}],
-                    response_format={"type": "json_object"}
-                )
-                content = res.choices[0].message.content
-            except Exception as e:
-                print(f"Direct Groq Table Gen Error: {e}")
-
-
-
-        if not content and llm:
-            messages = [
-                SystemMessage(content=system_instruction),
-                ("user", "TEXT: {text}")
-            ]
-            prompt = ChatPromptTemplate.from_messages(messages)
-            chain = prompt | llm | JsonOutputParser()
-            res = chain.invoke({"text": text})
-            return {"table": res.get("rows", []) if isinstance(res, dict) else res}
-            
+        content = await acomplete(system_instruction, f"TEXT: {text}", json_mode=True)
         if content:
-             content = content.replace("```json", "").replace("```", "").strip()
-             data = json.loads(content, strict=False)
+             data = parse_json_content(content)
              return {"table": data.get("rows", []) if isinstance(data, dict) else data}
     except Exception as e:
         print(f"Table Gen Error: {e}")
-        return {"table": []}
-    return {"table": []}
+        return {"table": [], **node_error("table", e)}
+    return {"table": [], **node_error("table", "empty response")}
 
 
-def generate_flowchart_node(state: DeckState):
+async def generate_flowchart_node(state: DeckState):
     print("--- NODE: FLOWCHART GEN ---")
-    text = state['original_text'][:15000]
-    
     options = state.get('options', {})
     instructions = options.get('instructions', '')
+    text = await select_context(state, 15000, instructions)
     
     # Using f-string for python variable injection
-    # We use single braces for JSON examples because we will pass this to SystemMessage
     system_instruction = f"""You are an expert at creating mind maps. Generate a helper Mermaid.js flowchart syntax based on the provided text. 
 
 RULES:
@@ -299,35 +303,15 @@ USER PREFERENCES:
     
     prompt_text = f"TEXT TO ANALYZE:\n{text}"
     content = ""
+    error = "empty response"
     try:
-        if direct_groq_client:
-            try:
-                res = direct_groq_client.chat.completions.create(
-                    model=AI_MODEL if "llama" in AI_MODEL.lower() else "llama-3.3-70b-versatile",
-                    messages=[{"role": "system", "content": system_instruction}, {"role": "user", "content": prompt_text}]
-                )
-                content = res.choices[0].message.content
-            except Exception as e:
-                print(f"Direct Groq Flowchart Error: {e}")
-
-
-
-        # 3. Fallback to LangChain
-        if not content and llm:
-            print("DEBUG: Using LangChain wrapper for Flowchart")
-            messages = [
-                SystemMessage(content=system_instruction),
-                ("user", "{text}")
-            ]
-            full_prompt = ChatPromptTemplate.from_messages(messages)
-            chain = full_prompt | llm
-            res = chain.invoke({"text": text})
-            content = res.content
+        content = await acomplete(system_instruction, prompt_text)
     except Exception as e:
         print(f"Flowchart node Error: {e}")
+        error = e
 
     if not content:
-         return {"flowchart": "graph TD\nError[Generation Failed]"}
+         return {"flowchart": "graph TD\nError[Generation Failed]", **node_error("flowchart", error)}
 
     content = content.replace('```mermaid', '').replace('```', '').strip()
     if not content.startswith('graph') and not content.startswith('flowchart') and not content.startswith('mindmap'):
@@ -342,81 +326,65 @@ USER PREFERENCES:
     return {"flowchart": content}
 
 
-def generate_cards_node(state: DeckState):
-    print("--- NODE: CARD GEN ---")
-    chunks = state.get('chunks', [])
-    if not chunks:
-        return {"partial_cards": []}
-    
-    options = state.get('options', {})
+async def _generate_cards_for_chunk(idx: int, chunk: str, system_instruction: str) -> Tuple[List[Dict], Optional[str]]:
+    """Runs card generation for a single chunk. Returns the chunk's cards and the error, if it failed."""
+    start_time = time.time()
+    cards = []
+    error = None
+    try:
+        content = await acomplete(system_instruction, f"TEXT: {chunk}", json_mode=True)
+        if content:
+            try:
+                data = parse_json_content(content)
+                if isinstance(data, dict) and 'cards' in data:
+                    cards.extend(data['cards'])
+                elif isinstance(data, list):
+                    cards.extend(data)
+            except Exception as e:
+                print(f"Card parse error: {e}")
+                error = str(e)
+        else:
+            error = "empty response"
+
+    except Exception as e:
+        print(f"Card Chunk Error: {e}")
+        error = str(e)
+
+    print(f"Chunk {idx + 1}: {len(cards)} cards in {time.time() - start_time:.2f}s")
+    return cards, error
+
+def _card_instruction(options: Dict) -> str:
     count = options.get('count', 5)
     difficulty = options.get('difficulty', 'medium')
     instructions = options.get('instructions', '')
 
-    # Use single braces for JSON schema in SystemMessage
-    system_instruction = f"""You are an expert educator. Based on the text, create {count} high-quality flashcards. 
+    return f"""You are an expert educator. Based on the text, create {count} high-quality flashcards. 
 Difficulty Level: {difficulty}.
 Special Instructions: {instructions}
 Respond ONLY with JSON matching the format: {{ "cards": [{{ "q": "...", "a": "..." }}] }}
 """
-    
-    new_cards = []
-    for chunk in chunks:
-        try:
-            content = ""
-            if direct_groq_client:
-                try:
-                    res = direct_groq_client.chat.completions.create(
-                        model=AI_MODEL if "llama" in AI_MODEL.lower() else "llama-3.3-70b-versatile",
-                        messages=[{"role": "system", "content": system_instruction}, {"role": "user", "content": f"TEXT: {chunk}"}],
-                        response_format={"type": "json_object"}
-                    )
-                    content = res.choices[0].message.content
-                except Exception as e:
-                    print(f"Direct Groq Card Gen Error: {e}")
-
-
-
-            if not content and llm:
-                print("DEBUG: Using LangChain wrapper for Cards")
-                parser = JsonOutputParser(pydantic_object=CardList)
-                messages = [
-                    SystemMessage(content=system_instruction),
-                    ("user", "TEXT: {text}")
-                ]
-                prompt = ChatPromptTemplate.from_messages(messages)
-                chain = prompt | llm | parser
-                res = chain.invoke({"text": chunk})
-                if 'cards' in res:
-                    new_cards.extend(res['cards'])
-                continue 
-
-            if content:
-                try:
-                    content = content.replace("```json", "").replace("```", "").strip()
-                    data = json.loads(content, strict=False)
-                    if isinstance(data, dict) and 'cards' in data:
-                        new_cards.extend(data['cards'])
-                    elif isinstance(data, list):
-                        new_cards.extend(data)
-                except Exception as e:
-                    print(f"Card parse error: {e}")
-
-        except Exception as e:
-            print(f"Card Chunk Error: {e}")
-    
-    return {"partial_cards": new_cards}
 
-
-
-def generate_quiz_node(state: DeckState):
+async def generate_card_chunk_node(payload: Dict):
+    """One chunk's cards as its own graph task, so finished chunks are checkpointed individually."""
+    # The payload names the chunk by index; its text is sliced from the deck
+    start, end, _ = deck_chunk_spans(payload)[payload['idx']]
+    cards, error = await _generate_cards_for_chunk(
+        payload['idx'], deck_text()[start:end], _card_instruction(payload.get('options', {}))
+    )
+    report_progress(advance=1)
+    update = {"partial_cards": [{**card, "_chunk": payload['idx']} for card in cards]}
+    if error is not None:
+        # The other chunks' cards are still returned, but the deck is incomplete
+        update.update(node_error(f"cards chunk {payload['idx'] + 1}", error))
+    return update
+
+async def generate_quiz_node(state: DeckState):
     print("--- NODE: QUIZ GEN ---")
-    text = state['original_text'][:25000]
-    
     options = state.get('options', {})
     count = options.get('count', 5)
     difficulty = options.get('difficulty', 'medium')
     instructions = options.get('instructions', '')
+    text = await select_context(state, 25000, instructions)
     
     system_instruction = f"""You are an expert examiner. Create a challenging multiple-choice quiz ({count} questions) based on the provided text.
     Difficulty Level: {difficulty}.
@@ -435,31 +403,17 @@ def generate_quiz_node(state: DeckState):
     """
     
     try:
-        content = ""
-
-
-        if not content and llm:
-            print("DEBUG: Using LangChain for Quiz Gen")
-            parser = JsonOutputParser(pydantic_object=QuizList)
-            messages = [
-                SystemMessage(content=system_instruction),
-                ("user", "TEXT: {text}")
-            ]
-            prompt = ChatPromptTemplate.from_messages(messages)
-            chain = prompt | llm | parser
-            res = chain.invoke({"text": text})
-            return {"quiz": res.get("quiz", [])}
-
+        content = await acomplete(system_instruction, f"TEXT: {text}", json_mode=True)
         if content:
-            content = content.replace("```json", "").replace("```", "").strip()
-            data = json.loads(content, strict=False)
+            data = parse_json_content(content)
             return {"quiz": data.get("quiz", [])}
             
     except Exception as e:
         print(f"Quiz Gen Error: {e}")
-        return {"quiz": []}
+        return {"quiz": [], **node_error("quiz", e)}
+    return {"quiz": [], **node_error("quiz", "empty response")}
 
-def generate_review_node(state: Dict):
+async def generate_review_node(state: Dict):
     print("--- NODE: REVIEW GEN ---")
     missed_questions = state.get('missed_questions', [])
     if not missed_questions:
@@ -470,30 +424,18 @@ def generate_review_node(state: Dict):
     context = "\n".join([f"Q: {m['question']} (Missed because they answered: {m.get('user_answer', 'Unknown')})" for m in missed_questions])
     
     try:
-        content = ""
-
-
+        content = await acomplete(system_instruction, f"MISSED:\n{context}", json_mode=True)
         if content:
-            data = json.loads(content.replace("```json", "").replace("```", "").strip(), strict=False)
+            data = parse_json_content(content)
             return {"review_cards": data.get("cards", [])}
-            
-        if llm:
-             parser = JsonOutputParser(pydantic_object=CardList)
-             messages = [
-                SystemMessage(content=system_instruction),
-                ("user", "MISSED:\n{text}")
-             ]
-             prompt = ChatPromptTemplate.from_messages(messages)
-             chain = prompt | llm | parser
-             res = chain.invoke({"text": context})
-             return {"review_cards": res.get("cards", [])}
     except Exception as e:
         print(f"Review Card Gen Error: {e}")
-        return {"review_cards": []}
+        return {"review_cards": [], **node_error("review", e)}
+    return {"review_cards": [], **node_error("review", "empty response")}
 
-def generate_guide_node(state: DeckState):
+async def generate_guide_node(state: DeckState):
     print("--- NODE: GUIDE GEN ---")
-    text = state['original_text'][:15000]
+    text = await summary_context(state, 15000)
     
     system_instruction = """You are an expert AI Guide.
     Create a welcoming, structured summary of the provided text.
@@ -506,43 +448,24 @@ def generate_guide_node(state: DeckState):
     """
     
     try:
-        content = ""
-
-
-        if not content and llm:
-            messages = [
-                SystemMessage(content=system_instruction),
-                ("user", "TEXT: {text}")
-            ]
-            prompt = ChatPromptTemplate.from_messages(messages)
-            chain = prompt | llm
-            res = chain.invoke({"text": text})
-            content = res.content
-            
+        content = await acomplete(system_instruction, f"TEXT: {text}", json_mode=True)
     except Exception as e:
         print(f"Guide Gen Error: {e}")
-        return {"guide": {}}
+        return {"guide": {}, **node_error("guide", e)}
     
     if content:
-            try:
-                content = content.replace("```json", "").replace("```", "").strip()
-                data = json.loads(content, strict=False)
+        try:
+            data = parse_json_content(content)
+            if isinstance(data, dict):
                 return {"guide": data}
-            except Exception as e:
-                import re
-                match = re.search(r'\{.*\}', content, re.DOTALL)
-                if match:
-                    try:
-                        data = json.loads(match.group(), strict=False)
-                        return {"guide": data}
-                    except: pass
-
+        except Exception as e:
+            print(f"Guide parse error: {e}")
                 
-    return {"guide": {}}
+    return {"guide": {}, **node_error("guide", "no usable response")}
 
-def generate_podcast_script_node(state: DeckState):
+async def generate_podcast_script_node(state: DeckState):
     print("--- NODE: PODCAST SCRIPT GEN ---")
-    text = state['original_text'][:40000]
+    text = await summary_context(state, 40000)
     
     options = state.get('options', {})
     mode = options.get('mode', 'default') # default, brief, summarized
@@ -571,27 +494,20 @@ def generate_podcast_script_node(state: DeckState):
     """
     
     try:
-
-
-        # 2. LangChain Fallback
-        if llm:
-            messages = [
-                SystemMessage(content=system_instruction),
-                ("user", "TEXT: {text}")
-            ]
-            prompt = ChatPromptTemplate.from_messages(messages)
-            chain = prompt | llm | JsonOutputParser()
-            res = chain.invoke({"text": text})
-            return {"podcast_script": res.get("script", [])}
+        content = await acomplete(system_instruction, f"TEXT: {text}", json_mode=True)
+        if content:
+            data = parse_json_content(content)
+            return {"podcast_script": data.get("script", [])}
             
     except Exception as e:
         print(f"Podcast Script Gen Error: {e}")
+        return {"podcast_script": [], **node_error("podcast_script", e)}
         
-    return {"podcast_script": []}
+    return {"podcast_script": [], **node_error("podcast_script", "empty response")}
 
-def generate_overview_script_node(state: DeckState):
+async def generate_overview_script_node(state: DeckState):
     print("--- NODE: OVERVIEW SCRIPT GEN ---")
-    text = state['original_text'][:40000]
+    text = await summary_context(state, 40000)
     
     options = state.get('options', {})
     mode = options.get('mode', 'default')
@@ -617,62 +533,138 @@ def generate_overview_script_node(state: DeckState):
     """
     
     try:
-
-                
-        # 2. LangChain Fallback
-        if llm:
-            messages = [
-                SystemMessage(content=system_instruction),
-                ("user", "TEXT: {text}")
-            ]
-            prompt = ChatPromptTemplate.from_messages(messages)
-            chain = prompt | llm | JsonOutputParser()
-            res = chain.invoke({"text": text})
-            return {"overview_script": res.get("text", "")}
+        content = await acomplete(system_instruction, f"TEXT: {text}", json_mode=True)
+        if content:
+            data = parse_json_content(content)
+            return {"overview_script": data.get("text", "")}
             
     except Exception as e:
         print(f"Overview Script Gen Error: {e}")
+        return {"overview_script": "", **node_error("overview_script", e)}
         
-    return {"overview_script": ""}
+    return {"overview_script": "", **node_error("overview_script", "empty response")}
 
 def refine_deck(state: DeckState):
     print("--- NODE: REFINER ---")
     # Simple pass-through: In a real app, you might deduplicate or polish here.
+    # Cards from parallel chunk tasks are put back in chunk order.
     cards = state.get('partial_cards', [])
+    cards = sorted(cards, key=lambda card: card.get('_chunk', 0) if isinstance(card, dict) else 0)
+    cards = [{k: v for k, v in card.items() if k != '_chunk'} if isinstance(card, dict) else card for card in cards]
     return {"final_cards": cards}
 
 
 
 # --- GRAPH BUILD ---
+# Every task is a branch off one shared chunker; run_selective_node runs the
+# branch for one task. Card generation fans out one graph task per chunk
+# (Send) and joins in the refiner.
+TASK_NODES = {
+    "flowchart": "flowcharter",
+    "quiz": "quiz_gen",
+    "review": "review_gen",
+    "report": "report_gen",
+    "slides": "slides_gen",
+    "table": "table_gen",
+    "guide": "guide_gen",
+    "podcast_script": "podcast_gen",
+    "overview_script": "overview_gen",
+}
+
+# SQLite file for LangGraph checkpoints, so a run interrupted by a worker
+# restart resumes with its finished branches/chunks. Empty disables.
+GRAPH_CHECKPOINT_DB = os.getenv("GRAPH_CHECKPOINT_DB", os.path.join("data", "graph_checkpoints.db"))
+# A run owns its checkpoint thread through a lease (shared_state.py) renewed
+# while it runs; only a thread whose owner is gone is resumed.
+GRAPH_LEASE_TTL = float(os.getenv("GRAPH_LEASE_TTL", "60"))
+
+def shared_chunker(state: DeckState):
+    # Only card generation consumes chunks; the other branches read the
+    # deck text through the retrieval index / summaries
+    if state.get('task') != "cards":
+        return {}
+    print("--- NODE: CHUNKER ---")
+    # Token-sized chunks, computed once per deck text and budget (chunker.py)
+    chunk_count = len(deck_chunk_spans(state))
+    print(f"Created {chunk_count} chunks.")
+    # Background jobs report "chunks processed" against this total
+    report_progress("chunks", total=chunk_count)
+    return {"chunk_count": chunk_count}
+
+def route_tasks(state: DeckState):
+    task = state.get('task')
+    if task == "cards":
+        if not state.get('chunk_count'):
+            return ["refiner"]
+        payload = {k: state.get(k) for k in ("options", "deck_digest", "chunk_tokens")}
+        return [Send("card_chunk", {**payload, "idx": idx}) for idx in range(state['chunk_count'])]
+    if task in TASK_NODES:
+        return [TASK_NODES[task]]
+    return [END]
 
 workflow = StateGraph(DeckState)
-workflow.add_node("chunker", chunk_document)
-workflow.add_node("generator", generate_cards_node)
-workflow.add_node("flowcharter", generate_flowchart_node)
+workflow.add_node("chunker", shared_chunker)
+workflow.add_node("card_chunk", generate_card_chunk_node)
 workflow.add_node("refiner", refine_deck)
-# New nodes
+workflow.add_node("flowcharter", generate_flowchart_node)
+workflow.add_node("quiz_gen", generate_quiz_node)
+workflow.add_node("review_gen", generate_review_node)
 workflow.add_node("report_gen", generate_report_node)
 workflow.add_node("slides_gen", generate_slides_node)
 workflow.add_node("table_gen", generate_table_node)
+workflow.add_node("guide_gen", generate_guide_node)
 workflow.add_node("podcast_gen", generate_podcast_script_node)
 workflow.add_node("overview_gen", generate_overview_script_node)
 
-
 workflow.set_entry_point("chunker")
-workflow.add_edge("chunker", "generator")
-workflow.add_edge("generator", "flowcharter")
-workflow.add_edge("flowcharter", "refiner")
+workflow.add_conditional_edges("chunker", route_tasks, ["card_chunk", "refiner", END, *TASK_NODES.values()])
+workflow.add_edge("card_chunk", "refiner")
 workflow.add_edge("refiner", END)
+for node in TASK_NODES.values():
+    workflow.add_edge(node, END)
 
 app_graph = workflow.compile()
 
-import time
+_checkpointed_graph = None
+_checkpointer_lock = asyncio.Lock()
 
-def run_selective_node(text: str, task_type: str, extra_data: Dict = None):
-    # Initialize basic state
+async def get_graph():
+    """The graph compiled with the SQLite checkpointer (created on first use), or without one."""
+    global _checkpointed_graph
+    if not GRAPH_CHECKPOINT_DB:
+        return app_graph, None
+    async with _checkpointer_lock:
+        if _checkpointed_graph is None:
+            try:
+                import aiosqlite
+                from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+                os.makedirs(os.path.dirname(GRAPH_CHECKPOINT_DB) or ".", exist_ok=True)
+                conn = await aiosqlite.connect(GRAPH_CHECKPOINT_DB)
+                await conn.execute("PRAGMA journal_mode=WAL")
+                checkpointer = AsyncSqliteSaver(conn)
+                await checkpointer.setup()
+                _checkpointed_graph = (workflow.compile(checkpointer=checkpointer), checkpointer)
+            except Exception as e:
+                print(f"Graph checkpointing disabled: {e}")
+                _checkpointed_graph = (app_graph, None)
+    return _checkpointed_graph
+
+async def close_graph():
+    """Closes the checkpoint database connection (app shutdown)."""
+    global _checkpointed_graph
+    if _checkpointed_graph and _checkpointed_graph[1] is not None:
+        await _checkpointed_graph[1].conn.close()
+    _checkpointed_graph = None
+
+async def run_graph(text: str, task: str, extra_data: Dict = None) -> Dict:
+    """
+    Runs the graph for one task and returns the final state. Runs are
+    checkpointed under a thread id derived from the deck, task and inputs:
+    if an earlier identical run was interrupted (its owner's lease expired),
+    it is resumed and only unfinished chunks run again.
+    """
     state = {
-        "original_text": text, 
-        "chunks": [], 
+        "chunk_count": 0,
         "partial_cards": [], 
         "final_cards": [], 
         "flowchart": "", 
@@ -680,50 +672,58 @@ def run_selective_node(text: str, task_type: str, extra_data: Dict = None):
         "review_cards": [],
         "report": "",
         "slides": [],
-        "report": "",
-        "slides": [],
         "table": [],
         "guide": {},
-        "options": {}
+        "options": {},
+        "task": task,
+        "errors": [],
     }
     if extra_data:
         state.update(extra_data)
-        
-    for attempt in range(2):
-        try:
-            # Common Chunking for these tasks if needed, though most new ones prefer full text or large prefix
-            # report, slides, table, infographic usually take "original_text" directly in the node function
-            
-            if task_type == "cards":
-                state.update(chunk_document(state))
-                state.update(generate_cards_node(state))
-                state.update(refine_deck(state))
-            elif task_type == "flowchart":
-                state.update(generate_flowchart_node(state))
-            elif task_type == "quiz":
-                state.update(generate_quiz_node(state))
-            elif task_type == "review":
-                state.update(generate_review_node(state))
-            
-            # NEW TASKS
-            elif task_type == "report":
-                state.update(generate_report_node(state))
-            elif task_type == "slides":
-                state.update(generate_slides_node(state))
-            elif task_type == "table":
-                state.update(generate_table_node(state))
-            elif task_type == "guide":
-                state.update(generate_guide_node(state))
-            elif task_type == "podcast_script":
-                state.update(generate_podcast_script_node(state))
-            elif task_type == "overview_script":
-                state.update(generate_overview_script_node(state))
-                
-            return state
-        except Exception as e:
-            if "429" in str(e) and attempt == 0:
-                print(f"--- 429 Quota Limit Hit. Retrying in 2 seconds... ---")
-                time.sleep(2)
-                continue
-            print(f"--- Fatal selective node error: {e} ---")
-            return state # Return whatever we have
+
+    graph, checkpointer = await get_graph()
+    inputs = {k: v for k, v in (extra_data or {}).items() if k != "deck_digest"}
+    thread_id = make_cache_key(task, state.get("deck_digest") or text_digest(text), inputs)
+    # Card chunks run as parallel graph tasks; keep the per-request cap
+    config = {
+        "configurable": {"thread_id": thread_id},
+        "max_concurrency": max(1, CARD_GEN_MAX_WORKERS) + 1,
+    }
+
+    text_token = _DECK_TEXT.set(text)
+    try:
+        lease = GENERATION_LOCKS.lease(f"graph:{thread_id}", GRAPH_LEASE_TTL) if checkpointer else nullcontext(False)
+        with span("graph", task_type=task, chars=len(text)) as run:
+            async with lease as owned:
+                if checkpointer and not owned:
+                    # An identical run is live (here or in another worker): run
+                    # without a checkpoint rather than share its thread
+                    print(f"🔗 GRAPH RUN IN PROGRESS ELSEWHERE: {thread_id}, running unsaved")
+                    graph, checkpointer = app_graph, None
+
+                graph_input = state
+                if checkpointer:
+                    snapshot = await graph.aget_state(config)
+                    if snapshot.next:
+                        print(f"♻️ RESUMING GRAPH RUN: {thread_id} (pending: {list(snapshot.next)})")
+                        run.set(resumed=True)
+                        graph_input = None
+
+                result = await graph.ainvoke(graph_input, config)
+                if checkpointer:
+                    # Finished runs live on in the response cache; keep only interrupted ones
+                    await checkpointer.adelete_thread(thread_id)
+    finally:
+        _DECK_TEXT.reset(text_token)
+    return result
+
+async def run_selective_node(text: str, task_type: str, extra_data: Dict = None):
+    try:
+        return await run_graph(text, task_type, extra_data)
+    except Exception as e:
+        # Rate limits and provider failover are handled by the router (llm_router.py)
+        print(f"--- Fatal selective node error: {e} ---")
+        state = {"options": {}}
+        state.update(extra_data or {})
+        state.update(node_error(task_type, e))
+        return state # Return whatever we have
@@ -1,64 +1,18 @@
-from openai import OpenAI
-import os
 import json
 
-from dotenv import load_dotenv
-from google import genai
-import groq
+# Provider clients and model selection live in llm_provider (async)
+from llm_provider import acomplete_messages
 
-# Load env
-from pathlib import Path
-env_path = Path(__file__).parent.parent / ".env"
-load_dotenv(dotenv_path=env_path)
+# Text extraction lives in pdf_extractor (page-parallel, streaming)
+from pdf_extractor import extract_text
 
-# --- LLM SETUP ---
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-OPENROUTER_KEY = os.getenv("OPENROUTER_API_KEY")
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-AI_MODEL = os.getenv("AI_MODEL", "gemini-flash-latest")
-
-# New Google GenAI Client
-google_client = None
-if GOOGLE_API_KEY:
-    print("--- Using Google AI Engine (New SDK) ---")
-    google_client = genai.Client(api_key=GOOGLE_API_KEY)
-
-# OpenRouter Client (OpenAI compatible)
-or_client = None
-if OPENROUTER_KEY:
-    or_client = OpenAI(
-    )
-
-# Groq Client
-groq_client = None
-if GROQ_API_KEY:
-    print("--- Using Groq AI Engine ---")
-    groq_client = groq.Groq(api_key=GROQ_API_KEY)
-
-import fitz  # PyMuPDF
-
-# ... (imports remain)
-
-def extract_text(pdf_source):
-    text = ""
+async def generate_flashcards(file_path):
+    # 1. Extract
     try:
-        # Handle both bytes and file-like objects
-        if isinstance(pdf_source, bytes):
-            pdf_bytes = pdf_source
-        else:
-            pdf_bytes = pdf_source.read()
-            
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        
-        for page in doc:
-            text += page.get_text() + "\n"
+        text = extract_text(file_path)
     except Exception as e:
         print(f"PDF Error: {e}")
-    return text
-
-def generate_flashcards(file_path):
-    # 1. Extract
-    text = extract_text(file_path)
+        return []
     if not text:
         return []
 
@@ -79,57 +33,7 @@ def generate_flashcards(file_path):
 
     # 3. Call AI
     try:
-        content = ""
-        # Ensure models with ':free' or other provider prefixes go to OpenRouter, not native Google
-        model_is_google_native = "gemini" in AI_MODEL.lower() and ":" not in AI_MODEL
-        model_is_groq_native = any(x in AI_MODEL.lower() for x in ["llama", "mixtral", "gemma"])
-
-        # Try Groq if it's a Groq model
-        if groq_client and model_is_groq_native:
-            try:
-                res = groq_client.chat.completions.create(
-                    model=AI_MODEL,
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                content = res.choices[0].message.content
-            except Exception as e:
-                print(f"Groq SDK Error: {e}")
-
-        # Try Google if it's a Gemini model
-        if not content and google_client and model_is_google_native:
-            try:
-                # Use standard gemini if the requested one isn't 1.5/2.0
-                target_model = AI_MODEL if ("gemini" in AI_MODEL.lower()) else "gemini-flash-latest"
-                res = google_client.models.generate_content(
-                    model=target_model,
-                    contents=prompt
-                )
-                content = res.text
-            except Exception as e:
-                print(f"Google New SDK Error: {e}")
-                if not or_client:
-                    raise e
-
-        # Use OpenRouter for non-Gemini models OR as fallback
-        if not content and or_client:
-            try:
-                res = or_client.chat.completions.create(
-                    model=AI_MODEL,
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                content = res.choices[0].message.content
-            except Exception as e:
-                print(f"OpenRouter Error: {e}")
-                # Secondary fallback to google if primary failed
-                if google_client and not model_is_google_native:
-                    res = google_client.models.generate_content(
-                        model="gemini-flash-latest",
-                        contents=prompt
-                    )
-                    content = res.text
-                else:
-                    raise e
-        
+        content = await call_llm(prompt)
         if not content:
             raise Exception("AI providers failed or returned empty content.")
         
@@ -141,37 +45,10 @@ def generate_flashcards(file_path):
         print(f"AI Card Gen Error: {e}")
         return []
 
-def call_llm(prompt: str) -> str:
+async def call_llm(prompt: str) -> str:
     """Generic helper to call the configured LLM"""
-    content = ""
-    model_is_google_native = "gemini" in AI_MODEL.lower() and ":" not in AI_MODEL
-    model_is_groq_native = any(x in AI_MODEL.lower() for x in ["llama", "mixtral", "gemma"])
-
     try:
-        if groq_client and model_is_groq_native:
-            res = groq_client.chat.completions.create(
-                model=AI_MODEL,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            content = res.choices[0].message.content
-        
-        if not content and google_client and model_is_google_native:
-            target_model = AI_MODEL if ("gemini" in AI_MODEL.lower()) else "gemini-flash-latest"
-            res = google_client.models.generate_content(
-                model=target_model,
-                contents=prompt
-            )
-            content = res.text
-
-        if not content and or_client:
-            res = or_client.chat.completions.create(
-                model=AI_MODEL,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            content = res.choices[0].message.content
-
+        return await acomplete_messages([{"role": "user", "content": prompt}])
     except Exception as e:
         print(f"LLM Call Error: {e}")
         return None
-        
-    return content
@@ -1,13 +1,24 @@
 import os
+import re
+import hashlib
+import time
 import asyncio
 import edge_tts
 from gtts import gTTS
 import uuid
+from tracing import span, start_span
 
 # Audio Storage Path
 DATA_DIR = "data"
 AUDIO_DIR = os.path.join(DATA_DIR, "audio")
-os.makedirs(AUDIO_DIR, exist_ok=True)
+# Synthesized clips keyed by hash of (text, voice), reused across generations
+CLIP_CACHE_DIR = os.path.join(AUDIO_DIR, "clips")
+os.makedirs(CLIP_CACHE_DIR, exist_ok=True)
+
+# Max TTS requests in flight across the process, and clip cache budget
+TTS_MAX_CONCURRENCY = int(os.getenv("TTS_MAX_CONCURRENCY", "4"))
+TTS_CLIP_CACHE_MAX_MB = float(os.getenv("TTS_CLIP_CACHE_MAX_MB", "512"))
+TTS_SEMAPHORE = asyncio.Semaphore(TTS_MAX_CONCURRENCY)
 
 # Voices for Edge TTS (fallback)
 VOICE_HOST_A = "en-US-GuyNeural"      # Male Host
@@ -22,51 +33,59 @@ GTTS_VOICE_MAP = {
     "teacher": {"lang": "en", "tld": "co.in"},  # Indian English (Clear, slightly slower, good for lecturing)
 }
 
-async def generate_speech_file_gtts(text: str, voice_type: str, filename: str) -> str:
+def synthesize_gtts(tts: gTTS) -> bytes:
+    """Runs the gTTS request(s) for one clip and joins the audio parts it streams back."""
+    audio = bytearray()
+    for part in tts.stream():
+        audio += part
+    return bytes(audio)
+
+async def generate_speech_gtts(text: str, voice_type: str) -> bytes:
     """Generates speech using Google TTS (primary, free service)."""
-    ensure_dir = os.path.dirname(filename)
-    if not os.path.exists(ensure_dir):
-        os.makedirs(ensure_dir, exist_ok=True)
-    
     try:
         # Get voice settings
         voice_settings = GTTS_VOICE_MAP.get(voice_type, GTTS_VOICE_MAP["teacher"])
-        
+
         # Generate speech using gTTS
         tts = gTTS(text=text, lang=voice_settings["lang"], tld=voice_settings["tld"], slow=False)
-        
-        # Save to file (run in executor to avoid blocking)
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, tts.save, filename)
-        
+
+        # Run the blocking HTTP calls in executor to avoid blocking
+        loop = asyncio.get_running_loop()
+        audio = await loop.run_in_executor(None, synthesize_gtts, tts)
+        if not audio:
+            raise Exception("gTTS returned no audio")
+
         print(f"✅ Audio generated with gTTS (Google TTS)")
-        return filename
+        return audio
     except Exception as e:
         print(f"❌ gTTS failed: {e}")
         raise
 
-async def generate_speech_file_edge(text: str, voice: str, filename: str) -> str:
+async def _collect_edge_audio(communicate: edge_tts.Communicate) -> bytes:
+    audio = bytearray()
+    async for chunk in communicate.stream():
+        if chunk["type"] == "audio":
+            audio += chunk["data"]
+    return bytes(audio)
+
+async def generate_speech_edge(text: str, voice: str) -> bytes:
     """Generates speech using Edge TTS (fallback service)."""
-    ensure_dir = os.path.dirname(filename)
-    if not os.path.exists(ensure_dir):
-        os.makedirs(ensure_dir, exist_ok=True)
-        
     max_retries = 5
     last_error = None
 
     for attempt in range(max_retries):
         try:
             communicate = edge_tts.Communicate(text, voice)
-            await asyncio.wait_for(communicate.save(filename), timeout=90.0)
+            audio = await asyncio.wait_for(_collect_edge_audio(communicate), timeout=90.0)
             print(f"✅ Audio generated with Edge TTS on attempt {attempt + 1}")
-            return filename
+            return audio
         except asyncio.TimeoutError:
             last_error = "Connection timed out"
             print(f"⚠️ Edge TTS Attempt {attempt + 1}/{max_retries} timed out. Retrying...")
         except Exception as e:
             last_error = str(e)
             print(f"⚠️ Edge TTS Attempt {attempt + 1}/{max_retries} failed: {e}. Retrying...")
-        
+
         if attempt < max_retries - 1:
             delay = 2 ** attempt
             print(f"   Waiting {delay}s before retry...")
@@ -74,93 +93,202 @@ async def generate_speech_file_edge(text: str, voice: str, filename: str) -> str
 
     raise Exception(f"Failed to generate audio with Edge TTS after {max_retries} attempts. Last error: {last_error}")
 
-async def generate_speech_file(text: str, voice: str, filename: str, voice_type: str = "teacher") -> str:
+def _clip_cache_path(text: str, voice: str, voice_type: str) -> str:
+    key = hashlib.sha256(f"{voice_type}\n{voice}\n{text}".encode("utf-8")).hexdigest()
+    return os.path.join(CLIP_CACHE_DIR, f"{key}.mp3")
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def _write_file_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+async def synthesize_speech(text: str, voice: str, voice_type: str = "teacher") -> bytes:
     """
-    Generates speech file with automatic fallback.
+    Returns mp3 bytes for text, served from the clip cache when possible.
     Primary: Google TTS (gTTS) - Free, Reliable, but Robotic
     Fallback: Edge TTS - High Quality, but Unreliable
     """
-    # 1. Try Google TTS (Primary for now due to Edge instability)
+    with span("tts.line", voice_type=voice_type, chars=len(text)) as line:
+        audio = await _synthesize_speech(text, voice, voice_type, line)
+        line.set(bytes=len(audio))
+        return audio
+
+async def _synthesize_speech(text: str, voice: str, voice_type: str, line) -> bytes:
+    loop = asyncio.get_running_loop()
+    cache_path = _clip_cache_path(text, voice, voice_type)
+    if os.path.exists(cache_path):
+        try:
+            audio = await loop.run_in_executor(None, _read_file, cache_path)
+            line.set(cached=True)
+            return audio
+        except OSError as e:
+            print(f"Clip cache read failed: {e}")
+
+    queued_at = time.perf_counter()
+    async with TTS_SEMAPHORE:
+        line.set(queue_ms=round((time.perf_counter() - queued_at) * 1000, 1))
+        # 1. Try Google TTS (Primary for now due to Edge instability)
+        try:
+            print(f"🎤 Attempting audio generation with Google TTS ({voice_type})...")
+            audio = await generate_speech_gtts(text, voice_type)
+            line.set(provider="gtts")
+        except Exception as gtts_error:
+            print(f"⚠️ Google TTS failed: {gtts_error}")
+            # 2. Fallback to Edge TTS if gTTS fails (unlikely)
+            try:
+                print(f"🔄 Falling back to Edge TTS...")
+                audio = await generate_speech_edge(text, voice)
+                line.set(provider="edge")
+            except Exception as edge_error:
+                print(f"❌ Both TTS services failed!")
+                raise Exception(f"All TTS services failed. Google TTS: {gtts_error}, Edge TTS: {edge_error}")
+
+    try:
+        await loop.run_in_executor(None, _write_file_atomic, cache_path, audio)
+    except OSError as e:
+        print(f"Clip cache write failed: {e}")
+    return audio
+
+async def generate_speech_file(text: str, voice: str, filename: str, voice_type: str = "teacher") -> str:
+    """Generates a speech file with automatic fallback (see synthesize_speech)."""
+    ensure_dir = os.path.dirname(filename)
+    if not os.path.exists(ensure_dir):
+        os.makedirs(ensure_dir, exist_ok=True)
+
+    audio = await synthesize_speech(text, voice, voice_type)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, _write_file_atomic, filename, audio)
+    return filename
+
+def prune_clip_cache():
+    """Deletes the least recently written clips once the cache exceeds its budget."""
+    budget = TTS_CLIP_CACHE_MAX_MB * 1024 * 1024
     try:
-        print(f"🎤 Attempting audio generation with Google TTS ({voice_type})...")
-        return await generate_speech_file_gtts(text, voice_type, filename)
-    except Exception as gtts_error:
-        print(f"⚠️ Google TTS failed: {gtts_error}")
-        
-    # 2. Fallback to Edge TTS if gTTS fails (unlikely)
+        clips = [entry for entry in os.scandir(CLIP_CACHE_DIR) if entry.name.endswith(".mp3")]
+    except OSError:
+        return
+    stats = []
+    for entry in clips:
+        try:
+            info = entry.stat()
+        except OSError:
+            # Removed (e.g. by another worker's prune) since the scan
+            continue
+        stats.append((info.st_mtime, info.st_size, entry.path))
+    total = sum(size for _, size, _ in stats)
+    for _, size, path in sorted(stats):
+        if total <= budget:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+def _script_voices(line: dict):
+    speaker = line.get("speaker", "Host A")
+    # Determine voice type for gTTS, Edge TTS voice (fallback)
+    if "Host B" in speaker:
+        return VOICE_HOST_B, "host_b"
+    return VOICE_HOST_A, "host_a"
+
+def split_for_speech(text: str, max_chars: int = 400) -> list:
+    """Splits a monologue into sentence-aligned segments so audio can start early."""
+    sentences = re.split(r'(?<=[.!?])\s+', text.strip())
+    segments, current = [], ""
+    for sentence in sentences:
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            segments.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        segments.append(current)
+    return segments
+
+def audio_output_path(kind: str, deck_id: str = None, options: dict = None) -> str:
+    """Stable output path per deck and mode, so finished files can be reused."""
+    if not deck_id:
+        # Fallback to UUID if no deck_id provided
+        return os.path.join(AUDIO_DIR, f"{kind}_{uuid.uuid4()}.mp3")
+    mode = (options or {}).get("mode", "default")
+    suffix = "" if mode == "default" else f"_{re.sub(r'[^a-zA-Z0-9_-]', '', str(mode))}"
+    return os.path.join(AUDIO_DIR, f"{kind}_{deck_id}{suffix}.mp3")
+
+async def iter_speech_audio(lines: list, output_filename: str):
+    """
+    Takes a list of (text, edge_voice, voice_type) tuples and yields each
+    clip's mp3 bytes in order as soon as it (and every clip before it) is
+    ready, while writing the same bytes to output_filename.
+    """
+    # Synthesize all lines concurrently (bounded by TTS_SEMAPHORE). Identical
+    # (text, voice) pairs share one task, so repeated phrases are made once.
+    tasks = {}
+    ordered = []
+    for text, edge_voice, voice_type in lines:
+        if not text:
+            continue
+        key = (text, edge_voice, voice_type)
+        if key not in tasks:
+            tasks[key] = asyncio.ensure_future(synthesize_speech(text, edge_voice, voice_type))
+        ordered.append(tasks[key])
+
+    # MP3 frames are self-contained, so binary concatenation is a valid merge.
+    # The file only appears under its final name once complete.
+    loop = asyncio.get_running_loop()
+    part_filename = f"{output_filename}.{uuid.uuid4().hex}.part"
+    # Not a context-managed span: the generator may resume in another context
+    merge = start_span("audio.merge", lines=len(ordered), clips=len(tasks))
+    written = 0
     try:
-        print(f"🔄 Falling back to Edge TTS...")
-        return await generate_speech_file_edge(text, voice, filename)
-    except Exception as edge_error:
-        print(f"❌ Both TTS services failed!")
-        raise Exception(f"All TTS services failed. Google TTS: {gtts_error}, Edge TTS: {edge_error}")
+        with open(part_filename, "wb") as outfile:
+            for task in ordered:
+                clip = await task
+                await loop.run_in_executor(None, outfile.write, clip)
+                written += len(clip)
+                yield clip
+        os.replace(part_filename, output_filename)
+    except BaseException as e:
+        merge.fail(e)
+        raise
+    finally:
+        merge.set(bytes=written)
+        merge.end()
+        for task in tasks.values():
+            task.cancel()
+        if os.path.exists(part_filename):
+            os.remove(part_filename)
+
+    await loop.run_in_executor(None, prune_clip_cache)
+
+def podcast_lines(script: list) -> list:
+    return [(line.get("text", ""), *_script_voices(line)) for line in script]
+
+def overview_lines(text: str) -> list:
+    return [(segment, VOICE_TEACHER, "teacher") for segment in split_for_speech(text)]
 
-async def create_podcast_audio(script: list, deck_id: str = None) -> str:
+async def create_podcast_audio(script: list, deck_id: str = None, options: dict = None) -> str:
     """
     Takes a list of dicts: [{"speaker": "Host A", "text": "..."}, ...]
     Returns path to the final merged mp3.
     Uses deck_id for consistent naming if provided.
     """
-    temp_files = []
-    
-    # Generate individual clips
-    for idx, line in enumerate(script):
-        speaker = line.get("speaker", "Host A")
-        text = line.get("text", "")
-        if not text:
-            continue
-        
-        # Determine voice type for gTTS
-        voice_type = "host_b" if "Host B" in speaker else "host_a"
-        # Edge TTS voice (fallback)
-        edge_voice = VOICE_HOST_B if "Host B" in speaker else VOICE_HOST_A
-        
-        # Temp filename
-        temp_filename = os.path.join(AUDIO_DIR, f"temp_{uuid.uuid4()}_{idx}.mp3")
-        await generate_speech_file(text, edge_voice, temp_filename, voice_type)
-        temp_files.append(temp_filename)
-        
-    # Merge using binary concatenation
-    def merge_audio():
-        if deck_id:
-            # Use deck_id for consistent naming
-            output_filename = os.path.join(AUDIO_DIR, f"podcast_{deck_id}.mp3")
-        else:
-            # Fallback to UUID if no deck_id provided
-            output_filename = os.path.join(AUDIO_DIR, f"podcast_{uuid.uuid4()}.mp3")
-        
-        with open(output_filename, 'wb') as outfile:
-            for f in temp_files:
-                try:
-                    with open(f, 'rb') as infile:
-                        outfile.write(infile.read())
-                except Exception as e:
-                    print(f"Error merging clip {f}: {e}")
-        
-        return output_filename
-
-    # Execute merge
-    loop = asyncio.get_event_loop()
-    final_path = await loop.run_in_executor(None, merge_audio)
-    
-    # Cleanup temp files
-    for f in temp_files:
-        if os.path.exists(f):
-            os.remove(f)
-            
-    return final_path
-
-async def create_overview_audio(text: str, deck_id: str = None) -> str:
+    output_filename = audio_output_path("podcast", deck_id, options)
+    async for _ in iter_speech_audio(podcast_lines(script), output_filename):
+        pass
+    return output_filename
+
+async def create_overview_audio(text: str, deck_id: str = None, options: dict = None) -> str:
     """
     Generates a monologue audio file.
     Uses deck_id for consistent naming if provided.
     """
-    if deck_id:
-        # Use deck_id for consistent naming
-        output_filename = os.path.join(AUDIO_DIR, f"overview_{deck_id}.mp3")
-    else:
-        # Fallback to UUID if no deck_id provided
-        output_filename = os.path.join(AUDIO_DIR, f"overview_{uuid.uuid4()}.mp3")
-    
-    await generate_speech_file(text, VOICE_TEACHER, output_filename, "teacher")
+    output_filename = audio_output_path("overview", deck_id, options)
+    async for _ in iter_speech_audio(overview_lines(text), output_filename):
+        pass
     return output_filename
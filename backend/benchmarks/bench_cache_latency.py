@@ -0,0 +1,82 @@
+"""
+Measures p50/p99 latency of cache hits under each latency profile.
+
+Seeds a deck and cached results, then fires concurrent requests at the
+cached endpoints in-process (no LLM or network calls).
+
+Usage (from backend/):
+    python benchmarks/bench_cache_latency.py --requests 200 --concurrency 50
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+import contextlib
+
+# Keep the benchmark self-contained: skip the on-disk cache tier
+os.environ.setdefault("RESPONSE_CACHE_DB", "")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import main
+
+DECK_ID = "bench-deck"
+DECK_TEXT = "Photosynthesis converts light energy into chemical energy. " * 2000
+
+def seed_cache():
+    main.DECK_STORE[DECK_ID] = DECK_TEXT
+    for task_type, result in [
+        ("quiz", {"quiz": [{"question": "Q?", "options": ["A", "B"], "answer": "A", "explanation": "..."}]}),
+        ("flowchart", {"flowchart": "graph TD\nA[\"Root\"]"}),
+        ("report", {"report": "# Report\n\nCached body."}),
+    ]:
+        main.RESPONSE_CACHE.set(main.get_cache_key(DECK_ID, task_type, DECK_TEXT, None if task_type == "report" else {}), result)
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+async def run_profile(profile: str, path: str, total: int, concurrency: int):
+    main.LATENCY = main.LATENCY_PROFILES[profile]
+    transport = httpx.ASGITransport(app=main.app)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                start = time.perf_counter()
+                res = await client.post(path, json={"deck_id": DECK_ID, "deck_name": "Bench", "options": {}})
+                await res.aread()
+                latencies.append(time.perf_counter() - start)
+                assert res.status_code == 200, res.text
+
+        # The endpoints log every hit; keep the report readable
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            wall_start = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(total)))
+            wall = time.perf_counter() - wall_start
+
+    print(
+        f"{profile:<11} {path:<20} n={total:<5} "
+        f"p50={statistics.median(latencies) * 1000:9.1f}ms "
+        f"p99={percentile(latencies, 99) * 1000:9.1f}ms "
+        f"throughput={total / wall:8.1f} req/s"
+    )
+
+async def main_async(args):
+    seed_cache()
+    for profile in args.profiles:
+        for path in args.paths:
+            await run_profile(profile, path, args.requests, args.concurrency)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=25)
+    parser.add_argument("--profiles", nargs="+", default=["theatrical", "fast"], choices=list(main.LATENCY_PROFILES))
+    parser.add_argument("--paths", nargs="+", default=["/generate/quiz", "/generate/flowchart", "/generate/report"])
+    asyncio.run(main_async(parser.parse_args()))
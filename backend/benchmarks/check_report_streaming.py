@@ -0,0 +1,87 @@
+"""
+Regression check: report streaming must not block the event loop.
+
+Starts a local mock LLM (benchmarks/mock_llm_server.py) that streams its
+answer slowly, opens N concurrent POST /generate/report streams (distinct
+decks, so none are coalesced), and meanwhile probes a cheap endpoint
+(GET /cache/stats) on the same event loop. Fails (exit code 1) if any probe
+takes longer than --max-stall seconds or any report comes back empty.
+
+A synchronous stream (the previous stream_report) would stall every probe
+for as long as a report was reading from the network.
+
+Usage (from backend/):
+    python benchmarks/check_report_streaming.py --streams 20 --delay 2.0
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.mock_llm_server import MockLLMServer
+from benchmarks.loadtest_llm_concurrency import configure_env, free_port
+
+async def run_check(args):
+    import httpx
+    import main
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://check", timeout=args.timeout) as client:
+        async def report(i: int) -> str:
+            deck_id = f"report-check-{i}"
+            main.DECK_STORE[deck_id] = f"Report check document {i}. " * 50
+            res = await client.post("/generate/report", json={"deck_id": deck_id, "deck_name": "Check", "options": {}})
+            assert res.status_code == 200, res.text
+            return res.text
+
+        async def probe(stop: asyncio.Event) -> list:
+            latencies = []
+            while not stop.is_set():
+                start = time.perf_counter()
+                res = await client.get("/cache/stats")
+                assert res.status_code == 200, res.text
+                latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(args.probe_interval)
+            return latencies
+
+        stop = asyncio.Event()
+        probe_task = asyncio.ensure_future(probe(stop))
+        start = time.perf_counter()
+        reports = await asyncio.wait_for(asyncio.gather(*(report(i) for i in range(args.streams))), args.timeout)
+        wall = time.perf_counter() - start
+        stop.set()
+        latencies = await probe_task
+
+    empty = [i for i, text in enumerate(reports) if not text.strip() or "[Error" in text]
+    worst = max(latencies) if latencies else 0.0
+    summary = (
+        f"streams={args.streams} wall={wall:.2f}s probes={len(latencies)} "
+        f"probe_max={worst * 1000:.1f}ms probe_avg={sum(latencies) / max(len(latencies), 1) * 1000:.1f}ms "
+        f"failed_reports={len(empty)}"
+    )
+    return worst <= args.max_stall and not empty and len(latencies) > 0, summary
+
+async def main_async(args) -> bool:
+    port = free_port()
+    configure_env(port, args.streams)
+    mock = MockLLMServer(args.delay, stream_chunks=args.chunks)
+    server = await mock.start(port=port)
+    async with server:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            passed, summary = await run_check(args)
+    print(summary)
+    return passed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=2.0, help="mock LLM time to stream one answer, in seconds")
+    parser.add_argument("--chunks", type=int, default=40, help="chunks per mock answer")
+    parser.add_argument("--probe-interval", type=float, default=0.02)
+    parser.add_argument("--max-stall", type=float, default=0.25, help="slowest allowed probe, in seconds")
+    parser.add_argument("--timeout", type=float, default=60)
+    passed = asyncio.run(main_async(parser.parse_args()))
+    print("PASS" if passed else "FAIL")
+    sys.exit(0 if passed else 1)
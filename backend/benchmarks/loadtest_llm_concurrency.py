@@ -0,0 +1,121 @@
+"""
+Load test: how many LLM round-trips can be in flight at once.
+
+Starts a local mock LLM (benchmarks/mock_llm_server.py), points the Groq
+provider at it, and fires N concurrent generations two ways:
+
+  threadpool  sync Groq client wrapped in run_in_threadpool (the previous
+              design; capped by Starlette's 40-thread limiter)
+  async       POST /generate/flowchart through the app, which now awaits
+              the async provider layer
+
+The mock reports the peak number of concurrent requests it saw. Each mode
+imports its modules and sends one warm-up request before the clock starts:
+importing the app takes seconds on a small box and would otherwise be
+counted against the async path.
+
+Usage (from backend/):
+    python benchmarks/loadtest_llm_concurrency.py --requests 200 --delay 1.0
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.mock_llm_server import MockLLMServer
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def configure_env(port: int, concurrency: int):
+    # Must happen before the app modules are imported
+    os.environ.update({
+        "GROQ_API_KEY": "mock-key",
+        "GROQ_BASE_URL": f"http://127.0.0.1:{port}",
+        "AI_MODEL": "llama-3.3-70b-versatile",
+        "GROQ_MAX_CONCURRENCY": str(concurrency),
+        "RESPONSE_CACHE_DB": "",
+        # No graph checkpoints or job table: nothing is written to disk and
+        # no SQLite connection thread outlives the run
+        "GRAPH_CHECKPOINT_DB": "",
+        "JOBS_DB": "",
+        "LATENCY_PROFILE": "fast",
+    })
+    for key in ("OPENROUTER_API_KEY", "GOOGLE_API_KEY"):
+        os.environ[key] = ""
+
+async def prepare_threadpool(port: int):
+    """Returns a coroutine function firing `total` sync calls through the threadpool."""
+    from groq import Groq
+    from fastapi.concurrency import run_in_threadpool
+
+    client = Groq(api_key="mock-key", base_url=f"http://127.0.0.1:{port}")
+
+    def call():
+        return client.chat.completions.create(
+            model="llama-3.3-70b-versatile",
+            messages=[{"role": "user", "content": "TEXT: mock"}]
+        )
+
+    await run_in_threadpool(call)
+
+    async def run(total: int):
+        await asyncio.gather(*(run_in_threadpool(call) for _ in range(total)))
+    return run
+
+async def prepare_async():
+    """Returns a coroutine function firing `total` flowchart generations through the app."""
+    import httpx
+    import main
+    import agent_graph  # imported lazily by the app
+
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://loadtest", timeout=600)
+    decks = 0
+
+    async def one():
+        nonlocal decks
+        decks += 1
+        deck_id = f"loadtest-{decks}"
+        # Unique text per deck so every request is a cache miss
+        main.DECK_STORE[deck_id] = f"Load test document {decks}. " * 50
+        res = await client.post("/generate/flowchart", json={"deck_id": deck_id, "deck_name": "Load", "options": {}})
+        assert res.status_code == 200, res.text
+
+    await one()
+
+    async def run(total: int):
+        await asyncio.gather(*(one() for _ in range(total)))
+    return run
+
+async def main_async(args):
+    port = free_port()
+    configure_env(port, args.requests)
+    mock = MockLLMServer(args.delay)
+    server = await mock.start(port=port)
+
+    async with server:
+        for mode in args.modes:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                run = await (prepare_threadpool(port) if mode == "threadpool" else prepare_async())
+                mock.reset_stats()
+                start = time.perf_counter()
+                await run(args.requests)
+                wall = time.perf_counter() - start
+            print(
+                f"{mode:<11} n={args.requests:<5} delay={args.delay}s "
+                f"peak_in_flight={mock.peak_in_flight:<5} wall={wall:7.2f}s "
+                f"throughput={args.requests / wall:7.1f} req/s"
+            )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=1.0, help="mock LLM response time in seconds")
+    parser.add_argument("--modes", nargs="+", default=["threadpool", "async"], choices=["threadpool", "async"])
+    asyncio.run(main_async(parser.parse_args()))
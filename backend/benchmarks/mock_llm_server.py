@@ -0,0 +1,133 @@
+"""
+Minimal OpenAI-compatible chat-completions server for local load tests.
+
+Every POST is answered after a fixed delay, regardless of path, so it can
+stand in for Groq (GROQ_BASE_URL) and OpenRouter (OPENROUTER_BASE_URL).
+Supports JSON mode and "stream": true (SSE). GET /stats reports the peak
+number of concurrent requests seen.
+
+Usage (from backend/):
+    python benchmarks/mock_llm_server.py --port 8765 --delay 1.0
+"""
+import json
+import time
+import asyncio
+import argparse
+
+MOCK_JSON = {
+    "cards": [{"q": "What does the mock return?", "a": "Canned cards."}],
+    "quiz": [{"question": "Mock?", "options": ["Yes", "No"], "answer": "Yes", "explanation": "It is a mock."}],
+    "slides": [{"title": "Mock Slide", "content": "Canned content", "type": "bullet"}],
+    "rows": [{"Name": "Mock", "Value": "1"}],
+    "script": [{"speaker": "Host A", "text": "Welcome to the mock show."}],
+    "text": "Hello students, this is a mock overview.",
+    "title": "Mock Guide",
+    "summary": "Canned summary.",
+    "questions": ["Mock question?"],
+}
+MOCK_TEXT = 'graph TD\nA["Mock Topic"] --> B["Mock Detail"]'
+
+
+class MockLLMServer:
+    def __init__(self, delay: float, stream_chunks: int = 20):
+        self.delay = delay
+        self.stream_chunks = stream_chunks
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765):
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server
+
+    def reset_stats(self):
+        self.peak_in_flight = 0
+        self.total = 0
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                if method == "GET" and path.startswith("/stats"):
+                    self._send_json(writer, {"peak_in_flight": self.peak_in_flight, "total": self.total})
+                else:
+                    await self._completion(writer, json.loads(body or b"{}"))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _completion(self, writer: asyncio.StreamWriter, payload: dict):
+        self.in_flight += 1
+        self.total += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            json_mode = (payload.get("response_format") or {}).get("type") == "json_object"
+            content = json.dumps(MOCK_JSON) if json_mode else MOCK_TEXT
+            if payload.get("stream"):
+                await self._stream(writer, content)
+            else:
+                await asyncio.sleep(self.delay)
+                self._send_json(writer, {
+                    "id": "mock",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": payload.get("model", "mock"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+                })
+        finally:
+            self.in_flight -= 1
+
+    async def _stream(self, writer: asyncio.StreamWriter, content: str):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        step = max(1, len(content) // self.stream_chunks)
+        for i in range(0, len(content), step):
+            await asyncio.sleep(self.delay / self.stream_chunks)
+            event = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": "mock",
+                     "choices": [{"index": 0, "delta": {"content": content[i:i + step]}, "finish_reason": None}]}
+            self._write_chunk(writer, f"data: {json.dumps(event)}\n\n".encode())
+            await writer.drain()
+        self._write_chunk(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+
+    @staticmethod
+    def _write_chunk(writer: asyncio.StreamWriter, data: bytes):
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    @staticmethod
+    def _send_json(writer: asyncio.StreamWriter, data: dict):
+        body = json.dumps(data).encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            + f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+
+
+async def serve(host: str, port: int, delay: float):
+    mock = MockLLMServer(delay)
+    server = await mock.start(host, port)
+    print(f"Mock LLM listening on http://{host}:{port} (delay {delay}s)")
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=1.0)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.delay))
@@ -0,0 +1,193 @@
+import os
+import re
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+from deck_store import DECKS_DIR, write_json, read_json
+from response_cache import text_digest
+from tracing import span
+
+# --- CHUNKER CONFIG ---
+# Chunks are sized in tokens (not characters) so they fit the target model,
+# computed once per deck text and persisted as offsets next to it.
+CHUNKS_DIR = os.path.join(DECKS_DIR, "chunks")       # {text_hash}.{max_tokens}.json
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")  # "none" = estimate only
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "120"))
+
+# Tokens per chunk for each chunked task, before the model cap below
+TASK_CHUNK_TOKENS = {
+    "cards": int(os.getenv("CARD_CHUNK_TOKENS", "6000")),
+    "summary": int(os.getenv("SUMMARY_CHUNK_TOKENS", "8000")),
+}
+
+# Context windows (tokens) by model name prefix; unknown models get the default
+MODEL_CONTEXT_TOKENS = {
+    "llama-3.3": 131072,
+    "llama-3.1": 131072,
+    "llama3": 8192,
+    "mixtral": 32768,
+    "gemma": 8192,
+    "gemini": 1048576,
+}
+DEFAULT_CONTEXT_TOKENS = 32768
+# Room left for the system prompt and the model's answer
+PROMPT_RESERVE_TOKENS = 4096
+
+os.makedirs(CHUNKS_DIR, exist_ok=True)
+
+# --- TOKEN COUNTING ---
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+def _cached_bpe_path(name: str) -> Optional[str]:
+    """Where tiktoken caches the BPE file for an encoding, if it is there (same layout as tiktoken.load)."""
+    if "TIKTOKEN_CACHE_DIR" in os.environ:
+        cache_dir = os.environ["TIKTOKEN_CACHE_DIR"]
+    elif "DATA_GYM_CACHE_DIR" in os.environ:
+        cache_dir = os.environ["DATA_GYM_CACHE_DIR"]
+    else:
+        cache_dir = os.path.join(tempfile.gettempdir(), "data-gym-cache")
+    if not cache_dir:
+        return None
+    url = f"https://openaipublic.blob.core.windows.net/encodings/{name}.tiktoken"
+    path = os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest())
+    return path if os.path.exists(path) else None
+
+def _get_encoding():
+    """
+    tiktoken's BPE encoding if its file is already in the local tiktoken
+    cache, else None (use the estimate). Never downloads: fetch it at deploy
+    time with python -c "import tiktoken; tiktoken.get_encoding('cl100k_base')".
+    """
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            _encoding_loaded = True
+            if TOKENIZER_ENCODING != "none":
+                if _cached_bpe_path(TOKENIZER_ENCODING) is None:
+                    print(f"Tokenizer {TOKENIZER_ENCODING} is not in the local tiktoken cache, estimating token counts")
+                else:
+                    try:
+                        import tiktoken
+                        _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+                    except Exception as e:
+                        print(f"Tokenizer unavailable ({e.__class__.__name__}), estimating token counts")
+    return _encoding
+
+_ESTIMATE_RE = re.compile(r"\w+|[^\w\s]+")
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # BPE splits long words into several tokens; ~1 token per 6 chars of a word
+    return sum(1 + len(piece) // 6 for piece in _ESTIMATE_RE.findall(text))
+
+def tokenizer_name() -> str:
+    return TOKENIZER_ENCODING if _get_encoding() is not None else "estimate"
+
+def model_context_tokens(model: str) -> int:
+    model = model.lower().split("/")[-1]
+    for prefix, tokens in MODEL_CONTEXT_TOKENS.items():
+        if model.startswith(prefix):
+            return tokens
+    return DEFAULT_CONTEXT_TOKENS
+
+def chunk_token_budget(task: str, model: str) -> int:
+    """Tokens per chunk for a task, capped so a chunk plus prompt fits the model's context."""
+    budget = TASK_CHUNK_TOKENS.get(task, TASK_CHUNK_TOKENS["cards"])
+    return max(256, min(budget, model_context_tokens(model) - PROMPT_RESERVE_TOKENS))
+
+# --- CHUNKING ---
+
+_SEGMENT_RE = re.compile(r".*?(?:\n\s*\n|(?<=[.!?])\s+|$)", re.DOTALL)
+
+def _segments(text: str, max_tokens: int) -> List[List[int]]:
+    """Paragraph/sentence segments as [start, end, tokens]; oversized ones are cut by characters."""
+    segments = []
+    for match in _SEGMENT_RE.finditer(text):
+        start, end = match.span()
+        if start == end:
+            continue
+        tokens = count_tokens(text[start:end])
+        if tokens <= max_tokens:
+            segments.append([start, end, tokens])
+            continue
+        pieces = -(-tokens // max_tokens)
+        step = -(-(end - start) // pieces)
+        for piece_start in range(start, end, step):
+            piece_end = min(piece_start + step, end)
+            segments.append([piece_start, piece_end, count_tokens(text[piece_start:piece_end])])
+    return segments
+
+def chunk_text(text: str, max_tokens: int, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[List[int]]:
+    """
+    Packs whole segments into chunks of at most max_tokens, repeating up to
+    overlap_tokens of trailing segments at the start of the next chunk.
+    Returns [start, end, tokens] per chunk.
+    """
+    overlap_tokens = min(overlap_tokens, max_tokens // 4)
+    chunks, current = [], []
+    current_tokens = 0
+    for segment in _segments(text, max_tokens):
+        if current and current_tokens + segment[2] > max_tokens:
+            chunks.append([current[0][0], current[-1][1], current_tokens])
+            # Carry trailing segments forward as overlap
+            carried, carried_tokens = [], 0
+            for prev in reversed(current):
+                if carried_tokens + prev[2] > overlap_tokens or carried_tokens + prev[2] + segment[2] > max_tokens:
+                    break
+                carried.insert(0, prev)
+                carried_tokens += prev[2]
+            current, current_tokens = carried, carried_tokens
+        current.append(segment)
+        current_tokens += segment[2]
+    if current:
+        chunks.append([current[0][0], current[-1][1], current_tokens])
+    return chunks
+
+# --- CHUNK CACHE ---
+_CHUNKS: "OrderedDict[str, List[List[int]]]" = OrderedDict()
+_CHUNKS_LOCK = threading.Lock()
+_CHUNKS_CACHE_SIZE = 128
+
+def _chunks_path(text_hash: str, max_tokens: int) -> str:
+    return os.path.join(CHUNKS_DIR, f"{text_hash}.{max_tokens}.json")
+
+def get_chunk_spans(text: str, max_tokens: int, text_hash: Optional[str] = None) -> List[List[int]]:
+    """Chunk offsets for this text and budget: memory, then disk, then computed and persisted."""
+    text_hash = text_hash or text_digest(text)
+    key = f"{text_hash}.{max_tokens}"
+    with _CHUNKS_LOCK:
+        spans = _CHUNKS.get(key)
+        if spans is not None:
+            _CHUNKS.move_to_end(key)
+            return spans
+
+    path = _chunks_path(text_hash, max_tokens)
+    data = read_json(path)
+    if data and data.get("tokenizer") == tokenizer_name():
+        spans = data["chunks"]
+    else:
+        with span("chunk", chars=len(text), max_tokens=max_tokens, tokenizer=tokenizer_name()) as timing:
+            spans = chunk_text(text, max_tokens)
+            timing.set(chunks=len(spans))
+        try:
+            write_json(path, {"tokenizer": tokenizer_name(), "max_tokens": max_tokens, "chunks": spans})
+        except OSError as e:
+            print(f"Chunk save failed ({text_hash[:12]}): {e}")
+        print(f"✂️ CHUNKED: {text_hash[:12]} into {len(spans)} chunks of <= {max_tokens} tokens")
+
+    with _CHUNKS_LOCK:
+        _CHUNKS[key] = spans
+        while len(_CHUNKS) > _CHUNKS_CACHE_SIZE:
+            _CHUNKS.popitem(last=False)
+    return spans
+
+def get_chunks(text: str, max_tokens: int, text_hash: Optional[str] = None) -> List[str]:
+    return [text[start:end] for start, end, _ in get_chunk_spans(text, max_tokens, text_hash)]
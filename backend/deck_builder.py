@@ -1,39 +1,147 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
 import genanki
-import random
-
-def create_anki_deck(cards_data, deck_name="FlashDeck"):
-    # 1. Generate Unique ID
-    deck_id = random.randrange(1 << 30, 1 << 31)
-    
-    # 2. Create Deck
-    my_deck = genanki.Deck(deck_id, f"FlashDeck - {deck_name}")
-    
-    # 3. Define Model (Card Style)
-    my_model = genanki.Model(
-        1607392319,
-        'Simple Model',
-        fields=[
-            {'name': 'Question'},
-            {'name': 'Answer'},
-        ],
-        templates=[
-            {
-                'name': 'Card 1',
-                'qfmt': '{{Question}}',
-                'afmt': '{{FrontSide}}<hr id="answer">{{Answer}}',
-            },
-        ])
-
-    # 4. Add Cards
+
+from deck_store import DECKS_DIR, write_atomic, read_json, write_json
+from tracing import span
+
+# --- ANKI EXPORT CONFIG ---
+# Packages are built in memory and content-addressed by (deck, name, cards),
+# so identical exports are built once and concurrent requests never share a
+# file. Built packages are kept in a memory LRU and on disk for later downloads.
+ANKI_DIR = os.path.join(DECKS_DIR, "anki")   # {key}.apkg + {deck_id}.json (latest export)
+ANKI_CACHE_MAX_MB = float(os.getenv("ANKI_CACHE_MAX_MB", "64"))
+
+os.makedirs(ANKI_DIR, exist_ok=True)
+
+# Card style, shared by every package (the model id must stay fixed so Anki
+# recognises re-imports as the same note type)
+ANKI_MODEL = genanki.Model(
+    1607392319,
+    'Simple Model',
+    fields=[
+        {'name': 'Question'},
+        {'name': 'Answer'},
+    ],
+    templates=[
+        {
+            'name': 'Card 1',
+            'qfmt': '{{Question}}',
+            'afmt': '{{FrontSide}}<hr id="answer">{{Answer}}',
+        },
+    ])
+
+def stable_deck_id(deck_id: str) -> int:
+    """Anki deck id derived from our deck id, so re-imports update the same deck."""
+    digest = hashlib.sha256(f"flashdeck:{deck_id}".encode("utf-8")).digest()
+    return (1 << 30) + int.from_bytes(digest[:8], "big") % (1 << 30)
+
+def _deck_key_prefix(deck_id: str) -> str:
+    return hashlib.sha256(f"flashdeck-anki:{deck_id}".encode("utf-8")).hexdigest()[:12]
+
+def package_key(cards_data: List[Dict], deck_name: str, deck_id: str) -> str:
+    """Content key of a package, prefixed with a tag of its deck so a key only serves that deck."""
+    canonical = json.dumps([deck_id, deck_name, [[c.get('q', ''), c.get('a', '')] for c in cards_data]],
+                           ensure_ascii=False, separators=(",", ":"))
+    return _deck_key_prefix(deck_id) + hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+def package_belongs_to(key: str, deck_id: str) -> bool:
+    """Whether key was built for deck_id (see package_key)."""
+    return bool(key) and key.startswith(_deck_key_prefix(deck_id))
+
+def _package_bytes(package: genanki.Package) -> bytes:
+    """The .apkg bytes, via genanki's public write_to_file and a temp file."""
+    fd, path = tempfile.mkstemp(suffix=".apkg")
+    os.close(fd)
+    try:
+        package.write_to_file(path)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+def build_anki_package(cards_data: List[Dict], deck_name: str, deck_id: str) -> bytes:
+    deck = genanki.Deck(stable_deck_id(deck_id), f"FlashDeck - {deck_name}")
     for card in cards_data:
-        note = genanki.Note(
-            model=my_model,
-            fields=[card['q'], card['a']]
-        )
-        my_deck.add_note(note)
-
-    # 5. Save
-    output_filename = "flashdeck_generated.apkg"
-    genanki.Package(my_deck).write_to_file(output_filename)
-    
-    return output_filename
+        deck.add_note(genanki.Note(
+            model=ANKI_MODEL,
+            fields=[card['q'], card['a']],
+            # Same deck and card content -> same note on re-import (no duplicates)
+            guid=genanki.guid_for(deck_id, card['q'], card['a'])
+        ))
+    return _package_bytes(genanki.Package(deck))
+
+# --- PACKAGE CACHE ---
+_PACKAGES: "OrderedDict[str, bytes]" = OrderedDict()
+_PACKAGES_BYTES = 0
+_PACKAGES_LOCK = threading.Lock()
+
+def _remember(key: str, data: bytes):
+    global _PACKAGES_BYTES
+    budget = ANKI_CACHE_MAX_MB * 1024 * 1024
+    with _PACKAGES_LOCK:
+        if key in _PACKAGES or len(data) > budget:
+            return
+        _PACKAGES[key] = data
+        _PACKAGES_BYTES += len(data)
+        while _PACKAGES_BYTES > budget:
+            _, evicted = _PACKAGES.popitem(last=False)
+            _PACKAGES_BYTES -= len(evicted)
+
+def _package_path(key: str) -> str:
+    return os.path.join(ANKI_DIR, f"{key}.apkg")
+
+def get_anki_package(key: str) -> Optional[bytes]:
+    """A built package by key: memory, then disk."""
+    if not key or not key.isalnum():
+        return None
+    with _PACKAGES_LOCK:
+        data = _PACKAGES.get(key)
+        if data is not None:
+            _PACKAGES.move_to_end(key)
+            return data
+    try:
+        with open(_package_path(key), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    _remember(key, data)
+    return data
+
+def latest_anki_export(deck_id: str) -> Optional[Dict]:
+    """{"key", "deck_name", "cards"} of the deck's most recent export, if any."""
+    if not deck_id or os.path.basename(deck_id) != deck_id:
+        return None
+    return read_json(os.path.join(ANKI_DIR, f"{deck_id}.json"))
+
+def create_anki_deck(cards_data, deck_name="FlashDeck", deck_id=None) -> str:
+    """
+    Builds (or reuses) the .apkg for these cards and returns its key; fetch
+    the bytes with get_anki_package(key) or GET /decks/{deck_id}/anki.
+    """
+    source_id = deck_id or deck_name
+    key = package_key(cards_data, deck_name, source_id)
+    with span("anki.package", cards=len(cards_data)) as packaging:
+        if get_anki_package(key) is not None:
+            packaging.set(cached=True)
+        else:
+            data = build_anki_package(cards_data, deck_name, source_id)
+            packaging.set(bytes=len(data))
+            _remember(key, data)
+            try:
+                write_atomic(_package_path(key), data)
+            except OSError as e:
+                print(f"Anki package save failed ({key}): {e}")
+        if deck_id and os.path.basename(deck_id) == deck_id:
+            try:
+                write_json(os.path.join(ANKI_DIR, f"{deck_id}.json"),
+                           {"key": key, "deck_name": deck_name, "cards": len(cards_data)})
+            except OSError as e:
+                print(f"Anki export index failed ({deck_id}): {e}")
+    return key
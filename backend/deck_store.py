@@ -0,0 +1,390 @@
+import os
+import sys
+import json
+import mmap
+import time
+import zlib
+import uuid
+import bisect
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Union
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from response_cache import text_digest
+from shared_state import open_state
+
+# --- STORAGE LAYOUT ---
+# Deck text is content-addressed: each distinct text is stored once,
+# compressed, under its sha256. Deck ids are small JSON references to it,
+# and uploaded files map (by hash of their bytes) to their extracted text,
+# so re-uploading the same PDF skips extraction and naming entirely.
+DATA_DIR = "data"
+DECKS_DIR = os.path.join(DATA_DIR, "decks")          # {deck_id}.json refs (+ legacy {deck_id}.txt)
+BLOBS_DIR = os.path.join(DECKS_DIR, "blobs")         # {text_hash}.txt.blk (+ legacy .txt.z) + {text_hash}.json metadata
+FILES_DIR = os.path.join(DECKS_DIR, "files")         # {file_hash}.json -> extracted text hash
+
+for _dir in (DECKS_DIR, BLOBS_DIR, FILES_DIR):
+    os.makedirs(_dir, exist_ok=True)
+
+def file_digest(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+def write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def read_json(path: str) -> Optional[Dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def write_json(path: str, data: Dict):
+    write_atomic(path, json.dumps(data).encode("utf-8"))
+
+# --- SHARED COPIES ---
+# Workers on one host share these files directly. With a remote shared
+# state (SHARED_STATE_URL=redis://...), every store file written here is
+# also published under its path, and files written on another host are
+# copied in on first use.
+SHARED_DECKS = open_state("decks")
+
+def _store_file(path: str, data: bytes):
+    write_atomic(path, data)
+    if SHARED_DECKS is not None:
+        try:
+            SHARED_DECKS.set(os.path.relpath(path, DECKS_DIR), data)
+        except Exception as e:
+            print(f"Deck store publish failed ({path}): {e}")
+
+def _store_json(path: str, data: Dict):
+    _store_file(path, json.dumps(data).encode("utf-8"))
+
+def _fetch_shared(path: str) -> bool:
+    """Copies a file published by another host into the local store; True if it did."""
+    if SHARED_DECKS is None or os.path.exists(path):
+        return False
+    try:
+        data = SHARED_DECKS.get(os.path.relpath(path, DECKS_DIR))
+    except Exception as e:
+        print(f"Deck store fetch failed ({path}): {e}")
+        return False
+    if data is None:
+        return False
+    write_atomic(path, data)
+    return True
+
+def _read_store_json(path: str) -> Optional[Dict]:
+    data = read_json(path)
+    if data is None and _fetch_shared(path):
+        data = read_json(path)
+    return data
+
+# --- TEXT BLOBS ---
+# A blob is the text cut into TEXT_BLOCK_CHARS blocks, each compressed on its
+# own (zstd when installed, else zlib), behind a JSON index of block offsets.
+# Reading a slice maps the file and decompresses only the blocks it spans, so
+# chat context and other partial reads never inflate the whole deck.
+TEXT_BLOCK_CHARS = 64 * 1024
+BLOB_MAGIC = b"FDT1"  # magic, u32 index length, index JSON, compressed blocks
+
+def _blob_path(text_hash: str) -> str:
+    return os.path.join(BLOBS_DIR, f"{text_hash}.txt.blk")
+
+def _legacy_blob_path(text_hash: str) -> str:
+    # Whole-text zlib blobs written before the block format
+    return os.path.join(BLOBS_DIR, f"{text_hash}.txt.z")
+
+def _encode_blob(text: str) -> bytes:
+    if zstandard is not None:
+        codec, compress = "zstd", zstandard.ZstdCompressor(level=3).compress
+    else:
+        codec, compress = "zlib", lambda data: zlib.compress(data, 6)
+    blocks, data, offset = [], [], 0
+    for start in range(0, max(len(text), 1), TEXT_BLOCK_CHARS):
+        block = compress(text[start:start + TEXT_BLOCK_CHARS].encode("utf-8", "surrogatepass"))
+        blocks.append([start, offset, len(block)])
+        data.append(block)
+        offset += len(block)
+    index = json.dumps({"codec": codec, "chars": len(text), "blocks": blocks}, separators=(",", ":")).encode("utf-8")
+    return BLOB_MAGIC + struct.pack("<I", len(index)) + index + b"".join(data)
+
+
+class TextBlob:
+    """
+    Read-only, mmap-backed view of a stored text. len() and slicing work like
+    on a str (blob[a:b] returns a str), decompressing only the blocks touched.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:4] != BLOB_MAGIC:
+            self._map.close()
+            raise ValueError(f"Not a text blob: {path}")
+        (index_len,) = struct.unpack("<I", self._map[4:8])
+        index = json.loads(self._map[8:8 + index_len])
+        if index["codec"] == "zstd":
+            if zstandard is None:
+                self._map.close()
+                raise RuntimeError("zstandard is required to read this deck text")
+            self._decompress = zstandard.ZstdDecompressor().decompress
+        else:
+            self._decompress = zlib.decompress
+        self._data_start = 8 + index_len
+        self._blocks = index["blocks"]
+        self._starts = [block[0] for block in self._blocks]
+        self._chars = index["chars"]
+        self._cached = (None, "")  # last decompressed block
+
+    def __len__(self) -> int:
+        return self._chars
+
+    def __getitem__(self, key) -> str:
+        if isinstance(key, int):
+            key = slice(key, key + 1 if key != -1 else None)
+        start, end, step = key.indices(self._chars)
+        if step != 1:
+            return self.read(start, end)[::step]
+        return self.read(start, end)
+
+    def _block(self, i: int) -> str:
+        if self._cached[0] != i:
+            _, offset, length = self._blocks[i]
+            begin = self._data_start + offset
+            self._cached = (i, self._decompress(self._map[begin:begin + length]).decode("utf-8", "surrogatepass"))
+        return self._cached[1]
+
+    def read(self, start: int = 0, end: Optional[int] = None) -> str:
+        end = self._chars if end is None else min(end, self._chars)
+        if start >= end:
+            return ""
+        first = bisect.bisect_right(self._starts, start) - 1
+        last = bisect.bisect_right(self._starts, end - 1) - 1
+        parts = [self._block(i) for i in range(first, last + 1)]
+        text = parts[0] if len(parts) == 1 else "".join(parts)
+        offset = self._starts[first]
+        return text[start - offset:end - offset]
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def save_text(text: str) -> str:
+    """Stores text once (block-compressed) and returns its hash."""
+    text_hash = text_digest(text)
+    path = _blob_path(text_hash)
+    if not os.path.exists(path) and not os.path.exists(_legacy_blob_path(text_hash)):
+        _store_file(path, _encode_blob(text))
+    return text_hash
+
+def open_text(text_hash: str) -> Union[TextBlob, str, None]:
+    """A sliceable view of the text: a TextBlob, or the str itself for legacy blobs."""
+    path = _blob_path(text_hash)
+    try:
+        return TextBlob(path)
+    except FileNotFoundError:
+        if _fetch_shared(path):
+            return TextBlob(path)
+    try:
+        with open(_legacy_blob_path(text_hash), "rb") as f:
+            return zlib.decompress(f.read()).decode("utf-8", "surrogatepass")
+    except FileNotFoundError:
+        return None
+
+def load_text(text_hash: str) -> Optional[str]:
+    blob = open_text(text_hash)
+    if isinstance(blob, TextBlob):
+        with blob:
+            return blob.read()
+    return blob
+
+def get_text_meta(text_hash: str) -> Dict:
+    """Metadata shared by every deck with this text (e.g. the generated deck name)."""
+    return _read_store_json(os.path.join(BLOBS_DIR, f"{text_hash}.json")) or {}
+
+def set_text_meta(text_hash: str, **meta):
+    _store_json(os.path.join(BLOBS_DIR, f"{text_hash}.json"), {**get_text_meta(text_hash), **meta})
+
+# --- UPLOADED FILES ---
+
+def find_extracted_text(content_hash: str) -> Optional[str]:
+    """Returns previously extracted text for a file with these bytes, if any."""
+    entry = _read_store_json(os.path.join(FILES_DIR, f"{content_hash}.json"))
+    if entry:
+        return load_text(entry["text_hash"])
+    return None
+
+def remember_extracted_text(content_hash: str, text: str):
+    text_hash = save_text(text)
+    _store_json(os.path.join(FILES_DIR, f"{content_hash}.json"), {"text_hash": text_hash})
+
+# --- DECK REFERENCES ---
+
+def create_deck(text_hash: str, deck_name: str) -> str:
+    deck_id = str(uuid.uuid4())
+    _store_json(os.path.join(DECKS_DIR, f"{deck_id}.json"), {
+        "text_hash": text_hash,
+        "deck_name": deck_name,
+        "created": time.time(),
+    })
+    return deck_id
+
+def get_deck_ref(deck_id: str) -> Optional[Dict]:
+    if not deck_id or os.path.basename(deck_id) != deck_id:
+        return None
+    return _read_store_json(os.path.join(DECKS_DIR, f"{deck_id}.json"))
+
+def _legacy_deck_path(deck_id: str) -> Optional[str]:
+    # Legacy decks stored as plain text per deck id
+    if deck_id and os.path.basename(deck_id) == deck_id:
+        legacy_path = os.path.join(DECKS_DIR, f"{deck_id}.txt")
+        if os.path.exists(legacy_path):
+            return legacy_path
+    return None
+
+def load_deck_text(deck_id: str) -> Optional[str]:
+    ref = get_deck_ref(deck_id)
+    if ref:
+        return load_text(ref["text_hash"])
+
+    legacy_path = _legacy_deck_path(deck_id)
+    if legacy_path:
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            return f.read()
+    return None
+
+# --- HOT DECK CACHE ---
+# Full text of recently used decks, bounded by bytes rather than deck count,
+# so a worker serving tens of thousands of decks keeps a fixed footprint.
+# Entries are keyed by text hash (decks sharing a text share one entry);
+# an evicted deck costs one blob read on its next use.
+DECK_STORE_MAX_MB = float(os.getenv("DECK_STORE_MAX_MB", "256"))
+DECK_DIGESTS_MAX = 100_000  # deck_id -> text hash entries kept (~100 bytes each)
+
+
+class DeckTextCache:
+    def __init__(self, max_mb: float):
+        self.budget = int(max_mb * 1024 * 1024)
+        self._texts: "OrderedDict[str, str]" = OrderedDict()     # text_hash -> text
+        self._digests: "OrderedDict[str, str]" = OrderedDict()   # deck_id -> text_hash
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def digest(self, deck_id: str) -> Optional[str]:
+        """The deck's text hash, from memory or its reference on disk."""
+        with self._lock:
+            text_hash = self._digests.get(deck_id)
+            if text_hash is not None:
+                self._digests.move_to_end(deck_id)
+                return text_hash
+        ref = get_deck_ref(deck_id)
+        if not ref:
+            return None
+        self._remember_digest(deck_id, ref["text_hash"])
+        return ref["text_hash"]
+
+    def _remember_digest(self, deck_id: str, text_hash: str):
+        with self._lock:
+            self._digests[deck_id] = text_hash
+            self._digests.move_to_end(deck_id)
+            while len(self._digests) > DECK_DIGESTS_MAX:
+                self._digests.popitem(last=False)
+
+    def put(self, deck_id: str, text: str, text_hash: str = None):
+        text_hash = text_hash or text_digest(text)
+        self._remember_digest(deck_id, text_hash)
+        size = sys.getsizeof(text)
+        with self._lock:
+            if text_hash in self._texts or size > self.budget:
+                return
+            self._texts[text_hash] = text
+            self._bytes += size
+            while self._bytes > self.budget:
+                _, evicted = self._texts.popitem(last=False)
+                self._bytes -= sys.getsizeof(evicted)
+
+    def _hot(self, text_hash: str) -> Optional[str]:
+        with self._lock:
+            text = self._texts.get(text_hash)
+            if text is not None:
+                self._texts.move_to_end(text_hash)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return text
+
+    def get_cached(self, deck_id: str) -> Optional[str]:
+        """The deck's text if this worker has it in memory, else None; never touches disk or shared state."""
+        with self._lock:
+            text_hash = self._digests.get(deck_id)
+            text = self._texts.get(text_hash) if text_hash is not None else None
+            if text is not None:
+                self._digests.move_to_end(deck_id)
+                self._texts.move_to_end(text_hash)
+                self.hits += 1
+            return text
+
+    def get(self, deck_id: str, default=None) -> Optional[str]:
+        """The deck's full text (cached), or default if the deck does not exist."""
+        text_hash = self.digest(deck_id)
+        if text_hash:
+            text = self._hot(text_hash)
+            if text is None:
+                text = load_text(text_hash)
+        else:
+            text = load_deck_text(deck_id)
+        if text is None:
+            return default
+        self.put(deck_id, text, text_hash)
+        return text
+
+    def open(self, deck_id: str) -> Union[TextBlob, str, None]:
+        """
+        A sliceable view of the deck's text for partial reads: the hot str if
+        cached, else an mmap-backed TextBlob (not added to the cache).
+        """
+        text_hash = self.digest(deck_id)
+        if not text_hash:
+            return self.get(deck_id)
+        return self._hot(text_hash) or open_text(text_hash)
+
+    def __contains__(self, deck_id: str) -> bool:
+        return bool(self.digest(deck_id) or _legacy_deck_path(deck_id))
+
+    def __getitem__(self, deck_id: str) -> str:
+        text = self.get(deck_id)
+        if text is None:
+            raise KeyError(deck_id)
+        return text
+
+    def __setitem__(self, deck_id: str, text: str):
+        self.put(deck_id, text)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "decks": len(self._texts),
+                "bytes": self._bytes,
+                "budget_bytes": self.budget,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
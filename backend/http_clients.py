@@ -0,0 +1,138 @@
+import os
+import threading
+from typing import Dict
+
+import httpx
+
+# --- CONNECTION POOL CONFIG ---
+# One set of keep-alive pools per provider, shared by every SDK client in the
+# process (direct clients and LangChain wrappers), so calls reuse warm
+# TCP/TLS connections instead of handshaking per request.
+POOL_DEFAULTS = {"max_connections": 200, "max_keepalive": 50}
+PROVIDER_POOLS = {
+    "groq": {"max_connections": int(os.getenv("GROQ_POOL_SIZE", "200"))},
+    "openrouter": {"max_connections": int(os.getenv("OPENROUTER_POOL_SIZE", "200"))},
+    "google": {"max_connections": int(os.getenv("GOOGLE_POOL_SIZE", "200"))},
+}
+POOL_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+LLM_HTTP_TIMEOUT = httpx.Timeout(float(os.getenv("LLM_HTTP_TIMEOUT", "120")), connect=10.0)
+
+def _http2_available() -> bool:
+    if os.getenv("HTTP2_ENABLED", "1") in ("0", "false", "False"):
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+HTTP2_ENABLED = _http2_available()
+
+
+class PoolStats:
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self.requests = 0
+        self.in_flight = 0
+        self.waits = 0  # requests that arrived while every connection was busy
+
+
+def _count_request(stats: PoolStats):
+    stats.requests += 1
+    if stats.in_flight >= stats.max_connections:
+        stats.waits += 1
+    stats.in_flight += 1
+
+
+class _CountingAsyncTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, stats: PoolStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    async def handle_async_request(self, request):
+        _count_request(self.stats)
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            self.stats.in_flight -= 1
+
+
+class _CountingTransport(httpx.HTTPTransport):
+    def __init__(self, stats: PoolStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    def handle_request(self, request):
+        _count_request(self.stats)
+        try:
+            return super().handle_request(request)
+        finally:
+            self.stats.in_flight -= 1
+
+
+class ClientRegistry:
+    """Process-wide HTTP clients, created lazily, one pool per provider and mode."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: Dict[str, object] = {}
+
+    def _limits(self, provider: str) -> httpx.Limits:
+        config = {**POOL_DEFAULTS, **PROVIDER_POOLS.get(provider, {})}
+        return httpx.Limits(
+            max_connections=config["max_connections"],
+            max_keepalive_connections=min(config["max_keepalive"], config["max_connections"]),
+            keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+        )
+
+    def _get(self, key: str, factory):
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = factory()
+                self._clients[key] = client
+            return client
+
+    def async_client(self, provider: str) -> httpx.AsyncClient:
+        def factory():
+            limits = self._limits(provider)
+            transport = _CountingAsyncTransport(PoolStats(limits.max_connections), http2=HTTP2_ENABLED, limits=limits)
+            return httpx.AsyncClient(transport=transport, timeout=LLM_HTTP_TIMEOUT, follow_redirects=True)
+        return self._get(f"{provider}:async", factory)
+
+    def sync_client(self, provider: str) -> httpx.Client:
+        def factory():
+            limits = self._limits(provider)
+            transport = _CountingTransport(PoolStats(limits.max_connections), http2=HTTP2_ENABLED, limits=limits)
+            return httpx.Client(transport=transport, timeout=LLM_HTTP_TIMEOUT, follow_redirects=True)
+        return self._get(f"{provider}:sync", factory)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            clients = dict(self._clients)
+        report = {"http2": HTTP2_ENABLED}
+        for key, client in clients.items():
+            transport = client._transport
+            connections = transport._pool.connections
+            stats = transport.stats
+            report[key] = {
+                "open": len(connections),
+                "idle": sum(1 for c in connections if c.is_idle()),
+                "max_connections": stats.max_connections,
+                "in_flight": stats.in_flight,
+                "requests": stats.requests,
+                "waits": stats.waits,
+            }
+        return report
+
+    async def aclose(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            if isinstance(client, httpx.AsyncClient):
+                await client.aclose()
+            else:
+                client.close()
+
+CLIENTS = ClientRegistry()
@@ -0,0 +1,521 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import ipaddress
+import threading
+import contextvars
+from urllib.parse import urlsplit
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+# --- JOB QUEUE CONFIG ---
+# Long-running generations (audio, large card decks) run as background jobs:
+# submit returns a job id at once, clients poll GET /jobs/{id} or follow
+# GET /jobs/{id}/events. Jobs live in SQLite, shared by every worker process:
+# queued and interrupted jobs are picked up again after a restart, and a job
+# started by one worker can be followed from any other.
+JOBS_DB = os.getenv("JOBS_DB", os.path.join("data", "jobs.db"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Finished jobs (and their results) are kept this long for polling
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(24 * 3600)))
+JOB_WEBHOOK_TIMEOUT = float(os.getenv("JOB_WEBHOOK_TIMEOUT", "10"))
+# Webhooks to private, loopback and link-local addresses are refused unless
+# this is set (e.g. a receiver on the same host during development)
+JOB_WEBHOOK_ALLOW_PRIVATE = os.getenv("JOB_WEBHOOK_ALLOW_PRIVATE", "0") in ("1", "true", "True")
+# A running job's owner renews its lease every JOB_LEASE_TTL / 3; once it
+# lapses (the process died) another worker takes the job over
+JOB_LEASE_TTL = float(os.getenv("JOB_LEASE_TTL", "30"))
+# A job whose worker keeps dying (e.g. a deck that exhausts memory) is failed
+# after this many runs instead of being taken over again
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# How often idle workers look for jobs queued by other processes, and how
+# often event streams re-read jobs run elsewhere (seconds)
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+# Progress ticks are written to the table at most this often per job (seconds)
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", "0.5"))
+
+ACTIVE_STATES = ("queued", "running")
+FINAL_STATES = ("succeeded", "failed")
+
+# The job the current task is working for; report_progress() is a no-op outside a job
+_CURRENT_JOB: contextvars.ContextVar = contextvars.ContextVar("current_job", default=None)
+
+def report_progress(stage: str = None, total: int = None, advance: int = 0):
+    """
+    Updates the running job's progress, e.g. report_progress("tts", total=40)
+    when a stage starts and report_progress(advance=1) per line synthesized.
+    """
+    job_id = _CURRENT_JOB.get()
+    if job_id is not None:
+        JOBS.progress(job_id, stage, total, advance)
+
+
+async def check_webhook_url(url: str) -> str:
+    """
+    Returns the address to deliver to if url is an http(s) URL whose host
+    resolves only to public addresses, else raises ValueError. Checked on
+    submit and again before each delivery, and the delivery connects to the
+    address checked here, so a host re-pointed at an internal address
+    (between submit and delivery, or between check and connect) is refused.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("Webhook URL must be an http(s) URL")
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = await asyncio.get_running_loop().getaddrinfo(parts.hostname, port)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Webhook host does not resolve: {e}")
+    if not infos:
+        raise ValueError("Webhook host does not resolve")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if getattr(address, "ipv4_mapped", None):
+            address = address.ipv4_mapped
+        if not JOB_WEBHOOK_ALLOW_PRIVATE and (not address.is_global or address.is_multicast):
+            raise ValueError(f"Webhook host resolves to a non-public address ({address})")
+    return infos[0][4][0]
+
+
+async def post_webhook(url: str, payload: Dict) -> httpx.Response:
+    """
+    POSTs payload to url at the address check_webhook_url vetted. The request
+    goes to that IP with the original Host header and TLS server name (so the
+    certificate is still verified against the hostname), on a connection of
+    its own: a pooled one could carry another webhook host's TLS session.
+    """
+    address = await check_webhook_url(url)
+    parts = urlsplit(url)
+    ip = ipaddress.ip_address(address.split("%")[0])
+    host = f"[{ip}]" if ip.version == 6 else str(ip)
+    netloc = f"{host}:{parts.port}" if parts.port else host
+    pinned = parts._replace(netloc=netloc).geturl()
+    host_header = parts.netloc.rsplit("@", 1)[-1]  # userinfo never goes in Host
+    async with httpx.AsyncClient(timeout=JOB_WEBHOOK_TIMEOUT, follow_redirects=False) as client:
+        # A redirect could point anywhere, so it is not followed
+        return await client.post(
+            pinned, json=payload, headers={"Host": host_header},
+            extensions={"sni_hostname": parts.hostname},
+        )
+
+
+class JobQueue:
+    """
+    Bounded worker pool over a job table shared by every worker process.
+    Workers claim queued jobs, and running jobs whose owner stopped renewing
+    its lease (a crashed or stopped process), so a job runs in one process
+    at a time. Jobs with the same key (task + deck + options) share one run
+    while queued or running.
+    """
+
+    def __init__(self, db_path: str, workers: int):
+        self.workers = workers
+        self.worker_id = uuid.uuid4().hex
+        self._handlers: Dict[str, Callable[[Dict], Awaitable[Dict]]] = {}
+        self._running: Dict[str, Dict] = {}  # jobs this process is running
+        self._changed: Dict[str, asyncio.Event] = {}
+        self._flushes: Dict[str, asyncio.Task] = {}  # pending progress saves
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._lock = threading.Lock()
+
+        self._db = None
+        if db_path:
+            try:
+                os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+                self._db = self._connect(db_path)
+            except Exception as e:
+                print(f"Job persistence disabled: {e}")
+        if self._db is None:
+            # Same code path, but jobs live only as long as this process
+            self._db = self._connect(":memory:")
+
+    @staticmethod
+    def _connect(path: str) -> sqlite3.Connection:
+        db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10.0)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, key TEXT NOT NULL, state TEXT NOT NULL, "
+            "data TEXT NOT NULL, updated_at REAL NOT NULL, owner TEXT, lease_until REAL)"
+        )
+        columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, state)")
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, updated_at)")
+        # One queued/running job per key, across every worker process
+        db.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_key ON jobs (key) "
+            "WHERE state IN ('queued', 'running')"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS job_webhooks ("
+            "job_id TEXT NOT NULL, url TEXT NOT NULL, PRIMARY KEY (job_id, url))"
+        )
+        return db
+
+    def register(self, kind: str, handler: Callable[[Dict], Awaitable[Dict]]):
+        """handler(job) runs the work and returns the job's result dict."""
+        self._handlers[kind] = handler
+
+    @property
+    def kinds(self) -> List[str]:
+        return list(self._handlers)
+
+    # --- PERSISTENCE ---
+
+    def _write(self, job_id: str, state: str, data: str, updated_at: float) -> bool:
+        """Writes a job this process runs; a job whose lease was taken over is left alone."""
+        final = state in FINAL_STATES
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET state = ?, data = ?, updated_at = ?, "
+                "owner = CASE WHEN ? THEN NULL ELSE owner END, "
+                "lease_until = CASE WHEN ? THEN NULL ELSE lease_until END "
+                "WHERE id = ? AND owner = ?",
+                (state, data, updated_at, final, final, job_id, self.worker_id)
+            )
+        return cursor.rowcount > 0
+
+    async def _save(self, job: Dict) -> bool:
+        # Serialized here, on the loop, so the thread never sees the job mid-update
+        data = json.dumps(job, default=str)
+        try:
+            return await asyncio.to_thread(self._write, job["id"], job["state"], data, job["updated_at"])
+        except Exception as e:
+            print(f"Job save failed ({job['id']}): {e}")
+            return False
+
+    async def _flush_progress(self, job: Dict):
+        """Saves a job's progress at most once per JOB_PROGRESS_INTERVAL."""
+        try:
+            await asyncio.sleep(JOB_PROGRESS_INTERVAL)
+        finally:
+            self._flushes.pop(job["id"], None)
+        await self._save(job)
+
+    def _load(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute("SELECT data, state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = json.loads(row[0])
+        job["state"] = row[1]
+        return job
+
+    def _webhooks(self, job_id: str) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT url FROM job_webhooks WHERE job_id = ?", (job_id,))]
+
+    def _insert(self, job: Dict, webhook_url: Optional[str]) -> Dict:
+        """Inserts the job, or returns the queued/running job with its key (any process)."""
+        with self._lock:
+            for _ in range(3):
+                try:
+                    self._db.execute(
+                        "INSERT INTO jobs (id, key, state, data, updated_at) VALUES (?, ?, ?, ?, ?)",
+                        (job["id"], job["key"], job["state"], json.dumps(job, default=str), job["updated_at"])
+                    )
+                    active = job
+                    break
+                except sqlite3.IntegrityError:
+                    row = self._db.execute(
+                        "SELECT data, state FROM jobs WHERE key = ? AND state IN (?, ?)", (job["key"], *ACTIVE_STATES)
+                    ).fetchone()
+                    if row is None:
+                        continue  # it finished in between; try again
+                    active = {**json.loads(row[0]), "state": row[1]}
+                    print(f"🔗 JOB DEDUP: {job['key']} -> {active['id']}")
+                    break
+            else:
+                raise RuntimeError(f"Could not queue job {job['key']}")
+            if webhook_url:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO job_webhooks (job_id, url) VALUES (?, ?)", (active["id"], webhook_url)
+                )
+        return active
+
+    def _claim(self) -> Optional[Dict]:
+        """Takes the oldest queued job, or a running one whose lease expired."""
+        now = time.time()
+        claimable = (
+            "state = 'queued' OR (state = 'running' AND (lease_until IS NULL OR lease_until < ?))"
+        )
+        with self._lock:
+            # Cheap read first, so idle polling never takes the write lock
+            if self._db.execute(f"SELECT 1 FROM jobs WHERE {claimable} LIMIT 1", (now,)).fetchone() is None:
+                return None
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    f"SELECT data, state FROM jobs WHERE {claimable} ORDER BY updated_at LIMIT 1", (now,)
+                ).fetchone()
+                if row is None:
+                    self._db.execute("COMMIT")
+                    return None
+                job = json.loads(row[0])
+                if row[1] == "running" and job.get("attempts", 0) >= JOB_MAX_ATTEMPTS:
+                    # Every run so far died with its worker; don't take another one down
+                    print(f"❌ JOB ABANDONED: {job['kind']} {job['id']} after {job['attempts']} attempts")
+                    job.update(state="failed", error=f"Gave up after {job['attempts']} attempts (worker lost)",
+                               finished_at=now, updated_at=now)
+                    job["progress"]["stage"] = "failed"
+                    self._db.execute(
+                        "UPDATE jobs SET state = 'failed', owner = NULL, lease_until = NULL, data = ?, updated_at = ? "
+                        "WHERE id = ?",
+                        (json.dumps(job, default=str), now, job["id"])
+                    )
+                    self._db.execute("COMMIT")
+                    return job
+                if row[1] == "running":
+                    print(f"♻️ JOB RECOVERED: {job['kind']} {job['id']} (previous worker's lease expired)")
+                job.update(state="running", started_at=now, updated_at=now, attempts=job.get("attempts", 0) + 1)
+                job["progress"].update(stage="started", done=0, total=None)
+                self._db.execute(
+                    "UPDATE jobs SET state = 'running', owner = ?, lease_until = ?, data = ?, updated_at = ? WHERE id = ?",
+                    (self.worker_id, now + JOB_LEASE_TTL, json.dumps(job, default=str), now, job["id"])
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return job
+
+    def _release(self, job: Dict):
+        """Hands a job this process was running back to the queue (shutdown)."""
+        job["state"] = "queued"
+        # A clean shutdown is not a failed attempt
+        job["attempts"] = max(job.get("attempts", 1) - 1, 0)
+        job["progress"].update(stage="queued", done=0, total=None)
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = 'queued', owner = NULL, lease_until = NULL, data = ?, updated_at = ? "
+                "WHERE id = ? AND owner = ?",
+                (json.dumps(job, default=str), time.time(), job["id"], self.worker_id)
+            )
+
+    def _renew_leases(self):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE owner = ? AND state = 'running'",
+                (time.time() + JOB_LEASE_TTL, self.worker_id)
+            )
+
+    def _purge(self):
+        cutoff = time.time() - JOB_RETENTION
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM job_webhooks WHERE job_id IN "
+                "(SELECT id FROM jobs WHERE state IN (?, ?) AND updated_at < ?)", (*FINAL_STATES, cutoff)
+            )
+            self._db.execute("DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?", (*FINAL_STATES, cutoff))
+
+    # --- LIFECYCLE ---
+
+    async def start(self):
+        """Starts the workers; they also pick up jobs left behind by stopped or crashed workers."""
+        if self._wakeup is not None:
+            return
+        self._wakeup = asyncio.Event()
+        await asyncio.to_thread(self._purge)
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._heartbeat()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._wakeup = None
+
+    # --- API ---
+
+    async def submit(self, kind: str, key: str, params: Dict, webhook_url: str = None) -> Dict:
+        """Queues a job, or returns the queued/running job with the same key."""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        await self.start()
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "key": key,
+            "state": "queued",
+            "params": params,
+            "progress": {"stage": "queued", "done": 0, "total": None},
+            "result": None,
+            "error": None,
+            "attempts": 0,
+            "created_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "updated_at": now,
+        }
+        active = await asyncio.to_thread(self._insert, job, webhook_url)
+        if active is job:
+            print(f"📥 JOB QUEUED: {kind} {job['id']}")
+            self._wakeup.set()
+        return self._running.get(active["id"], active)
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        return self._running.get(job_id) or await asyncio.to_thread(self._load, job_id)
+
+    def progress(self, job_id: str, stage: str = None, total: int = None, advance: int = 0):
+        job = self._running.get(job_id)
+        if job is None:
+            return
+        progress = job["progress"]
+        if stage is not None and stage != progress["stage"]:
+            progress.update(stage=stage, done=0, total=None)
+        if total is not None:
+            progress["total"] = total
+        progress["done"] += advance
+        job["updated_at"] = time.time()
+        # Local event streams see every tick; the table (other workers) is
+        # updated in batches, off the event loop
+        self._notify(job_id)
+        if job_id not in self._flushes:
+            self._flushes[job_id] = asyncio.ensure_future(self._flush_progress(job))
+
+    async def events(self, job_id: str):
+        """
+        Yields a snapshot of the job on every change until it finishes. Jobs
+        run by another worker process are followed by polling the table.
+        """
+        last_update = None
+        while True:
+            # Each notify sets and replaces the event, so no local update is missed
+            changed = self._changed.setdefault(job_id, asyncio.Event())
+            job = self._running.get(job_id) or await asyncio.to_thread(self._load, job_id)
+            if job is None:
+                return
+            if job["updated_at"] != last_update:
+                last_update = job["updated_at"]
+                yield public_job(job)
+            if job["state"] in FINAL_STATES:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def _notify(self, job_id: str):
+        changed = self._changed.pop(job_id, None)
+        if changed is not None:
+            changed.set()
+
+    def _count_states(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    async def stats(self) -> Dict:
+        states = await asyncio.to_thread(self._count_states)
+        return {
+            "workers": self.workers,
+            "worker_id": self.worker_id,
+            "running": self._wakeup is not None,
+            "running_here": len(self._running),
+            "waiting": states.get("queued", 0),
+            "jobs": states,
+        }
+
+    # --- WORKERS ---
+
+    async def _worker(self):
+        while True:
+            job = await asyncio.to_thread(self._claim)
+            if job is None:
+                # Woken at once by a local submit; jobs from other processes are polled
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            if job["state"] == "failed":
+                self._notify(job["id"])
+                await self._send_webhooks(job)
+                continue
+            await self._run(job)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(JOB_LEASE_TTL / 3)
+            try:
+                await asyncio.to_thread(self._renew_leases)
+            except Exception as e:
+                print(f"Job lease renewal failed: {e}")
+
+    async def _run(self, job: Dict):
+        self._running[job["id"]] = job
+        self._notify(job["id"])
+        print(f"🏃 JOB START: {job['kind']} {job['id']}")
+
+        token = _CURRENT_JOB.set(job["id"])
+        try:
+            job["result"] = await self._handlers[job["kind"]](job)
+            job["state"] = "succeeded"
+        except asyncio.CancelledError:
+            # Shutdown: hand it back so another worker (or the next start) picks it up
+            flush = self._flushes.pop(job["id"], None)
+            if flush is not None:
+                flush.cancel()
+            self._running.pop(job["id"], None)
+            self._release(job)
+            raise
+        except Exception as e:
+            print(f"❌ JOB FAILED: {job['kind']} {job['id']}: {e}")
+            job.update(state="failed", error=str(e))
+        finally:
+            _CURRENT_JOB.reset(token)
+
+        flush = self._flushes.pop(job["id"], None)
+        if flush is not None:
+            flush.cancel()
+        job["finished_at"] = job["updated_at"] = time.time()
+        job["progress"]["stage"] = job["state"]
+        if not await self._save(job):
+            print(f"Job {job['id']} is no longer owned by this worker; result dropped")
+        self._running.pop(job["id"], None)
+        self._notify(job["id"])
+        print(f"✅ JOB {job['state'].upper()}: {job['kind']} {job['id']} in {job['finished_at'] - job['started_at']:.1f}s")
+        await self._send_webhooks(job)
+
+    async def _send_webhooks(self, job: Dict):
+        webhooks = await asyncio.to_thread(self._webhooks, job["id"])
+        if not webhooks:
+            return
+        payload = public_job(job)
+        for url in webhooks:
+            try:
+                res = await post_webhook(url, payload)
+                if res.is_redirect:
+                    print(f"Job webhook {url} redirected; not followed")
+                elif res.status_code >= 400:
+                    print(f"Job webhook {url} returned {res.status_code}")
+            except Exception as e:
+                print(f"Job webhook {url} failed: {e}")
+
+
+def public_job(job: Dict) -> Dict:
+    """The job as returned to clients (no internal key or webhook URLs)."""
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "state": job["state"],
+        "progress": job["progress"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+
+JOBS = JobQueue(JOBS_DB, JOB_WORKERS)
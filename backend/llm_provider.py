@@ -0,0 +1,223 @@
+import os
+import json
+import asyncio
+from typing import AsyncIterator, Dict, List
+
+from dotenv import load_dotenv
+from groq import AsyncGroq
+from openai import AsyncOpenAI
+from google import genai
+from google.genai import types as genai_types
+from http_clients import CLIENTS
+from llm_router import ProviderRouter
+from tracing import span, record_llm_usage
+
+# Load env
+from pathlib import Path
+env_path = Path(__file__).parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+# --- PROVIDER CONFIG ---
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+AI_MODEL = os.getenv("AI_MODEL", "llama-3.3-70b-versatile")
+
+# Base URL overrides (e.g. to point at a local mock server for load tests)
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL") or None
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+
+DEFAULT_GROQ_MODEL = "llama-3.3-70b-versatile"
+DEFAULT_GOOGLE_MODEL = "gemini-flash-latest"
+
+# Max in-flight requests per provider, shared by every request in the process
+PROVIDER_MAX_CONCURRENCY = {
+    "groq": int(os.getenv("GROQ_MAX_CONCURRENCY", "32")),
+    "openrouter": int(os.getenv("OPENROUTER_MAX_CONCURRENCY", "32")),
+    "google": int(os.getenv("GOOGLE_MAX_CONCURRENCY", "32")),
+}
+
+def is_groq_model(model: str) -> bool:
+    return any(x in model.lower() for x in ["llama", "mixtral", "gemma"])
+
+def is_google_model(model: str) -> bool:
+    # Models with ':free' or other provider prefixes go to OpenRouter, not native Google
+    return "gemini" in model.lower() and ":" not in model
+
+def build_messages(system: str, user: str) -> List[Dict]:
+    return [{"role": "system", "content": system}, {"role": "user", "content": user}]
+
+
+class LLMProvider:
+    """Async chat-completion provider. Messages use the OpenAI role/content format."""
+
+    name = "base"
+
+    def __init__(self, model: str):
+        self.model = model
+        self.limit = asyncio.Semaphore(PROVIDER_MAX_CONCURRENCY.get(self.name, 32))
+
+    async def acomplete(self, messages: List[Dict], json_mode: bool = False) -> str:
+        async with self.limit:
+            return await self._complete(messages, json_mode)
+
+    async def astream(self, messages: List[Dict]) -> AsyncIterator[str]:
+        async with self.limit:
+            async for text in self._stream(messages):
+                yield text
+
+    async def _complete(self, messages: List[Dict], json_mode: bool) -> str:
+        raise NotImplementedError
+
+    async def _stream(self, messages: List[Dict]) -> AsyncIterator[str]:
+        raise NotImplementedError
+        yield
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """Groq and OpenRouter both speak the OpenAI chat-completions API."""
+
+    def __init__(self, model: str, client):
+        super().__init__(model)
+        self.client = client
+
+    async def _complete(self, messages: List[Dict], json_mode: bool) -> str:
+        kwargs = {"response_format": {"type": "json_object"}} if json_mode else {}
+        res = await self.client.chat.completions.create(model=self.model, messages=messages, **kwargs)
+        usage = getattr(res, "usage", None)
+        if usage is not None:
+            record_llm_usage(self.name, self.model, usage.prompt_tokens or 0, usage.completion_tokens or 0)
+        return res.choices[0].message.content
+
+    async def _stream(self, messages: List[Dict]) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(model=self.model, messages=messages, stream=True)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class GroqProvider(OpenAICompatibleProvider):
+    name = "groq"
+
+    def __init__(self, model: str):
+        client = AsyncGroq(
+            api_key=GROQ_API_KEY,
+            base_url=GROQ_BASE_URL,
+            max_retries=0,  # retries and failover are handled by the router
+            http_client=CLIENTS.async_client("groq")
+        )
+        super().__init__(model, client)
+
+
+class OpenRouterProvider(OpenAICompatibleProvider):
+    name = "openrouter"
+
+    def __init__(self, model: str):
+        client = AsyncOpenAI(
+            base_url=OPENROUTER_BASE_URL,
+            api_key=OPENROUTER_API_KEY,
+            max_retries=0,
+            http_client=CLIENTS.async_client("openrouter"),
+            default_headers={
+                "HTTP-Referer": "http://localhost:5173",
+                "X-Title": "FlashDeck"
+            }
+        )
+        super().__init__(model, client)
+
+
+class GoogleProvider(LLMProvider):
+    name = "google"
+
+    def __init__(self, model: str):
+        super().__init__(model)
+        self.client = genai.Client(
+            api_key=GOOGLE_API_KEY,
+            http_options=genai_types.HttpOptions(
+                httpx_client=CLIENTS.sync_client("google"),
+                httpx_async_client=CLIENTS.async_client("google")
+            )
+        )
+
+    def _request(self, messages: List[Dict], json_mode: bool = False) -> Dict:
+        system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+        contents = [
+            genai_types.Content(
+                role="model" if m["role"] == "assistant" else "user",
+                parts=[genai_types.Part(text=m["content"])]
+            )
+            for m in messages if m["role"] != "system"
+        ]
+        config = genai_types.GenerateContentConfig(
+            system_instruction=system or None,
+            response_mime_type="application/json" if json_mode else None
+        )
+        return {"model": self.model, "contents": contents, "config": config}
+
+    async def _complete(self, messages: List[Dict], json_mode: bool) -> str:
+        res = await self.client.aio.models.generate_content(**self._request(messages, json_mode))
+        usage = getattr(res, "usage_metadata", None)
+        if usage is not None:
+            record_llm_usage(self.name, self.model, usage.prompt_token_count or 0, usage.candidates_token_count or 0)
+        return res.text
+
+    async def _stream(self, messages: List[Dict]) -> AsyncIterator[str]:
+        async for chunk in await self.client.aio.models.generate_content_stream(**self._request(messages)):
+            if chunk.text:
+                yield chunk.text
+
+
+def _build_providers() -> List[LLMProvider]:
+    """Orders the configured providers: the one native to AI_MODEL first, the rest as fallbacks."""
+    available = []
+    if GROQ_API_KEY:
+        available.append(GroqProvider(AI_MODEL if is_groq_model(AI_MODEL) else DEFAULT_GROQ_MODEL))
+    if OPENROUTER_API_KEY:
+        available.append(OpenRouterProvider(AI_MODEL))
+    if GOOGLE_API_KEY:
+        available.append(GoogleProvider(AI_MODEL if is_google_model(AI_MODEL) else DEFAULT_GOOGLE_MODEL))
+
+    def priority(provider: LLMProvider) -> int:
+        if provider.name == "groq" and is_groq_model(AI_MODEL):
+            return 0
+        if provider.name == "google" and is_google_model(AI_MODEL):
+            return 0
+        if provider.name == "openrouter":
+            return 1
+        return 2
+
+    providers = sorted(available, key=priority)
+    if providers:
+        print(f"--- AI Config: Async providers {[f'{p.name}:{p.model}' for p in providers]} ---")
+    return providers
+
+PROVIDERS = _build_providers()
+# Picks the fastest healthy provider per request (llm_router.py); the order
+# above only breaks ties until latencies have been measured.
+ROUTER = ProviderRouter(PROVIDERS)
+
+async def acomplete(system: str, user: str, json_mode: bool = False) -> str:
+    """Runs a single-turn completion on the best available provider, with failover."""
+    return await acomplete_messages(build_messages(system, user), json_mode)
+
+async def acomplete_messages(messages: List[Dict], json_mode: bool = False) -> str:
+    return await ROUTER.acomplete(messages, json_mode)
+
+async def astream_messages(messages: List[Dict]) -> AsyncIterator[str]:
+    """Streams a completion from the best provider that starts successfully."""
+    async for text in ROUTER.astream(messages):
+        yield text
+
+def parse_json_content(content: str):
+    """Parses a JSON reply, tolerating markdown fences and surrounding prose."""
+    with span("json.parse", chars=len(content)) as parse:
+        content = content.replace("```json", "").replace("```", "").strip()
+        try:
+            return json.loads(content, strict=False)
+        except json.JSONDecodeError:
+            import re
+            parse.set(fallback=True)
+            match = re.search(r'[\{\[].*[\}\]]', content, re.DOTALL)
+            if not match:
+                raise
+            return json.loads(match.group(), strict=False)
@@ -0,0 +1,374 @@
+import os
+import time
+import asyncio
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from tracing import span, start_span, LLM_REQUESTS
+
+# --- ROUTER CONFIG ---
+# Per-provider request/token budgets (per minute, 0 = unlimited). Set these to
+# the account's quota so the router moves traffic before the provider 429s.
+PROVIDER_BUDGETS = {
+    name: {
+        "rpm": int(os.getenv(f"{name.upper()}_RPM", "0")),
+        "tpm": int(os.getenv(f"{name.upper()}_TPM", "0")),
+    }
+    for name in ("groq", "openrouter", "google")
+}
+# Consecutive 5xx/timeout failures before a provider's circuit opens
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))
+# Seconds a circuit stays open (doubles on repeated trips, up to the max)
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "30"))
+CIRCUIT_MAX_COOLDOWN = float(os.getenv("CIRCUIT_MAX_COOLDOWN", "300"))
+# Hedging: if the first provider has not answered by its p95 latency, race a second one
+ROUTER_HEDGE = os.getenv("ROUTER_HEDGE", "0") in ("1", "true", "True")
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "1.0"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "20"))
+# Longest the router waits for a provider's budget to free up before sending anyway
+ROUTER_MAX_BUDGET_WAIT = float(os.getenv("ROUTER_MAX_BUDGET_WAIT", "10"))
+# Extra passes over the providers when every one failed with a 429/5xx/timeout.
+# SDK-level retries are off (they sleep through Retry-After on the same provider).
+ROUTER_RETRIES = int(os.getenv("ROUTER_RETRIES", "1"))
+ROUTER_RETRY_DELAY = float(os.getenv("ROUTER_RETRY_DELAY", "1.0"))
+
+EWMA_ALPHA = 0.2
+# Assumed latency for a provider with no samples yet; keeps configured order until measured
+LATENCY_PRIOR = 5.0
+MIN_P95_SAMPLES = 20
+
+
+def error_status(error: Exception) -> Optional[int]:
+    """HTTP status of a provider SDK error (OpenAI/Groq, google-genai, httpx), if any."""
+    for attr in ("status_code", "code"):
+        status = getattr(error, attr, None)
+        if isinstance(status, int):
+            return status
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+def retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        value = headers.get("retry-after")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def is_transient(error: Exception) -> bool:
+    status = error_status(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    name = type(error).__name__.lower()
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError, asyncio.TimeoutError, ConnectionError)) \
+        or "timeout" in name or "connection" in name
+
+def estimate_tokens(messages: List[Dict]) -> int:
+    return sum(len(m.get("content") or "") for m in messages) // 4 + 1
+
+
+class ProviderHealth:
+    """Latency, error and quota bookkeeping for one provider, plus its circuit breaker."""
+
+    def __init__(self, name: str):
+        budget = PROVIDER_BUDGETS.get(name, {})
+        self.rpm = budget.get("rpm", 0)
+        self.tpm = budget.get("tpm", 0)
+        self.window = deque()  # (timestamp, tokens) sent in the last minute
+        self.latencies = deque(maxlen=200)
+        self.ewma = None
+        # Time to first token of streams; kept apart from full completions,
+        # which take far longer and drive routing and hedging
+        self.ttfb_ewma = None
+        self.error_rate = 0.0  # EWMA of failures, so old incidents fade out
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.hedges = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.cooldown = CIRCUIT_COOLDOWN
+        self.probing = False  # a half-open trial request is in flight
+
+    # Circuit breaker: closed -> open (skip) -> half-open (one trial) -> closed
+    @property
+    def state(self) -> str:
+        if not self.open_until:
+            return "closed"
+        # While the trial runs, everyone else keeps treating the circuit as open
+        return "open" if self.probing or time.monotonic() < self.open_until else "half_open"
+
+    def trip(self, seconds: float = None):
+        self.open_until = time.monotonic() + (seconds or self.cooldown)
+        self.cooldown = min(self.cooldown * 2, CIRCUIT_MAX_COOLDOWN)
+
+    def budget_wait(self, tokens: int) -> float:
+        """Seconds until this request fits the provider's per-minute budgets (0 = now)."""
+        now = time.monotonic()
+        while self.window and now - self.window[0][0] >= 60:
+            self.window.popleft()
+        wait = 0.0
+        if self.rpm and len(self.window) >= self.rpm:
+            wait = max(wait, 60 - (now - self.window[-self.rpm][0]))
+        if self.tpm:
+            used = sum(t for _, t in self.window)
+            for ts, t in self.window:
+                if used + tokens <= self.tpm:
+                    break
+                used -= t
+                wait = max(wait, 60 - (now - ts))
+        return wait
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < MIN_P95_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def score(self) -> float:
+        latency = self.ewma if self.ewma is not None else LATENCY_PRIOR
+        return latency * (1 + 2 * self.error_rate)
+
+    def start(self, tokens: int) -> bool:
+        """Records a request; returns True if it is the half-open trial."""
+        probe = self.state == "half_open"
+        self.probing = self.probing or probe
+        self.requests += 1
+        self.window.append((time.monotonic(), tokens))
+        return probe
+
+    def end_probe(self):
+        """The trial request finished without closing the circuit; the next caller may try again."""
+        self.probing = False
+
+    def success(self, latency: float, ttfb: bool = False):
+        if ttfb:
+            self.ttfb_ewma = latency if self.ttfb_ewma is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.ttfb_ewma
+        else:
+            self.latencies.append(latency)
+            self.ewma = latency if self.ewma is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.ewma
+        self.error_rate *= 1 - EWMA_ALPHA
+        self.consecutive_failures = 0
+        self.probing = False
+        self.open_until = 0.0
+        self.cooldown = CIRCUIT_COOLDOWN
+
+    def failure(self, error: Exception):
+        self.errors += 1
+        self.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.error_rate
+        if not is_transient(error):
+            return
+        self.consecutive_failures += 1
+        if error_status(error) == 429:
+            self.rate_limited += 1
+            self.trip(retry_after(error))
+        elif self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD or self.open_until:
+            # A failure after a trip (the half-open trial) reopens at once
+            self.trip()
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "requests": self.requests,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "hedges": self.hedges,
+            "error_rate": round(self.error_rate, 3),
+            "ewma_latency": round(self.ewma, 3) if self.ewma is not None else None,
+            "p95_latency": round(self.p95(), 3) if self.p95() is not None else None,
+            "ewma_ttfb": round(self.ttfb_ewma, 3) if self.ttfb_ewma is not None else None,
+            "requests_last_minute": len(self.window),
+            "tokens_last_minute": sum(t for _, t in self.window),
+        }
+
+
+class ProviderRouter:
+    """
+    Sends each request to the fastest healthy provider with budget left,
+    falls back through the rest on failure, and optionally hedges a slow
+    request to a second provider after the first one's p95 latency.
+    """
+
+    def __init__(self, providers: List):
+        self.providers = providers
+        self.health = {p.name: ProviderHealth(p.name) for p in providers}
+
+    def _require_providers(self):
+        if not self.providers:
+            raise RuntimeError("No LLM provider configured: set GROQ_API_KEY, OPENROUTER_API_KEY or GOOGLE_API_KEY")
+
+    def ranked(self, tokens: int) -> List:
+        """Healthy providers, fastest first; configured order breaks ties."""
+        usable = [p for p in self.providers if self.health[p.name].state != "open"]
+        if not usable:
+            # Every circuit is open: try the one that reopens soonest rather than failing outright
+            idle = [p for p in self.providers if not self.health[p.name].probing] or self.providers
+            usable = sorted(idle, key=lambda p: self.health[p.name].open_until)[:1]
+        order = {p.name: i for i, p in enumerate(self.providers)}
+        return sorted(usable, key=lambda p: (self.health[p.name].budget_wait(tokens) > 0, self.health[p.name].score(), order[p.name]))
+
+    def _in_trial(self, provider) -> Optional[Exception]:
+        """An error for skipping provider if another caller's half-open trial is running on it."""
+        if self.health[provider.name].probing:
+            # Transient, so acomplete tries again once the trial has had time to finish
+            return ConnectionError(f"{provider.name} circuit is half-open and its trial request is in flight")
+        return None
+
+    async def _wait_for_budget(self, providers: List, tokens: int):
+        if not providers:
+            return
+        wait = min(self.health[p.name].budget_wait(tokens) for p in providers)
+        if wait > 0:
+            wait = min(wait, ROUTER_MAX_BUDGET_WAIT)
+            print(f"⏳ All providers at quota, waiting {wait:.1f}s")
+            await asyncio.sleep(wait)
+
+    async def _attempt(self, provider, messages: List[Dict], json_mode: bool, tokens: int, retry: int = 0, hedge: bool = False) -> str:
+        health = self.health[provider.name]
+        probe = health.start(tokens)
+        start_time = time.monotonic()
+        with span("llm.call", provider=provider.name, model=provider.model, json_mode=json_mode,
+                  retry=retry, hedge=hedge, estimated_prompt_tokens=tokens) as call:
+            try:
+                content = await provider.acomplete(messages, json_mode)
+            except asyncio.CancelledError:
+                # Lost a hedge race or the caller went away
+                call.set(cancelled=True)
+                if probe:
+                    health.end_probe()
+                raise
+            except Exception as e:
+                health.failure(e)
+                if probe:
+                    health.end_probe()
+                LLM_REQUESTS.inc(provider=provider.name, model=provider.model, task_type=call.task_type, status=error_status(e) or "error")
+                print(f"{provider.name} ({provider.model}) Error: {e}")
+                raise
+            health.success(time.monotonic() - start_time)
+            LLM_REQUESTS.inc(provider=provider.name, model=provider.model, task_type=call.task_type, status="ok")
+        return content
+
+    async def _hedged(self, primary, backup, messages: List[Dict], json_mode: bool, tokens: int, tried: set, retry: int = 0) -> str:
+        """Runs primary; if it is still pending at its p95 latency, races backup against it."""
+        delay = min(max(self.health[primary.name].p95(), HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+        first = asyncio.ensure_future(self._attempt(primary, messages, json_mode, tokens, retry))
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+        except asyncio.CancelledError:
+            first.cancel()
+            raise
+        if done:
+            return first.result()
+
+        print(f"🏁 HEDGE: {primary.name} slower than {delay:.1f}s, also trying {backup.name}")
+        self.health[backup.name].hedges += 1
+        tried.add(backup.name)
+        pending = {first, asyncio.ensure_future(self._attempt(backup, messages, json_mode, tokens, retry, hedge=True))}
+        last_error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result():
+                        return task.result()
+                    last_error = task.exception() or last_error
+        finally:
+            for task in pending:
+                task.cancel()
+        if last_error:
+            raise last_error
+        return ""
+
+    async def acomplete(self, messages: List[Dict], json_mode: bool = False) -> str:
+        self._require_providers()
+        tokens = estimate_tokens(messages)
+        last_error = None
+        for attempt in range(ROUTER_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(ROUTER_RETRY_DELAY * attempt)
+            candidates = self.ranked(tokens)
+            await self._wait_for_budget(candidates, tokens)
+            tried = set()
+            for i, provider in enumerate(candidates):
+                if provider.name in tried:
+                    continue
+                tried.add(provider.name)
+                # Ranked before another caller took the provider's half-open trial
+                skip = self._in_trial(provider)
+                if skip:
+                    last_error = skip
+                    continue
+                backup = next((p for p in candidates[i + 1:]
+                               if p.name not in tried and not self.health[p.name].probing), None)
+                try:
+                    if ROUTER_HEDGE and backup and self.health[provider.name].p95() is not None:
+                        content = await self._hedged(provider, backup, messages, json_mode, tokens, tried, attempt)
+                    else:
+                        content = await self._attempt(provider, messages, json_mode, tokens, attempt)
+                    if content:
+                        return content
+                except Exception as e:
+                    last_error = e
+            # Only provider-side trouble (quota, outage, timeout) is worth another pass
+            if last_error is None or not is_transient(last_error):
+                break
+        if last_error:
+            raise last_error
+        return ""
+
+    async def astream(self, messages: List[Dict]) -> AsyncIterator[str]:
+        """Streams from the best provider; falls back only if nothing has been sent yet."""
+        self._require_providers()
+        tokens = estimate_tokens(messages)
+        candidates = self.ranked(tokens)
+        await self._wait_for_budget(candidates, tokens)
+        last_error = None
+        for provider in candidates:
+            skip = self._in_trial(provider)
+            if skip:
+                last_error = skip
+                continue
+            health = self.health[provider.name]
+            probe = health.start(tokens)
+            start_time = time.monotonic()
+            started = False
+            # Not a context-managed span: the generator may resume in another context
+            call = start_span("llm.stream", provider=provider.name, model=provider.model, estimated_prompt_tokens=tokens)
+            try:
+                async for text in provider.astream(messages):
+                    if not started:
+                        # Recorded as time to first token, not as a completion latency
+                        health.success(time.monotonic() - start_time, ttfb=True)
+                        call.set(ttfb_ms=round((time.monotonic() - start_time) * 1000, 1))
+                        started = True
+                    yield text
+                LLM_REQUESTS.inc(provider=provider.name, model=provider.model, task_type=call.task_type, status="ok")
+                return
+            except Exception as e:
+                health.failure(e)
+                call.fail(e)
+                LLM_REQUESTS.inc(provider=provider.name, model=provider.model, task_type=call.task_type, status=error_status(e) or "error")
+                # Once output has been sent we cannot switch providers mid-answer
+                if started:
+                    raise
+                last_error = e
+                print(f"{provider.name} ({provider.model}) Stream Error: {e}")
+            finally:
+                if probe and not started:
+                    # Failed, closed or cancelled before the first token
+                    health.end_probe()
+                call.end()
+        if last_error:
+            raise last_error
+
+    def stats(self) -> Dict:
+        return {
+            "hedging": ROUTER_HEDGE,
+            "providers": {
+                f"{p.name}:{p.model}": self.health[p.name].stats() for p in self.providers
+            },
+        }
@@ -1,67 +1,85 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Body
-from typing import List, Dict
+from fastapi import FastAPI, HTTPException, Body, Request, Response
+from typing import List, Dict, Optional
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse, PlainTextResponse
 from fastapi.concurrency import run_in_threadpool
 # Import the new helper
-from stream_helper import stream_report
+from stream_helper import astream_report
 
 from ai_engine import extract_text, call_llm
-from deck_builder import create_anki_deck
+from deck_builder import create_anki_deck, get_anki_package, latest_anki_export, package_belongs_to
 import shutil
 import shutil
 import os
-import uuid
+import json
 import time
 import asyncio
 from fastapi.staticfiles import StaticFiles
-from audio_service import create_podcast_audio, create_overview_audio
+from audio_service import (
+    create_podcast_audio, create_overview_audio, iter_speech_audio,
+    audio_output_path, podcast_lines, overview_lines
+)
+from response_cache import RESPONSE_CACHE, make_cache_key, text_digest
+from singleflight import SingleFlight, StreamFlight
+from http_clients import CLIENTS
+from contextlib import asynccontextmanager
+from streaming import StreamTimer, STREAM_METRICS, sse_event, micro_batch
+import deck_store
+from retrieval import get_index, build_context, CHAT_CONTEXT_CHARS
+from chunker import get_chunk_spans, chunk_token_budget, TASK_CHUNK_TOKENS
+from llm_provider import AI_MODEL, astream_messages
+from jobs import JOBS, FINAL_STATES, check_webhook_url, public_job, report_progress
+from tracing import span, render_metrics, TASK_SPAN
+from public_catalog import PUBLIC_CATALOG
+from shared_state import GENERATION_LOCKS
+from uploads import SpooledUpload, receive_uploads
 
 # --- STORAGE CONFIG ---
-DATA_DIR = "data"
-DECKS_DIR = os.path.join(DATA_DIR, "decks")
-PUBLIC_DECKS_FILE = os.path.join(DATA_DIR, "public_decks.json")
-
-os.makedirs(DECKS_DIR, exist_ok=True)
-
-def save_deck_to_disk(deck_id: str, content: str):
-    file_path = os.path.join(DECKS_DIR, f"{deck_id}.txt")
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(content)
-
-def load_deck_from_disk(deck_id: str) -> str:
-    file_path = os.path.join(DECKS_DIR, f"{deck_id}.txt")
-    if os.path.exists(file_path):
-        with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
-    return None
-
-def get_public_decks() -> List[Dict]:
-    if os.path.exists(PUBLIC_DECKS_FILE):
-        import json
-        with open(PUBLIC_DECKS_FILE, "r") as f:
-            return json.load(f)
-    return []
-
-def save_public_deck(deck_info: Dict):
-    public_decks = get_public_decks()
-    # Avoid duplicates
-    if not any(d['id'] == deck_info['id'] for d in public_decks):
-        public_decks.append(deck_info)
-        import json
-        with open(PUBLIC_DECKS_FILE, "w") as f:
-            json.dump(public_decks, f)
+# Deck text lives in the content-addressed store (deck_store.py), shared
+# decks in the public catalog (public_catalog.py)
 
 # --- GLOBAL STATE STORE ---
-# Cache for active sessions
-DECK_STORE = {}
+# Hot deck texts (byte-bounded LRU over the blob store) and deck_id -> text hash
+DECK_STORE = deck_store.DeckTextCache(deck_store.DECK_STORE_MAX_MB)
 
 # --- CACHE STORE ---
-# Map: (deck_id, task_type) -> result_dict
-RESPONSE_CACHE = {}
+# RESPONSE_CACHE (response_cache.py) maps task + deck text + options -> result_dict
+
+# --- LATENCY PROFILE ---
+# "theatrical" keeps the deliberate UX pacing (minimum response times,
+# 'thinking' pauses, line-by-line chat reveal). "fast" removes all of it so
+# cache hits return immediately and connections are released sooner.
+LATENCY_PROFILES = {
+    "theatrical": {"min_time_scale": 1.0, "thinking_pause": 2.5, "line_delay": 0.08},
+    "fast": {"min_time_scale": 0.0, "thinking_pause": 0.0, "line_delay": 0.0},
+}
+LATENCY_PROFILE = os.getenv("LATENCY_PROFILE", "theatrical").lower()
+if LATENCY_PROFILE not in LATENCY_PROFILES:
+    print(f"Unknown LATENCY_PROFILE '{LATENCY_PROFILE}', using 'theatrical'")
+    LATENCY_PROFILE = "theatrical"
+LATENCY = LATENCY_PROFILES[LATENCY_PROFILE]
+# Token-streamed chat ("text"/"sse"): coalesce tokens per window (0 = send each immediately)
+CHAT_STREAM_BATCH_MS = int(os.getenv("CHAT_STREAM_BATCH_MS", "0"))
+
+# --- IN-FLIGHT GENERATIONS ---
+# Concurrent identical requests (same cache key) share one LLM run; across
+# worker processes GENERATION_LOCKS (shared_state.py) does the same
+GENERATION_FLIGHTS = SingleFlight()
+REPORT_FLIGHTS = StreamFlight()
 
-app = FastAPI(title="FlashDeck AI API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Re-queue jobs that were queued or running when the server stopped
+    await JOBS.start()
+    yield
+    await JOBS.stop()
+    # Close the shared provider connection pools and the graph checkpoint DB
+    await CLIENTS.aclose()
+    from agent_graph import close_graph
+    await close_graph()
+
+app = FastAPI(title="FlashDeck AI API", lifespan=lifespan)
 
 # Allow CORS for React Frontend
 # For security, you can list specific domains like ["http://localhost:5173", "https://your-site.vercel.app"]
@@ -80,23 +98,53 @@ def home():
     return {"status": "FlashDeck Brain is Online 🧠"}
 
 
-@app.post("/generate")
-async def generate_initial(files: List[UploadFile] = File(...)):
+# Request body schema for the docs; /generate parses the body itself (uploads.py)
+UPLOAD_OPENAPI = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object",
+    "required": ["files"],
+    "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+}}}}}
+
+@app.post("/generate", openapi_extra=UPLOAD_OPENAPI)
+async def generate_initial(request: Request):
     """Initial processing: extract text and name the deck."""
-    print(f"📄 Processing {len(files)} files...")
     try:
-        full_text = ""
-        for file in files:
-            # Async read
-            content = await file.read()
+        async def extract_file(file: SpooledUpload) -> str:
             try:
-                # Offload CPU-bound extraction
-                text = await run_in_threadpool(extract_text, content)
-                if text:
-                    full_text += f"\n\n--- Source: {file.filename} ---\n\n" + text
+                with span("extract", file=file.filename, bytes=file.size) as extraction:
+                    # Same bytes uploaded before: reuse the stored extraction
+                    content_hash = file.content_hash
+                    text = await run_in_threadpool(deck_store.find_extracted_text, content_hash)
+                    if text is not None:
+                        print(f"⚡ UPLOAD DEDUP: {file.filename} ({content_hash[:12]})")
+                        extraction.set(dedup=True, chars=len(text))
+                        return text
+
+                    # Offload CPU-bound extraction (large uploads are opened from their temp file).
+                    # A failed extraction raises, so only complete text is remembered
+                    text = await run_in_threadpool(extract_text, file.source())
+                    extraction.set(chars=len(text))
+                    if text:
+                        await run_in_threadpool(deck_store.remember_extracted_text, content_hash, text)
+                    return text
             except Exception as e:
                 print(f"Extraction Error for {file.filename}: {e}")
-                continue
+                return ""
+
+        # Each file is extracted as soon as it has arrived, while later ones
+        # are still uploading; gather keeps upload order
+        received = await receive_uploads(request, extract_file)
+        if not received:
+            raise HTTPException(status_code=400, detail="No files uploaded.")
+        files = [file for file, _ in received]
+        print(f"📄 Processing {len(files)} files...")
+        texts = await asyncio.gather(*(task for _, task in received))
+        parts = []
+        for file, text in zip(files, texts):
+            if text:
+                parts.append(f"\n\n--- Source: {file.filename} ---\n\n")
+                parts.append(text)
+        full_text = "".join(parts)
             
         if not full_text.strip():
              raise HTTPException(status_code=400, detail="Could not extract text from uploaded files.")
@@ -106,29 +154,38 @@ async def generate_initial(files: List[UploadFile] = File(...)):
         else:
             deck_name_fallback = f"{files[0].filename.replace('.pdf', '')}_plus_{len(files)-1}"
 
-        # Generate Better Name via AI
-        try:
-            name_prompt = f"""
-            Generate a short, concise, and descriptive title (max 5 words) for a study deck based on the following text.
-            Do not use quotes. Just the title.
-            
-            Text Preview:
-            {full_text[:3000]}
-            """
-            # Use threadpool to not block async loop
-            generated_name = await run_in_threadpool(call_llm, name_prompt)
-            if generated_name:
-                deck_name = generated_name.strip().replace('"', '').replace("'", "")
-            else:
+        # Identical text shares one stored copy, its generated name and
+        # (via digest-keyed cache entries) every generated artifact
+        text_hash = await run_in_threadpool(deck_store.save_text, full_text)
+        # Build (or load) the retrieval index and chunk boundaries now so tasks never wait for them
+        await run_in_threadpool(precompute_deck, full_text, text_hash)
+        deck_name = deck_store.get_text_meta(text_hash).get("deck_name")
+
+        # Generate Better Name via AI (once per distinct text)
+        if deck_name:
+            print(f"⚡ DECK NAME REUSED: {deck_name}")
+        else:
+            try:
+                name_prompt = f"""
+                Generate a short, concise, and descriptive title (max 5 words) for a study deck based on the following text.
+                Do not use quotes. Just the title.
+                
+                Text Preview:
+                {full_text[:3000]}
+                """
+                generated_name = await call_llm(name_prompt)
+                if generated_name:
+                    deck_name = generated_name.strip().replace('"', '').replace("'", "")
+                    deck_store.set_text_meta(text_hash, deck_name=deck_name)
+                else:
+                    deck_name = deck_name_fallback
+            except Exception as e:
+                print(f"Title Gen Error: {e}")
                 deck_name = deck_name_fallback
-        except Exception as e:
-            print(f"Title Gen Error: {e}")
-            deck_name = deck_name_fallback
             
-        # Store text server-side
-        deck_id = str(uuid.uuid4())
-        DECK_STORE[deck_id] = full_text
-        save_deck_to_disk(deck_id, full_text)
+        # Store a lightweight deck reference to the shared text
+        deck_id = deck_store.create_deck(text_hash, deck_name)
+        DECK_STORE.put(deck_id, full_text, text_hash)
             
         return {
             "status": "success",
@@ -137,49 +194,105 @@ async def generate_initial(files: List[UploadFile] = File(...)):
             "full_text": full_text[:1000] + "...", # Preview
             "message": "Text stored successfully on server."
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Initial Processing Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def precompute_deck(text: str, text_hash: str):
+    get_index(text, text_hash)
+    for task in TASK_CHUNK_TOKENS:
+        get_chunk_spans(text, chunk_token_budget(task, AI_MODEL), text_hash)
+
 class TaskRequest(BaseModel):
     deck_id: str
     deck_name: str
     options: Dict = {}
+    refresh: bool = False # Regenerate instead of returning the cached result
     
-def get_text_or_404(deck_id: str):
-    text = DECK_STORE.get(deck_id)
-    if not text:
-        text = load_deck_from_disk(deck_id)
-        if text:
-            DECK_STORE[deck_id] = text
+async def get_text_or_404(deck_id: str):
+    text = DECK_STORE.get_cached(deck_id)
+    if text is None:
+        # A cold deck is read (and decompressed) from disk or the shared tier
+        text = await asyncio.to_thread(DECK_STORE.get, deck_id)
     if not text:
         raise HTTPException(status_code=404, detail="Deck not found or session expired. Please re-upload.")
     return text
 
-async def get_cached_or_run(deck_id: str, task_type: str, text: str, extra_data: Dict = None):
-    cache_key = (deck_id, task_type)
+async def require_deck(deck_id: str):
+    """404s for unknown decks without loading their text."""
+    if not await asyncio.to_thread(DECK_STORE.__contains__, deck_id):
+        raise HTTPException(status_code=404, detail="Deck not found or session expired. Please re-upload.")
+
+def get_deck_digest(deck_id: str, text: str) -> str:
+    return DECK_STORE.digest(deck_id) or text_digest(text)
+
+def get_cache_key(deck_id: str, task_type: str, text: str, options: Dict = None) -> str:
+    return make_cache_key(task_type, get_deck_digest(deck_id, text), options)
+
+async def get_cached_or_run(deck_id: str, task_type: str, text: str, extra_data: Dict = None, refresh: bool = False):
+    with span(TASK_SPAN, task_type=task_type, deck_id=deck_id) as task:
+        return await _get_cached_or_run(deck_id, task_type, text, extra_data, task, refresh)
+
+async def _get_cached_or_run(deck_id: str, task_type: str, text: str, extra_data: Dict, task, refresh: bool = False):
+    cache_key = get_cache_key(deck_id, task_type, text, (extra_data or {}).get("options"))
     
-    # Check Cache
-    if cache_key in RESPONSE_CACHE:
+    # Check Cache (refresh drops the stored result, so it is regenerated and replaced)
+    if refresh:
+        print(f"🔄 CACHE REFRESH: {cache_key}")
+        await RESPONSE_CACHE.adelete(cache_key)
+    cached = None if refresh else await RESPONSE_CACHE.aget(cache_key)
+    if cached is not None:
         print(f"⚡ CACHE HIT: {cache_key}")
-        return RESPONSE_CACHE[cache_key]
+        task.set(cache="hit")
+        return cached
+    task.set(cache="joined" if GENERATION_FLIGHTS.in_flight(cache_key) else "miss")
         
-    print(f"🐢 CACHE MISS: {cache_key} - Running AI...")
-    from agent_graph import run_selective_node
-    
-    # Run AI
-    result = await run_in_threadpool(run_selective_node, text, task_type, extra_data)
-    
-    # Store Result
-    RESPONSE_CACHE[cache_key] = result
-    return result
+    async def generate():
+        print(f"🐢 CACHE MISS: {cache_key} - Running AI...")
+        from agent_graph import run_selective_node
+        
+        # Run AI (async end to end, no worker thread held during the LLM call)
+        state_data = {**(extra_data or {}), "deck_digest": get_deck_digest(deck_id, text)}
+        result = await run_selective_node(text, task_type, state_data)
+        
+        # Store Result, unless a node fell back to a placeholder (provider
+        # error, empty or unparseable answer): the next request retries
+        if result.get("errors"):
+            print(f"⚠️ NOT CACHED: {cache_key} ({'; '.join(result['errors'])})")
+        else:
+            await RESPONSE_CACHE.aset(cache_key, result)
+        return result
+
+    async def run():
+        # If another worker is already generating this, wait for its result
+        result, shared = await GENERATION_LOCKS.run(cache_key, generate, lambda: RESPONSE_CACHE.peek(cache_key))
+        if shared:
+            print(f"🔗 JOINED OTHER WORKER: {cache_key}")
+            task.set(cache="joined")
+        return result
+
+    # Callers arriving while the same generation is running await its result
+    return await GENERATION_FLIGHTS.do(cache_key, run)
 
 async def ensure_min_time(start_time: float, min_seconds: float = 2.5):
-    """Ensures at least min_seconds have passed since start_time."""
+    """Ensures at least min_seconds (scaled by the latency profile) have passed since start_time."""
+    min_seconds *= LATENCY["min_time_scale"]
     elapsed = time.time() - start_time
     if elapsed < min_seconds:
         await asyncio.sleep(min_seconds - elapsed)
 
+async def thinking_pause():
+    """Initial 'Thinking' buffer before a stream starts (skipped in the fast profile)."""
+    if LATENCY["thinking_pause"] > 0:
+        await asyncio.sleep(LATENCY["thinking_pause"])
+
+async def export_anki(cards: List[Dict], deck_name: str, deck_id: str) -> str:
+    """Packages the cards for Anki and returns the download URL."""
+    key = await run_in_threadpool(create_anki_deck, cards, deck_name, deck_id)
+    return f"/decks/{deck_id}/anki?key={key}"
+
 class AnalysisRequest(BaseModel):
     deck_id: str
     missed_questions: List[Dict]
@@ -188,19 +301,19 @@ class AnalysisRequest(BaseModel):
 async def generate_cards(req: TaskRequest):
     start_time = time.time()
     print(f"--- Triggering Lazy Card Generation for: {req.deck_name} ---")
-    text = get_text_or_404(req.deck_id)
+    text = await get_text_or_404(req.deck_id)
     try:
-        result = await get_cached_or_run(req.deck_id, "cards", text, extra_data={"options": req.options})
+        result = await get_cached_or_run(req.deck_id, "cards", text, extra_data={"options": req.options}, refresh=req.refresh)
         await ensure_min_time(start_time, 3.5)
         cards = result.get("final_cards", [])
         
-        # Create anki deck 
-        output_file = create_anki_deck(cards, deck_name=req.deck_name)
+        # Build (or reuse) the Anki package in memory; served by GET /decks/{id}/anki
+        download_path = await export_anki(cards, req.deck_name, req.deck_id)
         
         return {
             "status": "success",
             "cards": cards,
-            "download_path": output_file
+            "download_path": download_path
         }
     except Exception as e:
         print(f"Card Gen Error: {e}")
@@ -210,9 +323,9 @@ async def generate_cards(req: TaskRequest):
 async def generate_flowchart(req: TaskRequest):
     start_time = time.time()
     print(f"--- Triggering Lazy Flowchart Generation for: {req.deck_name} ---")
-    text = get_text_or_404(req.deck_id)
+    text = await get_text_or_404(req.deck_id)
     try:
-        result = await get_cached_or_run(req.deck_id, "flowchart", text, extra_data={"options": req.options})
+        result = await get_cached_or_run(req.deck_id, "flowchart", text, extra_data={"options": req.options}, refresh=req.refresh)
         await ensure_min_time(start_time, 3.0)
         return {
             "status": "success",
@@ -226,9 +339,9 @@ async def generate_flowchart(req: TaskRequest):
 async def generate_quiz(req: TaskRequest):
     start_time = time.time()
     print(f"--- Triggering Lazy Quiz Generation for: {req.deck_name} ---")
-    text = get_text_or_404(req.deck_id)
+    text = await get_text_or_404(req.deck_id)
     try:
-        result = await get_cached_or_run(req.deck_id, "quiz", text, extra_data={"options": req.options})
+        result = await get_cached_or_run(req.deck_id, "quiz", text, extra_data={"options": req.options}, refresh=req.refresh)
         await ensure_min_time(start_time, 3.0)
         return {
             "status": "success",
@@ -241,55 +354,62 @@ async def generate_quiz(req: TaskRequest):
 @app.post("/generate/report")
 async def generate_report(req: TaskRequest):
     print(f"--- Triggering Streaming Report Generation for: {req.deck_name} ---")
-    text = get_text_or_404(req.deck_id)
+    text = await get_text_or_404(req.deck_id)
     
     # Check Cache first (we can cache the full string result)
-    cache_key = (req.deck_id, "report")
-    if cache_key in RESPONSE_CACHE:
+    # Reports do not depend on options, so the key leaves them out
+    cache_key = get_cache_key(req.deck_id, "report", text)
+    if req.refresh:
+        print(f"🔄 CACHE REFRESH: {cache_key}")
+        await RESPONSE_CACHE.adelete(cache_key)
+    cached = None if req.refresh else await RESPONSE_CACHE.aget(cache_key)
+    if cached is not None:
         print(f"⚡ CACHE HIT (Report): {cache_key}")
         # If cached, we simulate a stream or just return JSON? 
         # The frontend expects a stream, so we yield the cached string.
         async def cached_stream():
-            yield RESPONSE_CACHE[cache_key]['report']
+            yield cached['report']
         return StreamingResponse(cached_stream(), media_type="text/plain")
 
-    async def meta_stream_generator():
-        await asyncio.sleep(2.5) # Initial 'Thinking' buffer
-        full_content = ""
-        try:
-            # We run the synchronous generator in a theoretical way, but actually
-            # LLM streaming is usually async or sync-generator. 
-            # Our stream_helper is a synchronous generator (yield).
-            # To be safe with FastAPI async, we Iterate it direct if it's fast, 
-            # or use an async wrapper. 
-            # Since stream_helper calls APIs, it blocks.
-            # Best practice: use iterate_in_threadpool from starlette?
-            # Or just wrap the generator.
-            
-            # Let's simple iterate for now, assuming the underlying lib releases GIL or we accept one thread blockage per user.
-            # Ideally stream_helper should be async.
-            
-            formatted_input = text[:50000] 
-            for chunk in stream_report(formatted_input):
-               full_content += chunk
-               yield chunk
-               
-            # Update Cache after completion
-            RESPONSE_CACHE[cache_key] = {"report": full_content}
-            
-        except Exception as e:
-            yield f"\n\n[Error generating report: {e}]"
+    async def report_producer():
+        timer = StreamTimer("report")
+        # The producer runs in its own task (REPORT_FLIGHTS), so the span can stay current across yields
+        with span(TASK_SPAN, task_type="report", deck_id=req.deck_id, cache="miss") as task:
+            await thinking_pause()
+            full_content = ""
+            failed = False
+            try:
+                # Large decks are summarized map-reduce style (chunk summaries are
+                # shared with the guide, slides and podcast tasks)
+                from agent_graph import summarize_document
+                formatted_input = await summarize_document(text, 50000, get_deck_digest(req.deck_id, text))
+                # Async stream: each network read awaits instead of blocking the loop
+                async for chunk in astream_report(formatted_input):
+                    timer.sent(chunk)
+                    full_content += chunk
+                    yield chunk
+            except Exception as e:
+                failed = True
+                task.fail(e)
+                yield f"\n\n[Error generating report: {e}]"
+            finally:
+                await timer.finish()
+
+            # Only a report that streamed to the end is cached
+            if not failed and full_content.strip():
+                await RESPONSE_CACHE.aset(cache_key, {"report": full_content})
 
-    return StreamingResponse(meta_stream_generator(), media_type="text/plain")
+    # Concurrent requests share one stream; late joiners replay the prefix
+    return StreamingResponse(REPORT_FLIGHTS.subscribe(cache_key, report_producer), media_type="text/plain")
 
 
 @app.post("/generate/slides")
 async def generate_slides(req: TaskRequest):
     start_time = time.time()
     print(f"--- Triggering Lazy Slides Generation for: {req.deck_name} ---")
-    text = get_text_or_404(req.deck_id)
+    text = await get_text_or_404(req.deck_id)
     try:
-        result = await get_cached_or_run(req.deck_id, "slides", text, extra_data={"options": req.options})
+        result = await get_cached_or_run(req.deck_id, "slides", text, extra_data={"options": req.options}, refresh=req.refresh)
         await ensure_min_time(start_time, 3.0)
         return {
             "status": "success",
@@ -303,9 +423,9 @@ async def generate_slides(req: TaskRequest):
 async def generate_table(req: TaskRequest):
     start_time = time.time()
     print(f"--- Triggering Lazy Table Generation for: {req.deck_name} ---")
-    text = get_text_or_404(req.deck_id)
+    text = await get_text_or_404(req.deck_id)
     try:
-        result = await get_cached_or_run(req.deck_id, "table", text, extra_data={"options": req.options})
+        result = await get_cached_or_run(req.deck_id, "table", text, extra_data={"options": req.options}, refresh=req.refresh)
         await ensure_min_time(start_time, 3.0)
         return {
             "status": "success",
@@ -315,14 +435,187 @@ async def generate_table(req: TaskRequest):
         print(f"Table Gen Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- BATCH GENERATION ---
+# task type -> (result key from run_selective_node, response field, empty value).
+# Report and guide are cached without options, matching their own endpoints.
+BATCH_TASKS = {
+    "cards": ("final_cards", "cards", []),
+    "flowchart": ("flowchart", "flowchart", ""),
+    "quiz": ("quiz", "quiz", []),
+    "slides": ("slides", "slides", []),
+    "table": ("table", "table", []),
+    "guide": ("guide", "guide", {}),
+    "report": ("report", "report", ""),
+}
+OPTIONLESS_TASKS = {"guide", "report"}
+
+class BatchRequest(BaseModel):
+    deck_id: str
+    deck_name: str
+    tasks: List[str]
+    options: Dict = {} # Shared options
+    task_options: Dict[str, Dict] = {} # Per-task overrides, e.g. {"quiz": {"count": 10}}
+    refresh: bool = False # Regenerate every task instead of returning cached results
+    format: str = "ndjson" # "ndjson" or "sse"
+
+@app.post("/generate/batch")
+async def generate_batch(req: BatchRequest):
+    """
+    Runs several studio tasks for one deck concurrently and streams each
+    artifact as soon as it is ready (one NDJSON line or SSE event per task,
+    then a final "done"). Chunking, the retrieval index and chunk summaries
+    are shared across the tasks.
+    """
+    start_time = time.time()
+    tasks = list(dict.fromkeys(req.tasks))
+    unknown = [t for t in tasks if t not in BATCH_TASKS]
+    if not tasks or unknown:
+        raise HTTPException(status_code=400, detail=f"Unsupported tasks: {unknown}. Choose from {list(BATCH_TASKS)}.")
+    print(f"--- Triggering Batch Generation {tasks} for: {req.deck_name} ---")
+    text = await get_text_or_404(req.deck_id)
+
+    async def run_task(task_type: str) -> Dict:
+        result_key, field, empty = BATCH_TASKS[task_type]
+        try:
+            if task_type in OPTIONLESS_TASKS:
+                result = await get_cached_or_run(req.deck_id, task_type, text, refresh=req.refresh)
+            else:
+                options = {**req.options, **req.task_options.get(task_type, {})}
+                result = await get_cached_or_run(req.deck_id, task_type, text, extra_data={"options": options}, refresh=req.refresh)
+            artifact = {"task": task_type, "status": "success", field: result.get(result_key, empty)}
+            if task_type == "cards":
+                artifact["download_path"] = await export_anki(artifact["cards"], req.deck_name, req.deck_id)
+        except Exception as e:
+            print(f"Batch {task_type} Error: {e}")
+            artifact = {"task": task_type, "status": "error", "detail": str(e)}
+        artifact["elapsed"] = round(time.time() - start_time, 2)
+        return artifact
+
+    def frame(event: str, data: Dict) -> str:
+        if req.format == "sse":
+            return sse_event(event, data)
+        return json.dumps({"event": event, **data}) + "\n"
+
+    async def batch_stream():
+        # Chunk boundaries and the retrieval index are built once, up front
+        await run_in_threadpool(precompute_deck, text, get_deck_digest(req.deck_id, text))
+        pending = [asyncio.ensure_future(run_task(t)) for t in tasks]
+        try:
+            first = True
+            for next_done in asyncio.as_completed(pending):
+                artifact = await next_done
+                if first:
+                    # One minimum-time floor for the whole batch
+                    await ensure_min_time(start_time, 3.0)
+                    first = False
+                yield frame("artifact", artifact)
+            yield frame("done", {"tasks": tasks, "elapsed": round(time.time() - start_time, 2)})
+        finally:
+            for task in pending:
+                task.cancel()
+
+    media_type = "text/event-stream" if req.format == "sse" else "application/x-ndjson"
+    return StreamingResponse(batch_stream(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# --- BACKGROUND JOBS ---
+# Audio and large card decks can take minutes; POST /jobs returns a job id at
+# once and the work runs on the JOBS worker pool (jobs.py).
+
+async def run_audio_job(job: Dict) -> Dict:
+    with span(TASK_SPAN, task_type=job["kind"], deck_id=job["params"]["deck_id"]):
+        return await _run_audio_job(job)
+
+async def _run_audio_job(job: Dict) -> Dict:
+    kind, params = job["kind"], job["params"]
+    options = params.get("options", {})
+    text = await get_text_or_404(params["deck_id"])
+    output_path = audio_output_path(kind, params["deck_id"], options)
+
+    if os.path.exists(output_path) and not options.get("regenerate"):
+        print(f"⚡ AUDIO REUSE: {output_path}")
+    else:
+        report_progress("script")
+        lines = await audio_script_lines(kind, text, options)
+        report_progress("lines", total=sum(1 for line in lines if line[0]))
+        async for _ in iter_speech_audio(lines, output_path):
+            report_progress(advance=1)
+    return {"audio_url": f"/audio/{os.path.basename(output_path)}"}
+
+async def run_cards_job(job: Dict) -> Dict:
+    params = job["params"]
+    text = await get_text_or_404(params["deck_id"])
+    await run_in_threadpool(precompute_deck, text, get_deck_digest(params["deck_id"], text))
+    result = await get_cached_or_run(params["deck_id"], "cards", text, extra_data={"options": params.get("options", {})})
+    cards = result.get("final_cards", [])
+    report_progress("packaging")
+    download_path = await export_anki(cards, params.get("deck_name") or "FlashDeck", params["deck_id"])
+    return {"cards": cards, "download_path": download_path}
+
+JOBS.register("podcast", run_audio_job)
+JOBS.register("overview", run_audio_job)
+JOBS.register("cards", run_cards_job)
+
+class JobRequest(BaseModel):
+    kind: str # "podcast", "overview" or "cards"
+    deck_id: str
+    deck_name: str = ""
+    options: Dict = {}
+    webhook_url: str = None # POSTed the finished job
+
+@app.post("/jobs", status_code=202)
+async def submit_job(req: JobRequest):
+    """
+    Queues a long-running generation and returns its job id immediately.
+    A queued or running job for the same deck, task and options is reused.
+    """
+    if req.kind not in JOBS.kinds:
+        raise HTTPException(status_code=400, detail=f"Unsupported job kind: {req.kind}. Choose from {JOBS.kinds}.")
+    await require_deck(req.deck_id)
+    if req.webhook_url:
+        try:
+            await check_webhook_url(req.webhook_url)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    params = {"deck_id": req.deck_id, "deck_name": req.deck_name, "options": req.options}
+    job = await JOBS.submit(req.kind, make_cache_key(req.kind, req.deck_id, req.options), params, req.webhook_url)
+    return {"status": "success", "job": public_job(job)}
+
+@app.get("/jobs/stats")
+async def job_stats():
+    """Returns the job queue's worker count, queue depth and jobs per state."""
+    return {"status": "success", "jobs": await JOBS.stats()}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Returns a job's state, progress and (once finished) result or error."""
+    job = await JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired.")
+    return {"status": "success", "job": public_job(job)}
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-Sent Events: a "progress" event per change, then "done" with the result."""
+    if await JOBS.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired.")
+
+    async def event_stream():
+        async for snapshot in JOBS.events(job_id):
+            finished = snapshot["state"] in FINAL_STATES
+            yield sse_event("done" if finished else "progress", snapshot)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 
 @app.post("/analyze/quiz")
 async def analyze_quiz(req: AnalysisRequest):
     print(f"--- Analyzing Quiz Results for Review Cards ---")
     try:
-        text = get_text_or_404(req.deck_id)
+        text = await get_text_or_404(req.deck_id)
         # We pass missed questions in extra_data
-        result = await run_in_threadpool(run_selective_node, text, "review", extra_data={"missed_questions": req.missed_questions})
+        from agent_graph import run_selective_node
+        result = await run_selective_node(text, "review", extra_data={"missed_questions": req.missed_questions})
         return {
             "status": "success",
             "review_cards": result.get("review_cards", [])
@@ -335,11 +628,11 @@ async def analyze_quiz(req: AnalysisRequest):
 async def generate_guide(req: TaskRequest):
     start_time = time.time()
     print(f"--- Generating Notebook Guide for: {req.deck_name} ---")
-    text = get_text_or_404(req.deck_id)
+    text = await get_text_or_404(req.deck_id)
     
     # Check Cache
     try:
-        result = await get_cached_or_run(req.deck_id, "guide", text)
+        result = await get_cached_or_run(req.deck_id, "guide", text, refresh=req.refresh)
         await ensure_min_time(start_time, 2.5)
         return {"status": "success", "guide": result.get("guide", {})}
     except Exception as e:
@@ -352,12 +645,12 @@ async def generate_guide(req: TaskRequest):
 async def generate_podcast(req: TaskRequest):
     start_time = time.time()
     print(f"--- Generating Podcast for: {req.deck_name} ({req.options}) ---")
-    text = get_text_or_404(req.deck_id)
+    text = await get_text_or_404(req.deck_id)
     
     try:
         # 1. Generate Script (NO CACHE - always fresh)
         from agent_graph import run_selective_node
-        result = await run_in_threadpool(run_selective_node, text, "podcast_script", extra_data={"options": req.options})
+        result = await run_selective_node(text, "podcast_script", extra_data={"options": req.options})
         script = result.get("podcast_script", [])
         
         if not script:
@@ -368,7 +661,7 @@ async def generate_podcast(req: TaskRequest):
         # but we could cache the filename if we improved the cache logic.
         # For now, let's re-generate audio if requested (or check file existence if we had a stable ID).
         
-        audio_path = await create_podcast_audio(script, deck_id=req.deck_id)
+        audio_path = await create_podcast_audio(script, deck_id=req.deck_id, options=req.options)
         filename = os.path.basename(audio_path)
         
         # URL Logic (Assuming localhost or relative)
@@ -390,19 +683,19 @@ async def generate_podcast(req: TaskRequest):
 async def generate_overview(req: TaskRequest):
     start_time = time.time()
     print(f"--- Generating Audio Overview for: {req.deck_name} ({req.options}) ---")
-    text = get_text_or_404(req.deck_id)
+    text = await get_text_or_404(req.deck_id)
     
     try:
         # 1. Generate Script (NO CACHE - always fresh)
         from agent_graph import run_selective_node
-        result = await run_in_threadpool(run_selective_node, text, "overview_script", extra_data={"options": req.options})
+        result = await run_selective_node(text, "overview_script", extra_data={"options": req.options})
         script_text = result.get("overview_script", "")
         
         if not script_text:
              raise HTTPException(status_code=500, detail="Failed to generate overview script.")
              
         # 2. Generate Audio
-        audio_path = await create_overview_audio(script_text, deck_id=req.deck_id)
+        audio_path = await create_overview_audio(script_text, deck_id=req.deck_id, options=req.options)
         filename = os.path.basename(audio_path)
         audio_url = f"/audio/{filename}"
         
@@ -417,18 +710,76 @@ async def generate_overview(req: TaskRequest):
         print(f"Overview Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def audio_script_lines(kind: str, text: str, options: Dict) -> list:
+    """Generates the podcast/overview script and returns its (text, voice, voice_type) lines."""
+    from agent_graph import run_selective_node
+    result = await run_selective_node(text, f"{kind}_script", extra_data={"options": options})
+    if kind == "podcast":
+        lines = podcast_lines(result.get("podcast_script", []))
+    else:
+        lines = overview_lines(result.get("overview_script", ""))
+
+    if not lines:
+        raise HTTPException(status_code=500, detail=f"Failed to generate {kind} script.")
+    return lines
+
+async def stream_audio(kind: str, deck_id: str, options: Dict):
+    """
+    Progressive audio: serves mp3 bytes as soon as the first line is
+    synthesized instead of after the whole file is written. A finished file
+    for the same deck and mode is reused unless options.regenerate is set.
+    """
+    text = await get_text_or_404(deck_id)
+    output_path = audio_output_path(kind, deck_id, options)
+    audio_url = f"/audio/{os.path.basename(output_path)}"
+
+    if os.path.exists(output_path) and not options.get("regenerate"):
+        print(f"⚡ AUDIO REUSE: {output_path}")
+        return FileResponse(output_path, media_type="audio/mpeg", headers={"X-Audio-Url": audio_url})
+
+    lines = await audio_script_lines(kind, text, options)
+
+    # The complete file is also written to output_path for later reuse
+    return StreamingResponse(
+        iter_speech_audio(lines, output_path),
+        media_type="audio/mpeg",
+        headers={"X-Audio-Url": audio_url, "Cache-Control": "no-store"}
+    )
+
+@app.post("/generate/audio/podcast/stream")
+async def stream_podcast(req: TaskRequest):
+    print(f"--- Streaming Podcast for: {req.deck_name} ({req.options}) ---")
+    return await stream_audio("podcast", req.deck_id, req.options)
+
+@app.get("/generate/audio/podcast/stream")
+async def stream_podcast_get(deck_id: str, mode: str = "default", regenerate: bool = False):
+    """GET variant so an <audio> element can use the stream URL directly."""
+    return await stream_audio("podcast", deck_id, {"mode": mode, "regenerate": regenerate})
+
+@app.post("/generate/audio/overview/stream")
+async def stream_overview(req: TaskRequest):
+    print(f"--- Streaming Audio Overview for: {req.deck_name} ({req.options}) ---")
+    return await stream_audio("overview", req.deck_id, req.options)
+
+@app.get("/generate/audio/overview/stream")
+async def stream_overview_get(deck_id: str, mode: str = "default", regenerate: bool = False):
+    """GET variant so an <audio> element can use the stream URL directly."""
+    return await stream_audio("overview", deck_id, {"mode": mode, "regenerate": regenerate})
+
 
 class ChatRequest(BaseModel):
     history: List[Dict[str, str]] 
     message: str
     context: str = "" # Optional override
     deck_id: str = None # Preferred: ID lookup
+    # "lines": paced line-by-line reveal (latency profile), "text": raw tokens as
+    # they arrive, "sse": tokens as Server-Sent Events (token/done/error)
+    stream_format: str = "lines"
+    batch_ms: int = None # Micro-batch window for "text"/"sse" (default CHAT_STREAM_BATCH_MS)
 
 @app.post("/chat")
 async def chat_endpoint(req: ChatRequest):
-    from agent_graph import llm
-    print(f"DEBUG: Chat endpoint called. LLM Active: {bool(llm)}")
-    from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+    timer = StreamTimer("chat")
 
 
     system_prompt = """You are an expert, supportive AI Tutor. Your goal is to help the user understand their study materials deeply and interactively.
@@ -457,43 +808,79 @@ async def chat_endpoint(req: ChatRequest):
     
     # Resolve context
     doc_context = req.context
+    doc_digest = None
+    deck_text = None
     if not doc_context and req.deck_id:
-        doc_context = DECK_STORE.get(req.deck_id, "")
-        
+        # A sliceable view: only the passages picked below are decompressed
+        deck_text = await run_in_threadpool(DECK_STORE.open, req.deck_id)
+        doc_context = deck_text
+        doc_digest = DECK_STORE.digest(req.deck_id)
+
+    try:
+        if doc_context:
+            # Only the passages relevant to this turn (question + last exchange)
+            query = " ".join([req.message] + [msg.get('content', '') for msg in req.history[-2:]])
+            doc_context = await run_in_threadpool(build_context, doc_context, query, CHAT_CONTEXT_CHARS, doc_digest)
+    finally:
+        if isinstance(deck_text, deck_store.TextBlob):
+            # Unmap the blob; the passages picked above are plain strings
+            deck_text.close()
+
     if doc_context:
-        system_prompt += f"\n\nCONTEXT FROM DOCUMENTS:\n{doc_context[:30000]}\n\nUse this context to guide the conversation. If a question isn't in the context, use your general knowledge but mention it's outside the provided documents."
+        system_prompt += f"\n\nCONTEXT FROM DOCUMENTS:\n{doc_context}\n\nUse this context to guide the conversation. If a question isn't in the context, use your general knowledge but mention it's outside the provided documents."
     else:
         system_prompt += "\n\nProvide clear, helpful guidance based on your general knowledge."
 
 
-    messages = [SystemMessage(content=system_prompt)]
+    messages = [{"role": "system", "content": system_prompt}]
     
     # Trim history
     recent_history = req.history[-10:] 
     
     for msg in recent_history:
-        if msg['role'] == 'user':
-            messages.append(HumanMessage(content=msg['content']))
-        else:
-            messages.append(AIMessage(content=msg['content']))
+        role = "user" if msg['role'] == 'user' else "assistant"
+        messages.append({"role": role, "content": msg['content']})
             
-    messages.append(HumanMessage(content=req.message))
+    messages.append({"role": "user", "content": req.message})
 
-    async def stream_generator():
-        await asyncio.sleep(2.5) # Initial 'Thinking' buffer
+    def error_text(e: Exception) -> str:
+        if "429" in str(e):
+            return "⚠️ **AI Quota Reached**: Google's free tier has a strict limit on speed. Please wait about 30 seconds and try again."
+        return f"Error: {str(e)}"
+
+    async def token_stream():
+        # Tokens from the provider router, optionally re-chunked per time window
+        window = (req.batch_ms if req.batch_ms is not None else CHAT_STREAM_BATCH_MS) / 1000
+        async for text in micro_batch(astream_messages(messages), window):
+            if text:
+                timer.sent(text)
+                yield text
+
+    async def text_generator():
         try:
-            buffer = ""
-            async for chunk in llm.astream(messages):
-                # Use getattr to safely check for content attribute
-                content = getattr(chunk, 'content', chunk)
-                
-                text = ""
-                if isinstance(content, list):
-                    parts = [str(part.get('text', '')) if isinstance(part, dict) else str(part) for part in content]
-                    text = "".join(parts)
-                else:
-                    text = str(content)
+            async for text in token_stream():
+                yield text
+        except Exception as e:
+            print(f"Streaming Error: {e}")
+            yield error_text(e)
+        finally:
+            await timer.finish()
+
+    async def sse_generator():
+        try:
+            async for text in token_stream():
+                yield sse_event("token", {"text": text})
+            yield sse_event("done", await timer.finish())
+        except Exception as e:
+            print(f"Streaming Error: {e}")
+            await timer.finish()
+            yield sse_event("error", {"message": error_text(e)})
 
+    async def line_generator():
+        await thinking_pause()
+        try:
+            buffer = ""
+            async for text in astream_messages(messages):
                 if text:
                     buffer += text
                     # If we have a newline, yield line by line
@@ -501,40 +888,85 @@ async def chat_endpoint(req: ChatRequest):
                         lines = buffer.split("\n")
                         # Yield everything except the last part (which might be incomplete)
                         for i in range(len(lines) - 1):
+                            timer.sent(lines[i] + "\n")
                             yield lines[i] + "\n"
                             # Line-by-line reveal delay
-                            await asyncio.sleep(0.08) 
+                            if LATENCY["line_delay"] > 0:
+                                await asyncio.sleep(LATENCY["line_delay"])
                         buffer = lines[-1]
                     else:
                         # Optional: If the chunk is very long with no newline, still yield some to keep it moving
                         if len(buffer) > 100:
+                            timer.sent(buffer)
                             yield buffer
                             buffer = ""
 
             # Yield any remaining content
             if buffer:
+                timer.sent(buffer)
                 yield buffer
 
         except Exception as e:
             print(f"Streaming Error: {e}")
-            if "429" in str(e):
-                yield "⚠️ **AI Quota Reached**: Google's free tier has a strict limit on speed. Please wait about 30 seconds and try again."
-            else:
-                yield f"Error: {str(e)}"
+            yield error_text(e)
+        finally:
+            await timer.finish()
+
+    if req.stream_format == "sse":
+        return StreamingResponse(
+            sse_generator(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    if req.stream_format == "text":
+        return StreamingResponse(text_generator(), media_type="text/plain", headers={"X-Accel-Buffering": "no"})
+    return StreamingResponse(line_generator(), media_type="text/plain")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Returns response cache and hot deck text counters (hits, misses, evictions, size)."""
+    return {"status": "success", "cache": RESPONSE_CACHE.stats(), "decks": DECK_STORE.stats()}
 
+@app.get("/pools/stats")
+async def pool_stats():
+    """Returns HTTP connection pool stats per provider (open, idle, in flight, waits)."""
+    return {"status": "success", "pools": CLIENTS.stats()}
 
-    return StreamingResponse(stream_generator(), media_type="text/plain")
+@app.get("/streams/stats")
+async def stream_stats():
+    """Returns time-to-first-byte and tokens/sec per streaming endpoint."""
+    return {"status": "success", "streams": STREAM_METRICS.stats()}
+
+@app.get("/providers/stats")
+async def provider_stats():
+    """Returns router health per LLM provider (circuit state, latency EWMA/p95, error rate, quota use)."""
+    from llm_provider import ROUTER
+    return {"status": "success", "router": ROUTER.stats()}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: task and span duration histograms, LLM requests and tokens."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 @app.get("/decks/public")
-async def fetch_public_decks():
-    """Returns a list of public/featured decks."""
-    return {"status": "success", "decks": get_public_decks()}
+async def fetch_public_decks(request: Request, category: str = None, q: str = None, limit: Optional[int] = None, offset: int = 0):
+    """
+    Returns public/featured decks, newest first, optionally filtered by
+    category and title search: all of them, or a page when limit is given.
+    Honors If-None-Match (304 when unchanged).
+    """
+    page = PUBLIC_CATALOG.query(category, q, limit, offset)
+    headers = {"ETag": page["etag"], "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == page["etag"]:
+        return Response(status_code=304, headers=headers)
+    body = {"status": "success", **{k: v for k, v in page.items() if k != "etag"}}
+    return JSONResponse(body, headers=headers)
 
 @app.post("/decks/{deck_id}/share")
 async def share_deck(deck_id: str, info: Dict = Body(...)):
     """Shares a deck to the public list."""
     # Ensure text exists
-    get_text_or_404(deck_id)
+    await require_deck(deck_id)
     
     deck_info = {
         "id": deck_id,
@@ -545,13 +977,46 @@ async def share_deck(deck_id: str, info: Dict = Body(...)):
         "image": info.get("image", "https://images.unsplash.com/photo-1544648151-1823ed3bd333?q=80\u0026w=2000\u0026auto=format\u0026fit=crop"),
         "color": info.get("color", "from-blue-900/40 to-black/80")
     }
-    save_public_deck(deck_info)
-    return {"status": "success", "message": "Deck shared successfully!"}
+    added = await run_in_threadpool(PUBLIC_CATALOG.add, deck_info)
+    message = "Deck shared successfully!" if added else "Deck is already shared."
+    return {"status": "success", "message": message}
+
+ANKI_STREAM_CHUNK = 64 * 1024
+
+@app.get("/decks/{deck_id}/anki")
+async def download_anki(deck_id: str, key: str = None):
+    """
+    Streams the deck's Anki package (.apkg). key selects a specific export
+    (the download_path returned by card generation); default is the latest.
+    """
+    export = latest_anki_export(deck_id) or {}
+    if key and key != export.get("key") and not package_belongs_to(key, deck_id):
+        # Another deck's package: don't serve it under this deck's URL
+        key = None
+    else:
+        key = key or export.get("key")
+    data = await run_in_threadpool(get_anki_package, key) if key else None
+    if data is None:
+        raise HTTPException(status_code=404, detail="No Anki export for this deck. Generate cards first.")
+
+    deck_name = export.get("deck_name") or (deck_store.get_deck_ref(deck_id) or {}).get("deck_name") or "FlashDeck"
+    filename = "".join(c for c in deck_name if c.isalnum() or c in " -_").strip() or "FlashDeck"
+
+    async def chunks():
+        view = memoryview(data)
+        for start in range(0, len(data), ANKI_STREAM_CHUNK):
+            yield bytes(view[start:start + ANKI_STREAM_CHUNK])
+
+    return StreamingResponse(chunks(), media_type="application/octet-stream", headers={
+        "Content-Disposition": f'attachment; filename="{filename}.apkg"',
+        "Content-Length": str(len(data)),
+        "ETag": f'"{key}"',
+    })
 
 @app.get("/decks/{deck_id}/text")
 async def get_deck_text(deck_id: str):
     """Returns the full text of a deck."""
-    text = get_text_or_404(deck_id)
+    text = await get_text_or_404(deck_id)
     return {"status": "success", "text": text}
 
 
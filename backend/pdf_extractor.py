@@ -0,0 +1,104 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, List
+
+import fitz  # PyMuPDF
+
+# --- EXTRACTION CONFIG ---
+# Small documents are extracted inline; larger ones are split into page
+# ranges and spread across a process pool.
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXTRACT_PARALLEL_MIN_PAGES = int(os.getenv("EXTRACT_PARALLEL_MIN_PAGES", "32"))
+EXTRACT_MIN_PAGES_PER_TASK = 8
+
+_process_pool = None
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # 'spawn' avoids forking the (multi-threaded) API server process
+        _process_pool = ProcessPoolExecutor(
+            max_workers=EXTRACT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+def _reset_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+def _read_source(pdf_source):
+    # Paths are opened by PyMuPDF directly (and by each worker process, so
+    # the document is never pickled); bytes and file-like objects are read
+    if isinstance(pdf_source, (bytes, str, os.PathLike)):
+        return pdf_source
+    return pdf_source.read()
+
+def _open(pdf_source) -> fitz.Document:
+    if isinstance(pdf_source, bytes):
+        return fitz.open(stream=pdf_source, filetype="pdf")
+    return fitz.open(pdf_source, filetype="pdf")
+
+def _extract_page_range(pdf_source, start: int, end: int) -> List[str]:
+    """Extracts pages [start, end) in a worker process."""
+    with _open(pdf_source) as doc:
+        return [doc[i].get_text() for i in range(start, end)]
+
+def _page_ranges(page_count: int, workers: int) -> List[tuple]:
+    per_task = max(EXTRACT_MIN_PAGES_PER_TASK, -(-page_count // workers))
+    return [(start, min(start + per_task, page_count)) for start in range(0, page_count, per_task)]
+
+def iter_pages(pdf_source) -> Iterator[str]:
+    """
+    Yields the text of each page, in page order, as soon as it is ready.
+    pdf_source is a path, bytes or a file-like object. Large documents are
+    extracted in parallel page ranges.
+    """
+    pdf_source = _read_source(pdf_source)
+    doc = _open(pdf_source)
+    page_count = doc.page_count
+
+    if page_count < EXTRACT_PARALLEL_MIN_PAGES or EXTRACT_WORKERS < 2:
+        try:
+            for page in doc:
+                yield page.get_text()
+        finally:
+            doc.close()
+        return
+
+    doc.close()
+    next_page = 0
+    futures = []
+    try:
+        pool = _get_process_pool()
+        futures = [
+            pool.submit(_extract_page_range, pdf_source, start, end)
+            for start, end in _page_ranges(page_count, EXTRACT_WORKERS)
+        ]
+        for future in futures:
+            for page_text in future.result():
+                next_page += 1
+                yield page_text
+    except BrokenProcessPool as e:
+        # A worker died; drop the pool and finish the remaining pages inline
+        print(f"Extraction pool failed ({e}), continuing in-process from page {next_page + 1}")
+        _reset_process_pool()
+        yield from _extract_page_range(pdf_source, next_page, page_count)
+    finally:
+        for future in futures:
+            future.cancel()
+
+def extract_text(pdf_source) -> str:
+    """
+    The whole document's text. Errors propagate: a document that fails
+    part-way must not be mistaken for (and stored as) its full text.
+    """
+    parts = []
+    for page_text in iter_pages(pdf_source):
+        parts.append(page_text)
+        parts.append("\n")
+    return "".join(parts)
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# --- PUBLIC CATALOG CONFIG ---
+# Shared decks live in SQLite (WAL, so readers never block the writer and
+# several workers can share the file). Query results are kept in an
+# in-memory snapshot that is dropped whenever the catalog changes, in this
+# process or any other (detected through PRAGMA data_version).
+DATA_DIR = "data"
+PUBLIC_DECKS_DB = os.getenv("PUBLIC_DECKS_DB", os.path.join(DATA_DIR, "public_decks.db"))
+# Previous JSON catalog, imported once and renamed to *.migrated
+LEGACY_PUBLIC_DECKS_FILE = os.path.join(DATA_DIR, "public_decks.json")
+PUBLIC_SNAPSHOT_SIZE = 256  # cached query pages
+PUBLIC_PAGE_MAX = 200
+
+DECK_FIELDS = ("id", "title", "category", "sources", "date", "image", "color")
+
+
+class PublicCatalog:
+    def __init__(self, db_path: str, legacy_file: str = None):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5.0)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._snapshot: "OrderedDict[tuple, Dict]" = OrderedDict()
+        self._data_version = None
+        self.hits = 0
+        self.misses = 0
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(
+                "CREATE TABLE IF NOT EXISTS public_decks ("
+                " id TEXT PRIMARY KEY, title TEXT NOT NULL, category TEXT NOT NULL,"
+                " sources INTEGER NOT NULL DEFAULT 1, date TEXT, image TEXT, color TEXT,"
+                " created_at REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS public_decks_created ON public_decks (created_at DESC, id);"
+                "CREATE INDEX IF NOT EXISTS public_decks_category ON public_decks (category, created_at DESC, id);"
+                # Bumped with every write; part of the ETag, shared by all workers
+                "CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);"
+                "INSERT OR IGNORE INTO catalog_meta (key, value) VALUES ('revision', 0);"
+            )
+            self._db.commit()
+        if legacy_file and os.path.exists(legacy_file):
+            self._migrate(legacy_file)
+
+    def _migrate(self, legacy_file: str):
+        try:
+            with open(legacy_file, "r") as f:
+                decks = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Public deck migration skipped: {e}")
+            return
+        # Later entries were appended later; keep that order within a day
+        added = sum(
+            1 for i, deck in enumerate(decks)
+            if self.add(deck, created_at=(_parse_date(deck.get("date")) or time.time()) + i / 1000)
+        )
+        os.replace(legacy_file, f"{legacy_file}.migrated")
+        print(f"📦 PUBLIC DECKS MIGRATED: {added} of {len(decks)} from {legacy_file}")
+
+    def _fresh(self):
+        """Drops the snapshot if any connection has committed since it was filled. Caller holds the lock."""
+        version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._data_version = version
+            self._snapshot.clear()
+
+    def add(self, deck_info: Dict, created_at: float = None) -> bool:
+        """Adds a deck; returns False if it is already in the catalog."""
+        row = {field: deck_info.get(field) for field in DECK_FIELDS}
+        row.update(
+            title=row["title"] or "Untitled Deck",
+            category=row["category"] or "General",
+            sources=row["sources"] or 1,
+            created_at=created_at or time.time(),
+        )
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO public_decks (id, title, category, sources, date, image, color, created_at) "
+                "VALUES (:id, :title, :category, :sources, :date, :image, :color, :created_at)", row
+            )
+            if cursor.rowcount:
+                self._db.execute("UPDATE catalog_meta SET value = value + 1 WHERE key = 'revision'")
+            self._db.commit()
+            # data_version ignores this connection's own commits
+            self._snapshot.clear()
+            return cursor.rowcount > 0
+
+    def query(self, category: str = None, search: str = None, limit: Optional[int] = None, offset: int = 0) -> Dict:
+        """
+        One page of decks, newest first, with the total count and an ETag.
+        Without a limit every deck from offset on is returned.
+        """
+        if limit is not None:
+            limit = max(1, min(limit, PUBLIC_PAGE_MAX))
+        offset = max(0, offset)
+        key = (category or "", search or "", limit, offset)
+        with self._lock:
+            self._fresh()
+            page = self._snapshot.get(key)
+            if page is not None:
+                self._snapshot.move_to_end(key)
+                self.hits += 1
+                return page
+
+            self.misses += 1
+            where, params = [], []
+            if category:
+                where.append("category = ?")
+                params.append(category)
+            if search:
+                where.append("title LIKE ? ESCAPE '\\'")
+                params.append("%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+            clause = f"WHERE {' AND '.join(where)}" if where else ""
+            revision = self._db.execute("SELECT value FROM catalog_meta WHERE key = 'revision'").fetchone()[0]
+            total = self._db.execute(f"SELECT COUNT(*) FROM public_decks {clause}", params).fetchone()[0]
+            rows = self._db.execute(
+                f"SELECT {', '.join(DECK_FIELDS)} FROM public_decks {clause} "
+                "ORDER BY created_at DESC, id LIMIT ? OFFSET ?", (*params, -1 if limit is None else limit, offset)
+            ).fetchall()
+            query_hash = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:12]
+            page = {
+                "decks": [dict(row) for row in rows],
+                "total": total,
+                "limit": limit,
+                "offset": offset,
+                "next_offset": offset + limit if limit is not None and offset + limit < total else None,
+                "etag": f'W/"{revision}-{query_hash}"',
+            }
+            self._snapshot[key] = page
+            while len(self._snapshot) > PUBLIC_SNAPSHOT_SIZE:
+                self._snapshot.popitem(last=False)
+            return page
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "decks": self._db.execute("SELECT COUNT(*) FROM public_decks").fetchone()[0],
+                "snapshot_pages": len(self._snapshot),
+                "snapshot_hits": self.hits,
+                "snapshot_misses": self.misses,
+            }
+
+def _parse_date(value: Optional[str]) -> Optional[float]:
+    """Legacy entries only have a display date ("Jan 05, 2025")."""
+    try:
+        return time.mktime(time.strptime(value, "%b %d, %Y"))
+    except (TypeError, ValueError):
+        return None
+
+PUBLIC_CATALOG = PublicCatalog(PUBLIC_DECKS_DB, LEGACY_PUBLIC_DECKS_FILE)
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from shared_state import open_state
+
+# --- CACHE CONFIG ---
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+RESPONSE_CACHE_MAX_MB = float(os.getenv("RESPONSE_CACHE_MAX_MB", "64"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+# Shared tier that survives restarts and is read by every worker (SQLite, or
+# Redis when SHARED_STATE_URL is set). Set to an empty value to disable SQLite.
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB", os.path.join("data", "response_cache.db"))
+
+# State keys that are inputs or intermediates, not worth caching
+UNCACHED_KEYS = {"chunk_count", "partial_cards", "deck_digest", "chunk_tokens", "task", "missed_questions", "errors"}
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+def make_cache_key(task_type: str, deck_digest: str, options: Dict = None) -> str:
+    """Builds a key from the task, a digest of the deck text and a canonical hash of options."""
+    canonical = json.dumps(options or {}, sort_keys=True, separators=(",", ":"), default=str)
+    options_hash = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+    return f"{task_type}:{deck_digest}:{options_hash}"
+
+class ResponseCache:
+    """
+    LRU cache for generation results, bounded by entry count and memory,
+    with a TTL and an optional shared tier (see shared_state.py) that every
+    worker reads and that survives restarts. Keys are content-addressed, so
+    a worker's memory tier never holds a stale result.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float, db_path: str = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._shared = open_state("response", db_path, "response_cache")
+
+    def _get_local(self, key: str, now: float) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                expires_at, size, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+                self.expirations += 1
+            return None
+
+    def _read_shared(self, key: str) -> Optional[bytes]:
+        """Blocking read of the shared tier; runs without self._lock held."""
+        if not self._shared:
+            return None
+        try:
+            return self._shared.get(key)
+        except Exception as e:
+            print(f"Response cache shared read failed: {e}")
+            return None
+
+    def _found_shared(self, key: str, payload: Optional[bytes], now: float) -> Optional[Dict]:
+        with self._lock:
+            if payload is None:
+                self.misses += 1
+                return None
+            value = json.loads(payload)
+            # The shared tier does not report the remaining TTL; restart it locally
+            self._store(key, value, len(payload), now + self.ttl_seconds)
+            self.hits += 1
+            self.disk_hits += 1
+            return value
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        value = self._get_local(key, now)
+        if value is not None:
+            return value
+        return self._found_shared(key, self._read_shared(key), now)
+
+    def peek(self, key: str) -> Optional[Dict]:
+        """get() without counting a hit or miss, for polling while another worker generates."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.time():
+                return entry[2]
+        payload = self._read_shared(key)
+        if payload is None:
+            return None
+        value = json.loads(payload)
+        with self._lock:
+            self._store(key, value, len(payload), time.time() + self.ttl_seconds)
+        return value
+
+    async def aget(self, key: str) -> Optional[Dict]:
+        """get() for the event loop: the memory tier inline, the shared tier in a thread."""
+        now = time.time()
+        value = self._get_local(key, now)
+        if value is not None:
+            return value
+        payload = await asyncio.to_thread(self._read_shared, key) if self._shared else None
+        return self._found_shared(key, payload, now)
+
+    def set(self, key: str, value: Dict):
+        value = {k: v for k, v in value.items() if k not in UNCACHED_KEYS}
+        payload = json.dumps(value, default=str)
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._store(key, value, len(payload), expires_at)
+        if self._shared:
+            try:
+                self._shared.set(key, payload.encode("utf-8"), self.ttl_seconds)
+            except Exception as e:
+                print(f"Response cache shared write failed: {e}")
+
+    async def aset(self, key: str, value: Dict):
+        """set() for the event loop: serializing and the shared write run in a thread."""
+        await asyncio.to_thread(self.set, key, value)
+
+    def delete(self, key: str):
+        """Drops key from this worker's memory and from the shared tier."""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+        if self._shared:
+            try:
+                self._shared.delete(key)
+            except Exception as e:
+                print(f"Response cache shared delete failed: {e}")
+
+    async def adelete(self, key: str):
+        await asyncio.to_thread(self.delete, key)
+
+    def _store(self, key: str, value: Dict, size: int, expires_at: float):
+        if key in self._entries:
+            self._remove(key)
+        if size > self.max_bytes:
+            # Too large for the memory tier; the disk tier still has it
+            return
+        self._entries[key] = (expires_at, size, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+        if self._shared:
+            stats["shared_backend"] = self._shared.name
+            stats["disk_entries"] = self._shared.count()
+        return stats
+
+RESPONSE_CACHE = ResponseCache(
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=int(RESPONSE_CACHE_MAX_MB * 1024 * 1024),
+    ttl_seconds=RESPONSE_CACHE_TTL,
+    db_path=RESPONSE_CACHE_DB,
+)
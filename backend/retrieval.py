@@ -0,0 +1,221 @@
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from deck_store import DECKS_DIR
+from response_cache import text_digest
+
+# --- RETRIEVAL CONFIG ---
+# Each deck's text is split into small overlapping passages and indexed with
+# BM25 at upload. Chat and generators then send the passages that best match
+# the question (or the deck's main topics) instead of a fixed-size prefix.
+INDEX_DIR = os.path.join(DECKS_DIR, "index")        # {text_hash}.npz
+RETRIEVAL_CHUNK_CHARS = int(os.getenv("RETRIEVAL_CHUNK_CHARS", "1200"))
+RETRIEVAL_CHUNK_OVERLAP = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP", "150"))
+RETRIEVAL_INDEX_CACHE_SIZE = int(os.getenv("RETRIEVAL_INDEX_CACHE_SIZE", "64"))
+CHAT_CONTEXT_CHARS = int(os.getenv("CHAT_CONTEXT_CHARS", "3000"))
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+os.makedirs(INDEX_DIR, exist_ok=True)
+
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below between
+both but by can could did do does doing down during each few for from further had has have having he her here
+hers him his how i if in into is it its itself just me more most my no nor not now of off on once only or other
+our ours out over own same she should so some such than that the their theirs them then there these they this
+those through to too under until up very was we were what when where which while who whom why will with would
+you your yours
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+def split_passages(text: str) -> List[Tuple[int, int]]:
+    """Returns (start, end) offsets of overlapping passages, preferring paragraph/sentence breaks."""
+    spans = []
+    size, overlap = RETRIEVAL_CHUNK_CHARS, min(RETRIEVAL_CHUNK_OVERLAP, RETRIEVAL_CHUNK_CHARS // 2)
+    start, length = 0, len(text)
+    while start < length:
+        end = min(start + size, length)
+        if end < length:
+            # Back off to the nearest paragraph, line or sentence break in the last third
+            window_start = start + (size * 2) // 3
+            for sep in ("\n\n", "\n", ". "):
+                cut = text.rfind(sep, window_start, end)
+                if cut != -1:
+                    end = cut + len(sep)
+                    break
+        spans.append((start, end))
+        if end >= length:
+            break
+        start = max(end - overlap, start + 1)
+    return spans
+
+
+class DeckIndex:
+    """BM25 index over one deck's passages, stored as flat NumPy arrays (CSR by term)."""
+
+    def __init__(self, spans, terms, indptr, doc_ids, tfs, doc_len):
+        self.spans = spans          # (n_passages, 2) character offsets
+        self.terms = terms          # vocabulary, sorted
+        self.indptr = indptr        # postings for term i: doc_ids/tfs[indptr[i]:indptr[i + 1]]
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.vocab = {term: i for i, term in enumerate(terms.tolist())}
+        n_docs = max(len(doc_len), 1)
+        df = np.diff(indptr).astype(np.float64)
+        self.idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+        self.avg_len = float(doc_len.mean()) if len(doc_len) else 0.0
+
+    @classmethod
+    def build(cls, text: str) -> "DeckIndex":
+        spans = split_passages(text)
+        postings = {}
+        doc_len = np.zeros(len(spans), dtype=np.int32)
+        for doc_id, (start, end) in enumerate(spans):
+            counts = Counter(tokenize(text[start:end]))
+            doc_len[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        terms = sorted(postings)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            indptr[i + 1] = indptr[i] + len(postings[term])
+        pairs = [pair for term in terms for pair in postings[term]]
+        doc_ids = np.array([d for d, _ in pairs], dtype=np.int32)
+        tfs = np.array([tf for _, tf in pairs], dtype=np.int32)
+        return cls(np.array(spans, dtype=np.int64).reshape(-1, 2), np.array(terms, dtype=str), indptr, doc_ids, tfs, doc_len)
+
+    def save(self, path: str):
+        tmp_path = f"{path}.part.npz"
+        np.savez(tmp_path, spans=self.spans, terms=self.terms, indptr=self.indptr,
+                 doc_ids=self.doc_ids, tfs=self.tfs, doc_len=self.doc_len)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "DeckIndex":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["spans"], data["terms"], data["indptr"], data["doc_ids"], data["tfs"], data["doc_len"])
+
+    def scores(self, query_terms: List[str]) -> np.ndarray:
+        scores = np.zeros(len(self.doc_len), dtype=np.float64)
+        if not self.avg_len:
+            return scores
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len / self.avg_len)
+        for term, weight in Counter(query_terms).items():
+            i = self.vocab.get(term)
+            if i is None:
+                continue
+            lo, hi = self.indptr[i], self.indptr[i + 1]
+            docs, tf = self.doc_ids[lo:hi], self.tfs[lo:hi]
+            scores[docs] += weight * self.idf[i] * tf * (BM25_K1 + 1) / (tf + norm[docs])
+        return scores
+
+    def keywords(self, n: int = 40) -> List[str]:
+        """The deck's most characteristic terms (total tf x idf), used when there is no question."""
+        if not len(self.tfs):
+            return []
+        # Every term has at least one posting, so reduceat ranges are never empty
+        weight = np.add.reduceat(self.tfs, self.indptr[:-1]) * self.idf
+        top = np.argsort(-weight)[:n]
+        return [str(self.terms[i]) for i in top]
+
+    def search(self, query: str, k: int = 5) -> List[int]:
+        scores = self.scores(tokenize(query))
+        order = np.argsort(-scores, kind="stable")[:k]
+        return [int(i) for i in order if scores[i] > 0]
+
+    def select(self, text: str, query: str, budget_chars: int) -> str:
+        """
+        Picks the best-scoring passages that fit in budget_chars and returns
+        them in document order. Without a query, passages are scored against
+        the deck's keywords, with one pick per document segment first so the
+        whole deck is covered rather than just its densest section.
+        """
+        n = len(self.spans)
+        query_terms = tokenize(query)
+        scores = self.scores(query_terms or self.keywords())
+        lengths = self.spans[:, 1] - self.spans[:, 0]
+
+        order = list(np.argsort(-scores, kind="stable"))
+        if not query_terms and n:
+            per_passage = max(int(lengths.mean()), 1)
+            segments = max(1, min(n, budget_chars // per_passage // 2))
+            bounds = np.linspace(0, n, segments + 1).astype(int)
+            spread = [lo + int(np.argmax(scores[lo:hi])) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+            picked = set(spread)
+            order = spread + [i for i in order if i not in picked]
+
+        chosen, used = [], 0
+        for i in order:
+            if used + lengths[i] > budget_chars:
+                continue
+            chosen.append(i)
+            used += lengths[i]
+
+        # Merge overlapping/adjacent passages so overlap text is sent once
+        merged = []
+        for start, end in sorted(self.spans[i].tolist() for i in chosen):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return "\n[...]\n".join(text[start:end].strip() for start, end in merged)
+
+
+# --- INDEX CACHE ---
+# Built at upload and persisted next to the deck text; hot indexes stay in memory.
+_INDEXES: "OrderedDict[str, DeckIndex]" = OrderedDict()
+_INDEX_LOCK = threading.Lock()
+
+def _index_path(text_hash: str) -> str:
+    return os.path.join(INDEX_DIR, f"{text_hash}.npz")
+
+def get_index(text: str, text_hash: Optional[str] = None) -> DeckIndex:
+    text_hash = text_hash or text_digest(text)
+    with _INDEX_LOCK:
+        index = _INDEXES.get(text_hash)
+        if index is not None:
+            _INDEXES.move_to_end(text_hash)
+            return index
+
+    path = _index_path(text_hash)
+    index = None
+    if os.path.exists(path):
+        try:
+            index = DeckIndex.load(path)
+        except Exception as e:
+            print(f"Index load failed ({text_hash[:12]}): {e}")
+    if index is None:
+        # text may be a deck_store.TextBlob; a full slice reads it as one str
+        index = DeckIndex.build(text[:])
+        try:
+            index.save(path)
+        except OSError as e:
+            print(f"Index save failed ({text_hash[:12]}): {e}")
+        print(f"🔎 INDEXED: {text_hash[:12]} ({len(index.spans)} passages, {len(index.terms)} terms)")
+
+    with _INDEX_LOCK:
+        _INDEXES[text_hash] = index
+        while len(_INDEXES) > RETRIEVAL_INDEX_CACHE_SIZE:
+            _INDEXES.popitem(last=False)
+    return index
+
+def build_context(text: str, query: str, budget_chars: int, text_hash: Optional[str] = None) -> str:
+    """
+    Returns text unchanged when it fits the budget, otherwise the most relevant
+    passages. text may also be a sliceable view (deck_store.TextBlob).
+    """
+    if len(text) <= budget_chars:
+        return text[:]
+    return get_index(text, text_hash).select(text, query, budget_chars)
@@ -0,0 +1,308 @@
+import os
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# --- SHARED STATE CONFIG ---
+# State that every worker process must see: generation results, deck
+# references and text, and the locks that stop two workers generating the
+# same result. By default it lives in SQLite files under data/, which all
+# workers on one host share (uvicorn --workers N). With
+# SHARED_STATE_URL=redis://host:6379/0 (needs the redis package) it is
+# shared by workers on several hosts; memory:// keeps it in-process.
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL", "")
+SHARED_STATE_DB = os.getenv("SHARED_STATE_DB", os.path.join("data", "shared_state.db"))
+# A worker generating a result holds its lock for as long as it runs,
+# renewed every GENERATION_LOCK_TTL / 3; a crashed worker's lock expires
+# after the TTL. Others poll for the result meanwhile.
+GENERATION_LOCK_TTL = float(os.getenv("GENERATION_LOCK_TTL", "60"))
+GENERATION_LOCK_POLL = float(os.getenv("GENERATION_LOCK_POLL", "0.25"))
+# Expired SQLite rows are deleted by whichever worker writes next, at most this often (seconds)
+SHARED_STATE_EXPIRE_INTERVAL = float(os.getenv("SHARED_STATE_EXPIRE_INTERVAL", "60"))
+
+
+class MemoryState:
+    """In-process backend: same interface, shared by nothing but this worker."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._items: Dict[str, Tuple[bytes, float]] = {}  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def _live(self, key: str, now: float) -> Optional[bytes]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        if item[1] <= now:
+            del self._items[key]
+            return None
+        return item[0]
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self._live(key, time.time())
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        with self._lock:
+            self._items[key] = (value, time.time() + ttl if ttl else float("inf"))
+
+    def add(self, key: str, value: bytes, ttl: float = None) -> bool:
+        """Sets key only if it is absent (or expired); True if it was set."""
+        with self._lock:
+            if self._live(key, time.time()) is not None:
+                return False
+            self._items[key] = (value, time.time() + ttl if ttl else float("inf"))
+            return True
+
+    def touch(self, key: str, value: bytes, ttl: float) -> bool:
+        """Extends key's expiry if it still holds value (lease heartbeat); True if it did."""
+        with self._lock:
+            if self._live(key, time.time()) != value:
+                return False
+            self._items[key] = (value, time.time() + ttl)
+            return True
+
+    def delete(self, key: str, value: bytes = None):
+        """Deletes key; with value, only if it still holds that value (lock release)."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and (value is None or item[0] == value):
+                del self._items[key]
+
+    def count(self) -> int:
+        with self._lock:
+            now = time.time()
+            return sum(1 for _, expires_at in self._items.values() if expires_at > now)
+
+
+class SqliteState:
+    """One table of (key, value, expires_at) in a WAL database shared by every local worker."""
+
+    name = "sqlite"
+
+    def __init__(self, db_path: str, table: str = "shared_state"):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.table = table
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=10.0)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires ON {table} (expires_at)")
+            self._db.commit()
+        self._next_expiry = 0.0
+
+    def _expire(self, now: float):
+        """Deletes expired rows every SHARED_STATE_EXPIRE_INTERVAL; reads already skip them. Call with _lock held."""
+        if now < self._next_expiry:
+            return
+        self._next_expiry = now + SHARED_STATE_EXPIRE_INTERVAL
+        self._db.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,))
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT value FROM {self.table} WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        # Rows written before values were stored as bytes come back as str
+        return row[0].encode("utf-8") if isinstance(row[0], str) else row[0]
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + ttl if ttl else float("inf"))
+            )
+            self._expire(now)
+            self._db.commit()
+
+    def add(self, key: str, value: bytes, ttl: float = None) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                f"INSERT INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+                f"WHERE {self.table}.expires_at <= ?",
+                (key, value, now + ttl if ttl else float("inf"), now)
+            )
+            self._expire(now)
+            self._db.commit()
+            return cursor.rowcount > 0
+
+    def touch(self, key: str, value: bytes, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                f"UPDATE {self.table} SET expires_at = ? WHERE key = ? AND value = ? AND expires_at > ?",
+                (now + ttl, key, value, now)
+            )
+            self._db.commit()
+            return cursor.rowcount > 0
+
+    def delete(self, key: str, value: bytes = None):
+        with self._lock:
+            if value is None:
+                self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            else:
+                self._db.execute(f"DELETE FROM {self.table} WHERE key = ? AND value = ?", (key, value))
+            self._db.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute(
+                f"SELECT COUNT(*) FROM {self.table} WHERE expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+
+
+class RedisState:
+    """Redis (or any server speaking its protocol) under a key prefix."""
+
+    name = "redis"
+    # Deletes the lock only if we still own it
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+    # Extends the lease only if we still own it
+    _TOUCH = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end return 0"
+
+    def __init__(self, url: str, prefix: str):
+        import redis
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._redis.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        self._redis.set(self.prefix + key, value, px=int(ttl * 1000) if ttl else None)
+
+    def add(self, key: str, value: bytes, ttl: float = None) -> bool:
+        return bool(self._redis.set(self.prefix + key, value, nx=True, px=int(ttl * 1000) if ttl else None))
+
+    def touch(self, key: str, value: bytes, ttl: float) -> bool:
+        return bool(self._redis.eval(self._TOUCH, 1, self.prefix + key, value, int(ttl * 1000)))
+
+    def delete(self, key: str, value: bytes = None):
+        if value is None:
+            self._redis.delete(self.prefix + key)
+        else:
+            self._redis.eval(self._RELEASE, 1, self.prefix + key, value)
+
+    def count(self) -> int:
+        return sum(1 for _ in self._redis.scan_iter(match=self.prefix + "*", count=1000))
+
+
+def open_state(namespace: str, sqlite_path: str = None, table: str = "shared_state"):
+    """
+    The backend for one kind of shared state: Redis (or memory) when
+    SHARED_STATE_URL says so, else the given SQLite file, else None (the
+    caller has nothing to share beyond this host's disk).
+    """
+    if SHARED_STATE_URL.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            return RedisState(SHARED_STATE_URL, f"flashdeck:{namespace}:")
+        except ImportError:
+            print("SHARED_STATE_URL needs the redis package (pip install redis); using local state")
+    elif SHARED_STATE_URL.startswith("memory://"):
+        return MemoryState()
+    elif SHARED_STATE_URL:
+        print(f"Unknown SHARED_STATE_URL scheme: {SHARED_STATE_URL}; using local state")
+    if sqlite_path:
+        try:
+            return SqliteState(sqlite_path, table)
+        except Exception as e:
+            print(f"Shared state ({namespace}) disabled: {e}")
+    return None
+
+
+class WorkerLocks:
+    """
+    Cross-worker counterpart of SingleFlight: one worker runs the work for
+    a key while the others poll for its result instead of repeating it.
+    """
+
+    def __init__(self, state, ttl: float, poll: float):
+        self.state = state
+        self.ttl = ttl
+        self.poll = poll
+        # Leases still need an owner within this process when nothing is shared
+        self._local = MemoryState()
+
+    @staticmethod
+    async def _heartbeat(state, key: str, owner: bytes, ttl: float):
+        """Renews key every ttl / 3 while the holder works, so it only expires if this worker dies."""
+        while True:
+            await asyncio.sleep(ttl / 3)
+            try:
+                if not await asyncio.to_thread(state.touch, key, owner, ttl):
+                    print(f"Lost lock {key} (expired before renewal)")
+            except Exception as e:
+                print(f"Lease renewal failed ({key}): {e}")
+
+    @asynccontextmanager
+    async def lease(self, key: str, ttl: float):
+        """
+        Holds key for as long as the block runs, renewed every ttl / 3 so it
+        only expires if this worker dies. Yields False (and holds nothing)
+        when a live owner, in this process or another, already holds it.
+        """
+        state = self.state or self._local
+        owner = uuid.uuid4().hex.encode("ascii")
+        if not await asyncio.to_thread(state.add, f"lease:{key}", owner, ttl):
+            yield False
+            return
+
+        renewer = asyncio.ensure_future(self._heartbeat(state, f"lease:{key}", owner, ttl))
+        try:
+            yield True
+        finally:
+            renewer.cancel()
+            try:
+                await asyncio.to_thread(state.delete, f"lease:{key}", owner)
+            except Exception as e:
+                print(f"Lease release failed ({key}): {e}")
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]], lookup: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Returns (result, shared): fn()'s result, or lookup()'s once it finds
+        the result another worker produced (shared=True).
+        """
+        if self.state is None:
+            return await fn(), False
+        owner = uuid.uuid4().hex.encode("ascii")
+        waited = False
+        while not await asyncio.to_thread(self.state.add, f"lock:{key}", owner, self.ttl):
+            if not waited:
+                print(f"⏳ WAITING ON OTHER WORKER: {key}")
+                waited = True
+            await asyncio.sleep(self.poll)
+            result = await asyncio.to_thread(lookup)
+            if result is not None:
+                return result, True
+        # Held for as long as fn runs, however long that is
+        renewer = asyncio.ensure_future(self._heartbeat(self.state, f"lock:{key}", owner, self.ttl))
+        try:
+            if waited:
+                # The other worker may have finished between our last poll and its release
+                result = await asyncio.to_thread(lookup)
+                if result is not None:
+                    return result, True
+            return await fn(), False
+        finally:
+            renewer.cancel()
+            try:
+                await asyncio.to_thread(self.state.delete, f"lock:{key}", owner)
+            except Exception as e:
+                print(f"Generation lock release failed ({key}): {e}")
+
+GENERATION_LOCKS = WorkerLocks(open_state("locks", SHARED_STATE_DB, "locks"), GENERATION_LOCK_TTL, GENERATION_LOCK_POLL)
@@ -0,0 +1,84 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller starts the
+    work, everyone else awaits the same task. The work runs as its own task,
+    so a disconnecting caller does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._tasks
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            print(f"🔗 JOINED IN-FLIGHT: {key}")
+        return await asyncio.shield(task)
+
+
+class _Broadcast:
+    """Buffers everything a producer has emitted so late subscribers can replay it."""
+
+    def __init__(self, producer: AsyncIterator[str]):
+        self.chunks: List[str] = []
+        self.done = False
+        self._changed = asyncio.Condition()
+        self.task = asyncio.ensure_future(self._pump(producer))
+
+    async def _pump(self, producer: AsyncIterator[str]):
+        try:
+            async for chunk in producer:
+                async with self._changed:
+                    self.chunks.append(chunk)
+                    self._changed.notify_all()
+        except Exception as e:
+            print(f"Stream producer error: {e}")
+        finally:
+            async with self._changed:
+                self.done = True
+                self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        idx = 0
+        while True:
+            async with self._changed:
+                while idx >= len(self.chunks) and not self.done:
+                    await self._changed.wait()
+                pending = self.chunks[idx:]
+                finished = self.done
+            for chunk in pending:
+                yield chunk
+            idx += len(pending)
+            if finished and idx >= len(self.chunks):
+                return
+
+
+class StreamFlight:
+    """
+    Single-flight for streamed responses. Concurrent requests for the same key
+    share one producer; a late joiner first receives the already-streamed
+    prefix and then follows the live tail.
+    """
+
+    def __init__(self):
+        self._broadcasts: Dict[str, _Broadcast] = {}
+
+    def subscribe(self, key: str, producer_factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        broadcast = self._broadcasts.get(key)
+        if broadcast is None:
+            broadcast = _Broadcast(producer_factory())
+            self._broadcasts[key] = broadcast
+            broadcast.task.add_done_callback(lambda _: self._broadcasts.pop(key, None))
+        else:
+            print(f"🔗 JOINED IN-FLIGHT STREAM: {key} ({len(broadcast.chunks)} chunks buffered)")
+        return broadcast.subscribe()
@@ -1,12 +1,8 @@
-from agent_graph import llm, ChatPromptTemplate
+from typing import AsyncIterator
 
-# Add this to agent_graph.py
+from llm_provider import astream_messages, build_messages
 
-def stream_report(text: str):
-    """
-    Generator for streaming report content.
-    """
-    system_instruction = """You are an expert researcher. Create a comprehensive Deep Research Report based on the provided text.
+REPORT_SYSTEM_INSTRUCTION = """You are an expert researcher. Create a comprehensive Deep Research Report based on the provided text.
     Format the output in beautiful, professional Markdown.
     Structure:
     # Title
@@ -16,18 +12,10 @@ def stream_report(text: str):
     ## Conclusion
     """
 
-    # 2. LangChain/OpenRouter Stream
-    # 2. LangChain/OpenRouter Stream
-    if llm:
-        from langchain_core.messages import SystemMessage
-        messages = [
-            SystemMessage(content=system_instruction),
-            ("user", "TEXT: {text}")
-        ]
-        prompt = ChatPromptTemplate.from_messages(messages)
-        chain = prompt | llm
-        
-        # Stream the output
-        for chunk in chain.stream({"text": text}):
-             content = chunk.content if hasattr(chunk, 'content') else str(chunk)
-             yield content
+async def astream_report(text: str) -> AsyncIterator[str]:
+    """
+    Async generator for streaming report content. Every network read is
+    awaited, so a long report never blocks the event loop for other requests.
+    """
+    async for chunk in astream_messages(build_messages(REPORT_SYSTEM_INSTRUCTION, f"TEXT: {text}")):
+        yield chunk
@@ -0,0 +1,138 @@
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import AsyncIterator, Dict
+
+# --- STREAM METRICS ---
+# Time-to-first-byte and throughput per streaming endpoint, over the most
+# recent requests (GET /streams/stats).
+STREAM_METRICS_WINDOW = 500
+
+def _percentile(values, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class StreamMetrics:
+    def __init__(self, window: int = STREAM_METRICS_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self._samples: Dict[str, deque] = {}
+        self._totals: Dict[str, int] = {}
+
+    def record(self, endpoint: str, ttfb: float, duration: float, tokens: int):
+        with self._lock:
+            self._samples.setdefault(endpoint, deque(maxlen=self._window)).append((ttfb, duration, tokens))
+            self._totals[endpoint] = self._totals.get(endpoint, 0) + 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            samples = {k: list(v) for k, v in self._samples.items()}
+            totals = dict(self._totals)
+        report = {}
+        for endpoint, rows in samples.items():
+            ttfbs = [r[0] for r in rows if r[0] is not None]
+            rates = [r[2] / r[1] for r in rows if r[1] > 0 and r[2]]
+            report[endpoint] = {
+                "streams": totals[endpoint],
+                "ttfb_p50_ms": round(_percentile(ttfbs, 0.5) * 1000, 1) if ttfbs else None,
+                "ttfb_p95_ms": round(_percentile(ttfbs, 0.95) * 1000, 1) if ttfbs else None,
+                "tokens_per_sec_avg": round(sum(rates) / len(rates), 1) if rates else None,
+            }
+        return report
+
+STREAM_METRICS = StreamMetrics()
+
+
+class StreamTimer:
+    """Measures one response: TTFB from request start, and tokens/sec while streaming."""
+
+    def __init__(self, endpoint: str, started: float = None):
+        self.endpoint = endpoint
+        self.started = started or time.perf_counter()
+        self.first_byte = None
+        self.chunks = []
+
+    def sent(self, text: str):
+        if self.first_byte is None and text:
+            self.first_byte = time.perf_counter()
+        self.chunks.append(text)
+
+    async def finish(self) -> Dict:
+        from chunker import count_tokens
+        end = time.perf_counter()
+        # Tokenizing a long answer is CPU work; keep it off the event loop
+        tokens = await asyncio.to_thread(count_tokens, "".join(self.chunks))
+        ttfb = self.first_byte - self.started if self.first_byte else None
+        streaming = end - (self.first_byte or end)
+        STREAM_METRICS.record(self.endpoint, ttfb, streaming, tokens)
+        summary = {
+            "ttfb_ms": round(ttfb * 1000, 1) if ttfb is not None else None,
+            "tokens": tokens,
+            "tokens_per_sec": round(tokens / streaming, 1) if streaming > 0 else None,
+        }
+        print(f"📈 STREAM {self.endpoint}: TTFB {summary['ttfb_ms']}ms, {tokens} tokens, {summary['tokens_per_sec']} tok/s")
+        return summary
+
+# --- FRAMING ---
+
+def sse_event(event: str, data) -> str:
+    """One Server-Sent Events frame; data is JSON so newlines in tokens are safe."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def micro_batch(source: AsyncIterator[str], window: float) -> AsyncIterator[str]:
+    """
+    Re-chunks a token stream so at most one chunk is emitted per window
+    seconds; the first token is never delayed. window <= 0 passes through.
+    """
+    if window <= 0:
+        async for text in source:
+            yield text
+        return
+
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for text in source:
+                await queue.put(text)
+            await queue.put(done)
+        except Exception as e:
+            await queue.put(e)
+
+    task = asyncio.ensure_future(pump())
+    try:
+        loop = asyncio.get_running_loop()
+        buffer, deadline = "", None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                # Window over: flush what arrived, or go idle if nothing did
+                if buffer:
+                    yield buffer
+                    deadline = loop.time() + window
+                else:
+                    deadline = None
+                buffer = ""
+                continue
+            if item is done or isinstance(item, Exception):
+                if buffer:
+                    yield buffer
+                if isinstance(item, Exception):
+                    raise item
+                return
+            if deadline is None and not buffer:
+                # Flush immediately, then collect for one window
+                yield item
+                deadline = loop.time() + window
+            else:
+                buffer += item
+    finally:
+        task.cancel()
@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+# --- TRACING CONFIG ---
+# Spans around the hot paths (extraction, chunking, LLM calls, JSON parsing,
+# TTS, audio merge, Anki packaging). Every span feeds the Prometheus
+# histograms served at GET /metrics; spans are also exported to OpenTelemetry
+# (when an SDK/exporter is configured) and/or appended to TRACE_FILE as JSON lines.
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+OTEL_ENABLED = os.getenv("OTEL_ENABLED", "1") not in ("0", "false", "False")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "flashdeck-backend")
+
+# Histogram buckets (seconds): sub-ms parsing up to multi-minute audio jobs
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _setup_otel():
+    """
+    An OpenTelemetry tracer. With only opentelemetry-api installed this is a
+    no-op; if opentelemetry-sdk and the OTLP exporter are installed and
+    OTEL_EXPORTER_OTLP_ENDPOINT is set, spans are exported to that collector.
+    """
+    if not OTEL_ENABLED:
+        return None
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        return None
+    if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        try:
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+            provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+            trace.set_tracer_provider(provider)
+            print(f"🔭 Exporting traces to {os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT')}")
+        except ImportError as e:
+            print(f"OTLP export unavailable ({e}); install opentelemetry-sdk and opentelemetry-exporter-otlp")
+    return trace.get_tracer("flashdeck")
+
+_tracer = _setup_otel()
+
+# --- METRICS ---
+
+class Histogram:
+    """Prometheus-style cumulative histogram with labels."""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...], buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series: Dict[Tuple, list] = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            idx = bisect.bisect_left(self.buckets, value)
+            if idx < len(self.buckets):
+                series[idx] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for key, values in sorted(series.items()):
+            base = ",".join(f'{label}="{_escape(value)}"' for label, value in zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="+Inf"}} {values[-1]}')
+            lines.append(f"{self.name}_sum{{{base}}} {values[-2]}")
+            lines.append(f"{self.name}_count{{{base}}} {values[-1]}")
+        return "\n".join(lines)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            base = ",".join(f'{label}="{_escape(v)}"' for label, v in zip(self.labels, key))
+            lines.append(f"{self.name}{{{base}}} {value}")
+        return "\n".join(lines)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+SPAN_SECONDS = Histogram(
+    "flashdeck_span_duration_seconds", "Duration of instrumented operations.", ("span", "task_type", "status")
+)
+TASK_SECONDS = Histogram(
+    "flashdeck_task_duration_seconds", "End-to-end generation time per task type.", ("task_type", "cache", "status")
+)
+LLM_TOKENS = Counter(
+    "flashdeck_llm_tokens_total", "LLM tokens by provider, model and direction.", ("provider", "model", "task_type", "kind")
+)
+LLM_REQUESTS = Counter(
+    "flashdeck_llm_requests_total", "LLM requests by provider, model and outcome.", ("provider", "model", "task_type", "status")
+)
+METRICS = (TASK_SECONDS, SPAN_SECONDS, LLM_REQUESTS, LLM_TOKENS)
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in METRICS) + "\n"
+
+# --- SPANS ---
+
+# Spans with this name also feed TASK_SECONDS (one per studio task request)
+TASK_SPAN = "task"
+_CURRENT_SPAN: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+_trace_file_lock = threading.Lock()
+
+
+class Span:
+    """One timed operation. Attributes are mirrored onto the OpenTelemetry span, if any."""
+
+    def __init__(self, name: str, attributes: Dict, parent: Optional["Span"]):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.attributes = {}
+        self.status = "ok"
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self._otel = None
+        if _tracer is not None:
+            from opentelemetry import trace
+            context = trace.set_span_in_context(parent._otel) if parent and parent._otel else None
+            self._otel = _tracer.start_span(name, context=context)
+        self.set(**attributes)
+
+    @property
+    def task_type(self) -> str:
+        span = self
+        while span is not None:
+            if span.attributes.get("task_type"):
+                return span.attributes["task_type"]
+            span = span.parent
+        return ""
+
+    def set(self, **attributes):
+        for key, value in attributes.items():
+            if value is None:
+                continue
+            self.attributes[key] = value
+            if self._otel is not None:
+                self._otel.set_attribute(f"flashdeck.{key}", value if isinstance(value, (str, bool, int, float)) else str(value))
+
+    def fail(self, error: BaseException):
+        self.status = "error"
+        self.set(error=f"{type(error).__name__}: {error}")
+
+    def end(self):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._start
+        SPAN_SECONDS.observe(self.duration, span=self.name, task_type=self.task_type, status=self.status)
+        if self.name == TASK_SPAN:
+            TASK_SECONDS.observe(self.duration, task_type=self.task_type, cache=self.attributes.get("cache", ""), status=self.status)
+        if self._otel is not None:
+            if self.status == "error":
+                from opentelemetry.trace import Status, StatusCode
+                self._otel.set_status(Status(StatusCode.ERROR, self.attributes.get("error")))
+            self._otel.end()
+        if TRACE_FILE:
+            self._export()
+
+    def _export(self):
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "name": self.name,
+            "task_type": self.task_type,
+            "start": self.start_time,
+            "duration_ms": round(self.duration * 1000, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+        try:
+            with _trace_file_lock, open(TRACE_FILE, "a") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+        except OSError as e:
+            print(f"Trace export failed: {e}")
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Times the enclosed block as a child of the current span:
+        with span("llm.call", provider="groq") as s:
+            ...
+            s.set(completion_tokens=n)
+    """
+    record = Span(name, attributes, _CURRENT_SPAN.get())
+    token = _CURRENT_SPAN.set(record)
+    try:
+        yield record
+    except BaseException as e:
+        record.fail(e)
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        record.end()
+
+def start_span(name: str, **attributes) -> Span:
+    """
+    A span that is not made current; call .end() when done. For async
+    generators, whose body may resume in a different context.
+    """
+    return Span(name, attributes, _CURRENT_SPAN.get())
+
+def current_span() -> Optional[Span]:
+    return _CURRENT_SPAN.get()
+
+def record_llm_usage(provider: str, model: str, prompt_tokens: int, completion_tokens: int):
+    """Attaches token usage to the current LLM span and the token counters."""
+    record = current_span()
+    task_type = record.task_type if record else ""
+    if record is not None:
+        record.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    if prompt_tokens:
+        LLM_TOKENS.inc(prompt_tokens, provider=provider, model=model, task_type=task_type, kind="prompt")
+    if completion_tokens:
+        LLM_TOKENS.inc(completion_tokens, provider=provider, model=model, task_type=task_type, kind="completion")
@@ -0,0 +1,200 @@
+import os
+import io
+import asyncio
+import hashlib
+import tempfile
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+
+try:
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    from multipart.exceptions import MultipartParseError
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# --- UPLOAD CONFIG ---
+# /generate reads the multipart body as it arrives: each file is hashed and
+# spooled (memory up to UPLOAD_SPOOL_MB, then a temp file on disk) chunk by
+# chunk, and handed to extraction as soon as its part ends, while later
+# files are still uploading. Limits are enforced as the bytes arrive (413).
+UPLOAD_MAX_FILE_MB = float(os.getenv("UPLOAD_MAX_FILE_MB", "50"))
+UPLOAD_MAX_REQUEST_MB = float(os.getenv("UPLOAD_MAX_REQUEST_MB", "200"))
+UPLOAD_MAX_FILES = int(os.getenv("UPLOAD_MAX_FILES", "20"))
+UPLOAD_SPOOL_MB = float(os.getenv("UPLOAD_SPOOL_MB", "1"))
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR", "") or None  # default: system temp dir
+
+MB = 1024 * 1024
+
+
+def _too_large(detail: str) -> HTTPException:
+    return HTTPException(status_code=413, detail=detail)
+
+
+class SpooledUpload:
+    """
+    One uploaded file: kept in memory while small, moved to a named temp
+    file once it outgrows UPLOAD_SPOOL_MB so extractors can open it by path.
+    """
+
+    def __init__(self, filename: str, max_bytes: int, spool_bytes: int):
+        self.filename = filename
+        self.size = 0
+        self.max_bytes = max_bytes
+        self.spool_bytes = spool_bytes
+        self._sha256 = hashlib.sha256()
+        self._buffer: Optional[io.BytesIO] = io.BytesIO()
+        self._file = None
+        self.path: Optional[str] = None
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise _too_large(f"{self.filename} is larger than {UPLOAD_MAX_FILE_MB:g} MB.")
+        self._sha256.update(data)
+        if self._file is None and self.size > self.spool_bytes:
+            await run_in_threadpool(self._rollover)
+        if self._file is not None:
+            await run_in_threadpool(self._file.write, data)
+        else:
+            self._buffer.write(data)
+
+    def _rollover(self):
+        self._file = tempfile.NamedTemporaryFile(prefix="upload-", suffix=".pdf", dir=UPLOAD_TMP_DIR, delete=False)
+        self.path = self._file.name
+        self._file.write(self._buffer.getvalue())
+        self._buffer = None
+
+    async def finish(self):
+        if self._file is not None:
+            await run_in_threadpool(self._file.close)
+
+    @property
+    def content_hash(self) -> str:
+        """sha256 of the bytes, same as deck_store.file_digest."""
+        return self._sha256.hexdigest()
+
+    def source(self):
+        """What the extractor should open: the temp file's path, or the bytes if still in memory."""
+        return self.path if self.path else self._buffer.getvalue()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self._file = None
+        self._buffer = None
+
+
+async def receive_uploads(
+    request: Request,
+    handle: Callable[[SpooledUpload], Awaitable],
+    field: str = "files",
+) -> List[Tuple[SpooledUpload, "asyncio.Task"]]:
+    """
+    Streams the multipart files in `field` and starts handle(upload) for each
+    one as soon as it is complete. Returns (upload, task) pairs in upload
+    order; each upload is deleted when its task ends. Other fields are ignored.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload.")
+    max_request = int(UPLOAD_MAX_REQUEST_MB * MB)
+    try:
+        declared = int(request.headers.get("content-length", "0"))
+    except ValueError:
+        declared = 0
+    if declared > max_request:
+        raise _too_large(f"Upload is larger than {UPLOAD_MAX_REQUEST_MB:g} MB.")
+
+    # The parser's callbacks are synchronous; they queue events that are
+    # applied (with awaits for disk writes) after each chunk is fed
+    events = []
+    header = {"field": b"", "value": b""}
+    headers = {}
+
+    def on_header_field(data, start, end):
+        header["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+
+    def on_header_end():
+        headers[header["field"].lower()] = header["value"]
+        header.update(field=b"", value=b"")
+
+    def on_headers_finished():
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        events.append(("begin", options))
+        headers.clear()
+
+    def on_part_data(data, start, end):
+        events.append(("data", data[start:end]))
+
+    parser = MultipartParser(boundary, {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": lambda: events.append(("end", None)),
+    })
+
+    async def run(upload: SpooledUpload):
+        try:
+            return await handle(upload)
+        finally:
+            upload.close()
+
+    received: List[Tuple[SpooledUpload, asyncio.Task]] = []
+    current: Optional[SpooledUpload] = None
+    total = 0
+    try:
+        async for chunk in request.stream():
+            total += len(chunk)
+            if total > max_request:
+                raise _too_large(f"Upload is larger than {UPLOAD_MAX_REQUEST_MB:g} MB.")
+            try:
+                parser.write(chunk)
+            except MultipartParseError as e:
+                raise HTTPException(status_code=400, detail=f"Malformed upload: {e}")
+            for kind, value in events:
+                if kind == "begin":
+                    filename = value.get(b"filename")
+                    if value.get(b"name", b"").decode("utf-8", "replace") != field or filename is None:
+                        continue
+                    if len(received) >= UPLOAD_MAX_FILES:
+                        raise _too_large(f"At most {UPLOAD_MAX_FILES} files per upload.")
+                    current = SpooledUpload(
+                        os.path.basename(filename.decode("utf-8", "replace")) or "upload.pdf",
+                        int(UPLOAD_MAX_FILE_MB * MB), int(UPLOAD_SPOOL_MB * MB)
+                    )
+                elif kind == "data" and current is not None:
+                    await current.write(value)
+                elif kind == "end" and current is not None:
+                    await current.finish()
+                    # Extraction of this file overlaps the upload of the next
+                    received.append((current, asyncio.ensure_future(run(current))))
+                    current = None
+            events.clear()
+        if current is not None:
+            raise HTTPException(status_code=400, detail=f"Upload ended before {current.filename} was complete.")
+        parser.finalize()
+    except BaseException as e:
+        if current is not None:
+            current.close()
+        for upload, task in received:
+            # A task cancelled before it started never runs its cleanup
+            task.cancel()
+            upload.close()
+        if isinstance(e, ClientDisconnect):
+            print(f"Upload aborted by client after {total} bytes")
+        raise
+    return received